@@ -1,6 +1,7 @@
+import asyncio
 from abc import ABC, abstractmethod
 from core.shared_state import SharedState
-from config.llm_config import get_config_for_agent
+from config.llm_config import get_config_for_agent, apply_agent_policies
 
 class BaseAgent(ABC):
     """
@@ -8,7 +9,8 @@ class BaseAgent(ABC):
     """
     def __init__(self, role_name: str, llm_config=None):
         self.role_name = role_name
-        self.llm_config = llm_config if llm_config else get_config_for_agent(role_name)
+        # 前端切换模型时沿用该角色的缓存 / 故障转移设置
+        self.llm_config = apply_agent_policies(role_name, llm_config) if llm_config else get_config_for_agent(role_name)
 
     @abstractmethod
     def run(self, shared_state: SharedState, stream_callback: callable = None):
@@ -19,3 +21,10 @@ class BaseAgent(ABC):
         :return: Agent 的输出结果 (str 或 dict)
         """
         pass
+
+    async def arun(self, shared_state: SharedState, stream_callback: callable = None, **kwargs):
+        """
+        执行 Agent 逻辑 (异步版本)
+        子类应基于 async_llm_client 覆盖该方法；默认回退为在线程中执行同步的 run。
+        """
+        return await asyncio.to_thread(self.run, shared_state, stream_callback=stream_callback, **kwargs)
@@ -1,61 +1,80 @@
 import json
+from typing import Optional
 from agents.base import BaseAgent
 from core.shared_state import SharedState
-from llm.client import llm_client
+from llm.client import llm_client, async_llm_client
+from llm.json_stream import IncrementalJSONParser, JSONStreamError, JSONStreamWatcher
 from agents.case_organizer.prompts.intake import ROLE_DEFINITION
-from agents.case_organizer.prompts.structuring import STRUCTURING_INSTRUCTION, UPDATING_INSTRUCTION
+from agents.case_organizer.prompts.structuring import STRUCTURING_INSTRUCTION, UPDATING_INSTRUCTION, PATCHING_INSTRUCTION
+from agents.case_organizer.patch import CasePatchError, validate_patch, validate_answers, apply_patch, derive_new_evidence
+from config.settings import settings
 
 class CaseOrganizerAgent(BaseAgent):
     def __init__(self, llm_config=None):
         super().__init__(role_name="Case Organizer", llm_config=llm_config)
+        # 最近一次 run 失败的原因 (LLM 调用失败、输出格式错误)，成功时为 None；节点据此报告 error 状态
+        self.last_error: Optional[str] = None
 
-    def run(self, shared_state: SharedState, stream_callback: callable = None) -> str:
-        """
-        病例整理逻辑：
-        1. 读取 raw_case_text (最新输入)
-        2. 判断是初次整理还是增量更新
-        3. 调用 LLM 进行结构化提取/更新
-        4. 更新 shared_state.structured_info
-        """
-        raw_text = shared_state.raw_case_text
-        if not raw_text:
-            return "未提供病例信息。"
+    def _fail(self, message: str) -> str:
+        """记录失败原因，返回展示给用户的错误文本"""
+        self.last_error = message
+        return message
 
-        # 判断是否已有结构化信息
+    def _use_patch_mode(self, shared_state: SharedState) -> bool:
+        """后续轮次且开启 settings.organizer_patch_mode 时，只让模型输出变化字段的补丁"""
+        return bool(shared_state.structured_info) and settings.organizer_patch_mode
+
+    def _build_messages(self, shared_state: SharedState, patch_mode: bool = False) -> list:
+        """根据是否已有结构化信息，构造初次整理或增量更新 (完整 / 补丁) 的 Prompt"""
+        raw_text = shared_state.raw_case_text
         existing_info = shared_state.structured_info
-        
+
         if not existing_info:
             # 初次整理
             content = f"【原始病历】\n{raw_text}\n\n{STRUCTURING_INSTRUCTION}"
         else:
             # 增量更新
             existing_json = json.dumps(existing_info, ensure_ascii=False, indent=2)
-            content = f"【已有结构化病例信息】\n{existing_json}\n\n【用户最新输入】\n{raw_text}\n\n{UPDATING_INSTRUCTION}"
+            instruction = PATCHING_INSTRUCTION if patch_mode else UPDATING_INSTRUCTION
+            content = f"【已有结构化病例信息】\n{existing_json}\n\n【用户最新输入】\n{raw_text}\n\n{instruction}"
 
-        # 构造 Prompt
-        messages = [
+        return [
             {"role": "system", "content": ROLE_DEFINITION},
             {"role": "user", "content": content}
         ]
 
-        # 调用 LLM (强制 JSON 模式)
+    @staticmethod
+    def _parse_json(response: str):
+        # 有些模型可能返回 Markdown 代码块，需要清洗
+        cleaned_response = response.replace("```json", "").replace("```", "").strip()
+        return json.loads(cleaned_response)
+
+    def _apply_patch_response(self, shared_state: SharedState, response: str, existing_info: dict) -> str:
+        """
+        解析补丁模式的输出：校验并在本地应用补丁，new_evidence 由补丁前后的字段变化推导。
+        补丁不合法时抛出 CasePatchError，由调用方改用完整更新。
+        """
+        try:
+            parsed_data = self._parse_json(response)
+        except json.JSONDecodeError as e:
+            raise CasePatchError(f"invalid JSON: {e}")
+        if not isinstance(parsed_data, dict) or "patch" not in parsed_data:
+            # 模型没有按补丁格式输出 (例如直接给出了 updated_case)，按完整更新处理
+            return self._apply_response(shared_state, response, existing_info)
+
+        ops = validate_patch(parsed_data["patch"])
+        answers = validate_answers(parsed_data.get("answers_to_team_questions"))
+        updated_info = apply_patch(existing_info, ops)
+        shared_state.structured_info = updated_info
+        shared_state.new_evidence = derive_new_evidence(existing_info, updated_info, answers)
+        return response
+
+    def _apply_response(self, shared_state: SharedState, response: str, existing_info: dict) -> str:
+        """解析模型输出并写回 shared_state.structured_info / new_evidence"""
         try:
-            # 如果有回调，开启流式输出
-            stream = True if stream_callback else False
-            
-            response = llm_client.get_completion(
-                messages=messages,
-                json_mode=True,
-                stream=stream,
-                stream_callback=stream_callback,
-                config=self.llm_config
-            )
-            
             # 解析 JSON
-            # 有些模型可能返回 Markdown 代码块，需要清洗
-            cleaned_response = response.replace("```json", "").replace("```", "").strip()
-            parsed_data = json.loads(cleaned_response)
-            
+            parsed_data = self._parse_json(response)
+
             if not existing_info:
                 # 初次整理：直接是 structured_info
                 shared_state.structured_info = parsed_data
@@ -74,6 +93,131 @@ class CaseOrganizerAgent(BaseAgent):
             return response
 
         except json.JSONDecodeError:
-            return f"病例整理失败：模型返回格式错误。\n原始返回: {response}"
+            return self._fail(self._format_error_result(response))
+        except Exception as e:
+            return self._fail(f"病例整理过程中发生错误: {str(e)}")
+
+    def _on_patch_rejected(self, error: Exception, stream_callback: callable = None):
+        """补丁不合法：清空已流式输出的补丁文本，随后改用完整更新重新生成"""
+        print(f"[Case Organizer] Rejected patch ({error}), falling back to full update")
+        reset = getattr(stream_callback, "reset", None)
+        if reset:
+            reset()
+
+    def _watch_stream(self, stream_callback: callable, existing_info: dict, patch_mode: bool, partial_callback: callable = None):
+        """
+        为流式输出套上增量 JSON 解析 (llm.json_stream)：输出格式一旦出错立即结束调用；
+        完整模式下每个病例字段生成完毕即以 partial_callback(部分 structured_info) 通知下游。
+        未开启流式输出时返回 None。
+        """
+        if not stream_callback:
+            return None
+        partial = dict(existing_info or {})
+
+        def on_member(path, value):
+            if patch_mode or not partial_callback:
+                return
+            # 初次整理的字段在根对象上，完整更新的字段在 updated_case 下
+            if existing_info and not (len(path) == 2 and path[0] == "updated_case"):
+                return
+            if not existing_info and len(path) != 1:
+                return
+            partial[path[-1]] = value
+            partial_callback(dict(partial))
+
+        return JSONStreamWatcher(stream_callback, IncrementalJSONParser(on_member))
+
+    @staticmethod
+    def _format_error_result(response: str) -> str:
+        return f"病例整理失败：模型返回格式错误。\n原始返回: {response}"
+
+    def run(self, shared_state: SharedState, stream_callback: callable = None, partial_callback: callable = None) -> str:
+        """
+        病例整理逻辑：
+        1. 读取 raw_case_text (最新输入)
+        2. 判断是初次整理还是增量更新
+        3. 调用 LLM 进行结构化提取/更新
+        4. 更新 shared_state.structured_info
+        :param partial_callback: 流式生成过程中，每完成一个病例字段即以当前已知的 structured_info 调用一次
+        """
+        self.last_error = None
+        if not shared_state.raw_case_text:
+            return "未提供病例信息。"
+
+        existing_info = shared_state.structured_info
+        patch_mode = self._use_patch_mode(shared_state)
+
+        # 调用 LLM (强制 JSON 模式)
+        try:
+            if patch_mode:
+                try:
+                    response = llm_client.get_completion(
+                        messages=self._build_messages(shared_state, patch_mode=True),
+                        json_mode=True,
+                        stream=bool(stream_callback),
+                        stream_callback=self._watch_stream(stream_callback, existing_info, True),
+                        config=self.llm_config
+                    )
+                    return self._apply_patch_response(shared_state, response, existing_info)
+                except (CasePatchError, JSONStreamError) as e:
+                    self._on_patch_rejected(e, stream_callback)
+
+            # 如果有回调，开启流式输出
+            response = llm_client.get_completion(
+                messages=self._build_messages(shared_state),
+                json_mode=True,
+                stream=bool(stream_callback),
+                stream_callback=self._watch_stream(stream_callback, existing_info, False, partial_callback),
+                config=self.llm_config
+            )
+        except JSONStreamError as e:
+            print(f"[Case Organizer] Aborted malformed output early: {e}")
+            return self._fail(self._format_error_result(e.text))
+        except InterruptedError:
+            raise
         except Exception as e:
-            return f"病例整理过程中发生错误: {str(e)}"
+            return self._fail(f"病例整理过程中发生错误: {str(e)}")
+
+        return self._apply_response(shared_state, response, existing_info)
+
+    async def arun(self, shared_state: SharedState, stream_callback: callable = None, partial_callback: callable = None) -> str:
+        """
+        病例整理逻辑 (异步版本)
+        """
+        self.last_error = None
+        if not shared_state.raw_case_text:
+            return "未提供病例信息。"
+
+        existing_info = shared_state.structured_info
+        patch_mode = self._use_patch_mode(shared_state)
+
+        try:
+            if patch_mode:
+                try:
+                    response = await async_llm_client.get_completion(
+                        messages=self._build_messages(shared_state, patch_mode=True),
+                        json_mode=True,
+                        stream=bool(stream_callback),
+                        stream_callback=self._watch_stream(stream_callback, existing_info, True),
+                        config=self.llm_config
+                    )
+                    return self._apply_patch_response(shared_state, response, existing_info)
+                except (CasePatchError, JSONStreamError) as e:
+                    self._on_patch_rejected(e, stream_callback)
+
+            response = await async_llm_client.get_completion(
+                messages=self._build_messages(shared_state),
+                json_mode=True,
+                stream=bool(stream_callback),
+                stream_callback=self._watch_stream(stream_callback, existing_info, False, partial_callback),
+                config=self.llm_config
+            )
+        except JSONStreamError as e:
+            print(f"[Case Organizer] Aborted malformed output early: {e}")
+            return self._fail(self._format_error_result(e.text))
+        except InterruptedError:
+            raise
+        except Exception as e:
+            return self._fail(f"病例整理过程中发生错误: {str(e)}")
+
+        return self._apply_response(shared_state, response, existing_info)
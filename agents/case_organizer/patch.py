@@ -0,0 +1,88 @@
+from typing import Dict, List
+
+from agents.case_organizer.prompts.structuring import CASE_FIELDS
+
+# 补丁模式允许的操作 (结构化病例只有一层字符串字段，不需要 remove / move / copy)
+ALLOWED_OPS = {"add", "replace"}
+
+# 字段变化 -> new_evidence 类别 (与 UPDATING_INSTRUCTION 中的类别一致)
+EVIDENCE_CATEGORIES = {
+    "lab_results": "new_lab_results",
+    "symptoms": "new_symptoms_info",
+    "signs": "new_symptoms_info",
+    "basic_info": "new_symptoms_info",
+    "diagnosis_history": "new_symptoms_info",
+    "imaging": "new_imaging_info",
+    "pathology": "new_pathology_info",
+    # 核心问题被修改通常意味着用户回答了团队的提问；模型未单独给出回答时以此代替
+    "key_questions": "answers_to_team_questions",
+}
+EVIDENCE_KEYS = ["new_lab_results", "new_symptoms_info", "new_imaging_info", "new_pathology_info", "answers_to_team_questions"]
+
+MISSING_VALUES = {"", "未提及", "无"}
+
+class CasePatchError(ValueError):
+    """模型输出的补丁不合法 (调用方应改用完整更新)"""
+
+def validate_patch(patch) -> List[Dict[str, str]]:
+    """校验补丁操作列表，返回规范化后的操作；不合法时抛出 CasePatchError"""
+    if not isinstance(patch, list):
+        raise CasePatchError(f"patch must be a list, got {type(patch).__name__}")
+    ops = []
+    for i, op in enumerate(patch):
+        if not isinstance(op, dict):
+            raise CasePatchError(f"op #{i} is not an object")
+        if op.get("op") not in ALLOWED_OPS:
+            raise CasePatchError(f"op #{i}: unsupported op {op.get('op')!r}")
+        path = op.get("path")
+        if not isinstance(path, str) or not path.startswith("/") or path.count("/") != 1:
+            raise CasePatchError(f"op #{i}: path must be a top-level field, got {path!r}")
+        field = path[1:]
+        if field not in CASE_FIELDS:
+            raise CasePatchError(f"op #{i}: unknown field {field!r}")
+        if not isinstance(op.get("value"), str):
+            raise CasePatchError(f"op #{i}: value must be a string")
+        ops.append({"op": op["op"], "field": field, "value": op["value"]})
+    return ops
+
+def validate_answers(answers) -> List[str]:
+    """校验补丁输出中的 answers_to_team_questions (可省略)，返回去掉空项后的列表；不合法时抛出 CasePatchError"""
+    if answers is None:
+        return []
+    if not isinstance(answers, list) or not all(isinstance(answer, str) for answer in answers):
+        raise CasePatchError("answers_to_team_questions must be a list of strings")
+    return [answer.strip() for answer in answers if answer.strip() not in MISSING_VALUES]
+
+def apply_patch(structured_info: Dict[str, str], ops: List[Dict[str, str]]) -> Dict[str, str]:
+    """把已校验的操作应用到结构化病例上，返回新的 dict (不修改原对象)"""
+    updated = dict(structured_info)
+    for op in ops:
+        updated[op["field"]] = op["value"]
+    return updated
+
+def _added_text(old: str, new: str) -> str:
+    """字段新值中新增的部分：在原内容后追加时只取追加部分，否则取整个新值"""
+    old = (old or "").strip()
+    new = new.strip()
+    if old and old not in MISSING_VALUES and new.startswith(old):
+        return new[len(old):].strip(" ，,；;。\n")
+    return new
+
+def derive_new_evidence(old_info: Dict[str, str], new_info: Dict[str, str], answers: List[str] = None) -> Dict[str, List[str]]:
+    """
+    根据补丁前后字段的变化推导本轮新证据 (各类别均返回列表，没有则为空列表)
+    :param answers: 模型给出的对团队提问的回答 (validate_answers 的结果)，非空时优先于 key_questions 的变化
+    """
+    evidence = {key: [] for key in EVIDENCE_KEYS}
+    if answers:
+        evidence["answers_to_team_questions"] = list(answers)
+    for field, category in EVIDENCE_CATEGORIES.items():
+        if answers and category == "answers_to_team_questions":
+            continue
+        new = new_info.get(field, "")
+        if new == old_info.get(field, "") or new.strip() in MISSING_VALUES:
+            continue
+        added = _added_text(old_info.get(field, ""), new)
+        if added:
+            evidence[category].append(added)
+    return evidence
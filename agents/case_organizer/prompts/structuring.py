@@ -58,3 +58,31 @@ UPDATING_INSTRUCTION = """
 
 注意：直接返回 JSON 字符串，不要包含 Markdown 代码块标记。
 """
+
+# 结构化病例的字段 (与 STRUCTURING_INSTRUCTION 一致)
+CASE_FIELDS = ["basic_info", "symptoms", "signs", "lab_results", "imaging", "pathology", "diagnosis_history", "key_questions"]
+
+# 增量更新指令 (补丁模式)：只输出变化的字段
+PATCHING_INSTRUCTION = """
+你是一个专业的医疗病例整理员。
+你的任务是根据【用户最新输入】，以补丁 (JSON Patch, RFC 6902 风格) 的形式更新已有的【结构化病例信息】。
+只输出需要变化的字段，未变化的字段不要输出。
+
+请输出如下 JSON 对象：
+{
+    "patch": [
+        {"op": "replace", "path": "/lab_results", "value": "该字段更新后的完整内容"}
+    ],
+    "answers_to_team_questions": ["..."]
+}
+
+请遵循以下原则：
+1. `path` 只能是顶层字段：/basic_info, /symptoms, /signs, /lab_results, /imaging, /pathology, /diagnosis_history, /key_questions。
+2. `op` 只能是 "replace" (修改已有字段) 或 "add" (新增字段)。
+3. `value` 必须是该字段更新后的**完整**字符串：在原有内容基础上追加或修改，未被新输入否定的原有信息要保留。
+4. 如果新输入与旧信息冲突，以【用户最新输入】为准。
+5. 如果用户输入中没有新的病例信息 (例如只是提问)，返回 {"patch": [], "answers_to_team_questions": []}。
+6. `answers_to_team_questions`：用户本次输入中对专家团队此前提问的回答，逐条摘录；没有则返回空列表 []。已被回答的问题应同时从 /key_questions 中更新。
+
+注意：直接返回 JSON 字符串，不要包含 Markdown 代码块标记。
+"""
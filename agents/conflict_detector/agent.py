@@ -1,71 +1,100 @@
 from agents.base import BaseAgent
 from core.shared_state import SharedState
 from agents.conflict_detector.prompts.detection import ROLE_DEFINITION, DETECTION_INSTRUCTION
-from llm.client import llm_client
+from llm.client import llm_client, async_llm_client
 import json
 
 class ConflictDetectorAgent(BaseAgent):
     def __init__(self, llm_config=None):
         super().__init__(role_name="Conflict Detector", llm_config=llm_config)
+        # 最近一次检测失败的原因 (成功时为 None)：失败时返回空列表，节点据此报告 error 状态而不是"意见一致"
+        self.last_error = None
+
+    def _build_messages(self, summaries: dict) -> list:
+        """构造冲突检测 Prompt"""
+        summaries_str = "\n\n".join([f"【{role}】\n{summary}" for role, summary in summaries.items()])
+
+        content = f"""【各专科医生意见总结】
+{summaries_str}
+
+{DETECTION_INSTRUCTION}"""
+
+        return [
+            {"role": "system", "content": ROLE_DEFINITION},
+            {"role": "user", "content": content}
+        ]
+
+    def _parse_conflicts(self, response: str) -> list:
+        """清洗和解析模型输出的冲突列表"""
+        cleaned_response = response.replace("```json", "").replace("```", "").strip()
+        parsed_data = json.loads(cleaned_response)
+
+        if isinstance(parsed_data, dict):
+            if "conflicts" in parsed_data:
+                return parsed_data["conflicts"]
+            if "items" in parsed_data:
+                return parsed_data["items"]
+            # 尝试作为单个对象处理，或者返回空
+            print(f"Warning: Conflict Detector returned unexpected dict format: {parsed_data.keys()}")
+            return []
+        if isinstance(parsed_data, list):
+            return parsed_data
+        return []
 
     def run(self, shared_state: SharedState, stream_callback: callable = None):
         """
         冲突检测逻辑
         """
         # 1. 获取各专科意见
+        self.last_error = None
         summaries = shared_state.specialist_summaries
-        
+
         # 如果只有一个或没有专家发言，自然没有冲突
         if len(summaries) < 2:
             return []
 
-        # 2. 构造 Prompt
-        summaries_str = "\n\n".join([f"【{role}】\n{summary}" for role, summary in summaries.items()])
-        
-        content = f"""【各专科医生意见总结】
-{summaries_str}
-
-{DETECTION_INSTRUCTION}"""
-
-        messages = [
-            {"role": "system", "content": ROLE_DEFINITION},
-            {"role": "user", "content": content}
-        ]
-        
-        # 3. 调用 LLM
+        # 2. 调用 LLM
         try:
             # 冲突检测通常不需要流式展示给用户看过程，只需要结果
             # 但为了保持一致性，如果传了 stream_callback 也可以用
-            stream = True if stream_callback else False
-            
             response = llm_client.get_completion(
-                messages=messages,
+                messages=self._build_messages(summaries),
                 json_mode=True, # 强制 JSON
-                stream=stream,
+                stream=bool(stream_callback),
+                stream_callback=stream_callback,
+                config=self.llm_config
+            )
+            return self._parse_conflicts(response)
+
+        except InterruptedError:
+            raise
+        except Exception as e:
+            print(f"冲突检测出错: {e}")
+            self.last_error = str(e)
+            return []
+
+    async def arun(self, shared_state: SharedState, stream_callback: callable = None):
+        """
+        冲突检测逻辑 (异步版本)
+        """
+        self.last_error = None
+        summaries = shared_state.specialist_summaries
+        if len(summaries) < 2:
+            return []
+
+        try:
+            response = await async_llm_client.get_completion(
+                messages=self._build_messages(summaries),
+                json_mode=True,
+                stream=bool(stream_callback),
                 stream_callback=stream_callback,
                 config=self.llm_config
             )
-            
-            # 清洗和解析
-            cleaned_response = response.replace("```json", "").replace("```", "").strip()
-            parsed_data = json.loads(cleaned_response)
-            
-            if isinstance(parsed_data, dict):
-                if "conflicts" in parsed_data:
-                    conflicts = parsed_data["conflicts"]
-                elif "items" in parsed_data:
-                    conflicts = parsed_data["items"]
-                else:
-                    # 尝试作为单个对象处理，或者返回空
-                    print(f"Warning: Conflict Detector returned unexpected dict format: {parsed_data.keys()}")
-                    conflicts = []
-            elif isinstance(parsed_data, list):
-                conflicts = parsed_data
-            else:
-                conflicts = []
-            
-            return conflicts
-            
+            return self._parse_conflicts(response)
+
+        except InterruptedError:
+            raise
         except Exception as e:
             print(f"冲突检测出错: {e}")
+            self.last_error = str(e)
             return []
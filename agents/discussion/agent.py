@@ -1,39 +1,71 @@
 from agents.base import BaseAgent
 from core.shared_state import SharedState
 from agents.discussion.prompts import DISCUSSION_SYSTEM_PROMPT, DISCUSSION_USER_PROMPT_TEMPLATE
-from llm.client import llm_client
+from llm.client import llm_client, async_llm_client
 import json
 
 class DiscussionAgent(BaseAgent):
     def __init__(self, llm_config=None):
         super().__init__(role_name="Team Discussion", llm_config=llm_config)
+        # 最近一次讨论失败的原因 (成功时为 None)：失败时返回空纪要，节点据此报告 error 状态
+        self.last_error = None
 
-    def run(self, shared_state: SharedState, stream_callback: callable = None):
-        """
-        执行讨论逻辑
-        """
-        # 准备输入数据
+    def _build_messages(self, shared_state: SharedState) -> list:
+        """准备讨论 Prompt"""
         case_text = shared_state.raw_case_text
         specialist_opinions = json.dumps(shared_state.specialist_opinions, ensure_ascii=False, indent=2)
         conflicts = json.dumps(shared_state.conflicts, ensure_ascii=False, indent=2)
-        
+
         content = DISCUSSION_USER_PROMPT_TEMPLATE.format(
             case_text=case_text,
             specialist_opinions=specialist_opinions,
             conflicts=conflicts
         )
 
-        messages = [
+        return [
             {"role": "system", "content": DISCUSSION_SYSTEM_PROMPT},
             {"role": "user", "content": content}
         ]
-        
+
+    def run(self, shared_state: SharedState, stream_callback: callable = None):
+        """
+        执行讨论逻辑
+        """
+        self.last_error = None
         # 调用 LLM
-        response = llm_client.get_completion(
-            messages=messages,
-            stream=True, # 启用流式
-            stream_callback=stream_callback,
-            config=self.llm_config
-        )
-        
+        try:
+            response = llm_client.get_completion(
+                messages=self._build_messages(shared_state),
+                stream=True, # 启用流式
+                stream_callback=stream_callback,
+                config=self.llm_config
+            )
+        except InterruptedError:
+            raise
+        except Exception as e:
+            print(f"团队讨论出错: {e}")
+            self.last_error = str(e)
+            return ""
+
+        return response
+
+    async def arun(self, shared_state: SharedState, stream_callback: callable = None):
+        """
+        执行讨论逻辑 (异步版本)
+        """
+        self.last_error = None
+        try:
+            response = await async_llm_client.get_completion(
+                messages=self._build_messages(shared_state),
+                stream=True,
+                stream_callback=stream_callback,
+                config=self.llm_config
+            )
+        except InterruptedError:
+            raise
+        except Exception as e:
+            print(f"团队讨论出错: {e}")
+            self.last_error = str(e)
+            return ""
+
         return response
@@ -1,25 +1,49 @@
 from agents.base import BaseAgent
+from agents.specialist import ERROR_SUMMARY
 from core.shared_state import SharedState
 from agents.moderator.prompts.analysis import ROLE_DEFINITION, ANALYSIS_INSTRUCTION, REPLY_INSTRUCTION
 from agents.moderator.prompts.routing import ROUTING_ROLE_DEFINITION, ROUTING_INSTRUCTION
-from llm.client import llm_client
+from agents.moderator.routing import RoutingDecision, rule_router
+from config.settings import settings
+from core.history import history_builder
+from llm.client import llm_client, async_llm_client
 import json
 
 class ModeratorAgent(BaseAgent):
     def __init__(self, llm_config=None):
         super().__init__(role_name="Moderator", llm_config=llm_config)
+        # 最近一次 plan 的路由结果 (规则 / LLM)，供节点记录日志
+        self.last_routing: RoutingDecision = None
 
-    def plan(self, shared_state: SharedState):
-        """
-        路由逻辑：根据病例信息决定调用哪些专家
-        """
+    def _route_by_rules(self, shared_state: SharedState):
+        """规则路由：置信度足够时返回结果，否则返回 None 并在 last_routing 中记录原因"""
+        if not settings.rule_router_enabled:
+            self.last_routing = None
+            return None
+        decision = rule_router.route(shared_state)
+        self.last_routing = decision
+        if decision.confidence >= settings.rule_router_min_confidence:
+            return decision.agents
+        return None
+
+    def _record_llm_routing(self, selected_agents: list):
+        rule_decision = self.last_routing
+        self.last_routing = RoutingDecision(
+            agents=selected_agents,
+            confidence=rule_decision.confidence if rule_decision else 0.0,
+            reasons=rule_decision.reasons if rule_decision else [],
+            path="llm"
+        )
+
+    def _build_routing_messages(self, shared_state: SharedState) -> list:
+        """构造路由 (规划) Prompt"""
         structured_info = shared_state.structured_info
         new_evidence = shared_state.new_evidence
         round_count = shared_state.round_count
-        
+
         case_str = json.dumps(structured_info, ensure_ascii=False, indent=2)
         new_evidence_str = json.dumps(new_evidence, ensure_ascii=False, indent=2) if new_evidence else "无"
-        
+
         context_str = ""
         if round_count > 1:
              context_str = f"""
@@ -39,18 +63,14 @@ class ModeratorAgent(BaseAgent):
 
 {ROUTING_INSTRUCTION}"""
 
-        messages = [
+        return [
             {"role": "system", "content": ROUTING_ROLE_DEFINITION},
             {"role": "user", "content": content}
         ]
-        
+
+    def _parse_routing_response(self, response: str) -> list:
+        """解析路由输出的 JSON 列表，失败时回退到 Pulmonologist"""
         try:
-            response = llm_client.get_completion(
-                messages=messages,
-                stream=False,
-                config=self.llm_config
-            )
-            
             # 清理 markdown 代码块标记 (如果 LLM 输出了 ```json ... ```)
             cleaned_response = response.strip()
             if cleaned_response.startswith("```"):
@@ -58,52 +78,108 @@ class ModeratorAgent(BaseAgent):
                 first_newline = cleaned_response.find("\n")
                 if first_newline != -1:
                     cleaned_response = cleaned_response[first_newline+1:]
-                
+
                 # 去掉结尾的 ```
                 if cleaned_response.endswith("```"):
                     cleaned_response = cleaned_response[:-3]
-            
+
             selected_agents = json.loads(cleaned_response)
-            
+
             # 验证输出是否为列表
             if not isinstance(selected_agents, list):
                 print(f"Warning: Router output is not a list: {selected_agents}")
                 return ["Pulmonologist"] # Fallback
-                
+
             return selected_agents
-            
+
         except Exception as e:
             print(f"Error in Moderator planning: {e}")
             return ["Pulmonologist"] # Fallback
 
-    def run(self, shared_state: SharedState, stream_callback: callable = None, summary_stream_callback: callable = None):
+    def plan(self, shared_state: SharedState, before_llm: callable = None):
         """
-        主持专家逻辑：
-        1. 综合各方意见，生成专业总结 (Internal Summary) - 支持流式输出 (summary_stream_callback)
-        2. 基于总结，生成患者回复 (Patient Reply) - 支持流式输出 (stream_callback)
+        路由逻辑：根据病例信息决定调用哪些专家
+        先用规则路由 (见 agents/moderator/routing.py)，置信度不足时才调用 LLM。
+        :param before_llm: 需要调用 LLM 路由时，在调用前执行的回调 (例如启动投机执行)
+        """
+        selected_agents = self._route_by_rules(shared_state)
+        if selected_agents is not None:
+            return selected_agents
+        if before_llm:
+            before_llm()
+        selected_agents = self._plan_with_llm(shared_state)
+        self._record_llm_routing(selected_agents)
+        return selected_agents
+
+    def _plan_with_llm(self, shared_state: SharedState):
+        messages = self._build_routing_messages(shared_state)
+
+        try:
+            # 路由结果只取决于病例内容，相同输入直接复用缓存
+            response = llm_client.get_completion(
+                messages=messages,
+                stream=False,
+                config=self.llm_config,
+                use_cache=True
+            )
+        except InterruptedError:
+            raise
+        except Exception as e:
+            print(f"Error in Moderator planning: {e}")
+            return ["Pulmonologist"] # Fallback
+        return self._parse_routing_response(response)
+
+    async def aplan(self, shared_state: SharedState, before_llm: callable = None):
+        """
+        路由逻辑 (异步版本)
+        """
+        selected_agents = self._route_by_rules(shared_state)
+        if selected_agents is not None:
+            return selected_agents
+        if before_llm:
+            before_llm()
+        selected_agents = await self._aplan_with_llm(shared_state)
+        self._record_llm_routing(selected_agents)
+        return selected_agents
+
+    async def _aplan_with_llm(self, shared_state: SharedState):
+        messages = self._build_routing_messages(shared_state)
+
+        try:
+            response = await async_llm_client.get_completion(
+                messages=messages,
+                stream=False,
+                config=self.llm_config,
+                use_cache=True
+            )
+        except InterruptedError:
+            raise
+        except Exception as e:
+            print(f"Error in Moderator planning: {e}")
+            return ["Pulmonologist"] # Fallback
+        return self._parse_routing_response(response)
+
+    @staticmethod
+    def _format_dialogue(msg: dict):
+        """医患对话历史只保留基层医生与 MDT 专家 (Moderator) 的消息"""
+        if msg["role"] == "user":
+            return f"基层医生: {msg['content']}"
+        if msg["role"] == "Moderator":
+            return f"MDT专家: {msg['content']}"
+        return None
+
+    def _build_summary_messages(self, shared_state: SharedState, history_str: str) -> list:
+        """
+        构造专业总结 Prompt
+        :param history_str: 往期讨论历史 (由 history_builder 按 Moderator 的 Token 预算生成)
         """
-        # 1. 获取上下文
         structured_info = shared_state.structured_info
         specialist_opinions = shared_state.specialist_opinions
-        chat_history = shared_state.chat_history
         discussion_notes = shared_state.discussion_notes
-        
+
         case_str = json.dumps(structured_info, ensure_ascii=False, indent=2)
         opinions_str = "\n".join([f"【{role}】\n{opinion}" for role, opinion in specialist_opinions.items()])
-        
-        # 格式化对话历史
-        history_str = ""
-        if chat_history:
-            history_list = []
-            for msg in chat_history:
-                role = msg["role"]
-                content = msg["content"]
-                history_list.append(f"【{role}】: {content}")
-            history_str = "\n".join(history_list)
-        else:
-            history_str = "无往期讨论记录。"
 
-        # 2. 生成专业总结 (非流式，用于内部记录和展示在结论栏)
         summary_content = f"""【结构化病例信息】
 {case_str}
 
@@ -118,57 +194,86 @@ class ModeratorAgent(BaseAgent):
 
 {ANALYSIS_INSTRUCTION}"""
 
-        summary_messages = [
+        return [
             {"role": "system", "content": ROLE_DEFINITION},
             {"role": "user", "content": summary_content}
         ]
-        
+
+    def _build_reply_messages(self, medical_summary: str, dialogue_context: str) -> list:
+        """
+        构造患者回复 Prompt
+        :param dialogue_context: 医患对话历史 (chat_history 中的 User 和 Moderator 消息)，以便 Moderator 能够回答追问
+        """
+        reply_content = f"""【MDT 专业总结】
+{medical_summary}
+
+【医患对话历史】
+{dialogue_context}
+
+{REPLY_INSTRUCTION}"""
+
+        return [
+            {"role": "system", "content": ROLE_DEFINITION},
+            {"role": "user", "content": reply_content}
+        ]
+
+    def run(self, shared_state: SharedState, stream_callback: callable = None, summary_stream_callback: callable = None):
+        """
+        主持专家逻辑：
+        1. 综合各方意见，生成专业总结 (Internal Summary) - 支持流式输出 (summary_stream_callback)
+        2. 基于总结，生成患者回复 (Patient Reply) - 支持流式输出 (stream_callback)
+        """
         try:
             # 第一步：生成专业总结
             # 如果提供了 summary_stream_callback，则开启流式
-            summary_stream = True if summary_stream_callback else False
-            
+            history_str = history_builder.build_for(self.role_name, shared_state.chat_history)
             medical_summary = llm_client.get_completion(
-                messages=summary_messages,
-                stream=summary_stream,
+                messages=self._build_summary_messages(shared_state, history_str),
+                stream=bool(summary_stream_callback),
                 stream_callback=summary_stream_callback,
                 config=self.llm_config
             )
-            
-            # 3. 生成患者回复 (流式，用于对话框)
-            # 构造对话历史上下文，以便 Moderator 能够回答追问
-            # 提取 chat_history 中的 User 和 Moderator 消息
-            dialogue_history = []
-            for msg in shared_state.chat_history:
-                if msg["role"] == "user":
-                    dialogue_history.append(f"基层医生: {msg['content']}")
-                elif msg["role"] == "Moderator":
-                    dialogue_history.append(f"MDT专家: {msg['content']}")
-            
-            dialogue_context = "\n".join(dialogue_history)
-            
-            reply_content = f"""【MDT 专业总结】
-{medical_summary}
 
-【医患对话历史】
-{dialogue_context}
+            # 第二步：生成患者回复 (流式，用于对话框)
+            dialogue_context = history_builder.build_for(self.role_name, shared_state.chat_history, formatter=self._format_dialogue, empty_text="")
+            patient_reply = llm_client.get_completion(
+                messages=self._build_reply_messages(medical_summary, dialogue_context),
+                stream=bool(stream_callback),
+                stream_callback=stream_callback,
+                config=self.llm_config
+            )
 
-{REPLY_INSTRUCTION}"""
+            return {"content": patient_reply, "summary": medical_summary}
 
-            reply_messages = [
-                {"role": "system", "content": ROLE_DEFINITION},
-                {"role": "user", "content": reply_content}
-            ]
-            
-            stream = True if stream_callback else False
-            patient_reply = llm_client.get_completion(
-                messages=reply_messages,
-                stream=stream,
+        except InterruptedError:
+            raise
+        except Exception as e:
+            return {"content": f"主持专家分析过程中发生错误: {str(e)}", "summary": ERROR_SUMMARY}
+
+    async def arun(self, shared_state: SharedState, stream_callback: callable = None, summary_stream_callback: callable = None):
+        """
+        主持专家逻辑 (异步版本)
+        """
+        try:
+            history_str = await history_builder.abuild_for(self.role_name, shared_state.chat_history)
+            medical_summary = await async_llm_client.get_completion(
+                messages=self._build_summary_messages(shared_state, history_str),
+                stream=bool(summary_stream_callback),
+                stream_callback=summary_stream_callback,
+                config=self.llm_config
+            )
+
+            dialogue_context = await history_builder.abuild_for(self.role_name, shared_state.chat_history, formatter=self._format_dialogue, empty_text="")
+            patient_reply = await async_llm_client.get_completion(
+                messages=self._build_reply_messages(medical_summary, dialogue_context),
+                stream=bool(stream_callback),
                 stream_callback=stream_callback,
                 config=self.llm_config
             )
-            
+
             return {"content": patient_reply, "summary": medical_summary}
-            
+
+        except InterruptedError:
+            raise
         except Exception as e:
-            return {"content": f"主持专家分析过程中发生错误: {str(e)}", "summary": "分析出错"}
+            return {"content": f"主持专家分析过程中发生错误: {str(e)}", "summary": ERROR_SUMMARY}
@@ -0,0 +1,173 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from core.shared_state import SharedState
+
+# 规则路由：把 prompts/routing.py 中写给 LLM 的触发条件在本地直接求值。
+# 每位专家得到一个判定 (是否邀请 + 置信度)，整体置信度取最小值；
+# 低于 settings.rule_router_min_confidence 时交给 LLM 路由。
+
+# 输出顺序与路由 Prompt 示例一致
+ROUTING_ORDER = ["Pulmonologist", "Radiologist", "Pathologist", "Rheumatologist"]
+
+# 病例整理员对缺失字段的写法
+MISSING_VALUES = {"", "未提及", "无", "暂无", "未知", "不详", "none", "n/a", "null", "-"}
+
+# 判定置信度
+CONFIDENCE_HIT = 1.0       # 明确命中触发条件
+CONFIDENCE_ABSENT = 0.9    # 相关字段缺失且全文没有相关线索
+CONFIDENCE_UNSURE = 0.5    # 有线索但无法确定 (计划中的检查、被否定的症状等)
+
+IMAGING_PATTERN = re.compile(
+    r"(?<![A-Za-z])(?:HR)?CT(?![A-Za-z])|X线|X光|胸片|影像|磨玻璃|蜂窝|网格|牵拉性支气管扩张|实变|DICOM|\.dcm"
+)
+PATHOLOGY_PATTERN = re.compile(
+    r"活检|病理|切片|镜下|免疫组化|HE ?染色|TBLB|TBLC|VATS|组织学"
+)
+# 检查尚未完成 / 未做的说法
+PENDING_PATTERN = re.compile(
+    r"未行|未做|未进行|尚未|拒绝|拟行|计划|建议|待(?:行|做|完善|回报|结果)"
+)
+# 风湿免疫指标：无论阳性阴性，有结果即需要风湿科解读
+RHEUM_LAB_PATTERN = re.compile(
+    r"(?<![A-Za-z])(?:ANA|RF|CK|ANCA|SSA|SSB)(?![A-Za-z])|抗核抗体|类风湿因子|CCP|Jo-?1|MDA-?5|PL-?7|PL-?12|Ro-?52|Scl-?70|dsDNA|"
+    r"自身抗体|肌炎抗体|抗合成酶|肌酸激酶|补体",
+    re.IGNORECASE
+)
+RHEUM_CLINICAL_PATTERN = re.compile(
+    r"关节|皮疹|雷诺|技工手|Gottron|向阳疹|口干|眼干|肌无力|肌痛|光过敏|口腔溃疡|结缔组织病|CTD|IPAF|"
+    r"类风湿|狼疮|干燥综合征|皮肌炎|多发性肌炎|硬皮病|系统性硬化|血管炎"
+)
+# 出现在症状前方 4 个字符内的否定词 (如 "无关节痛"、"否认皮疹")
+NEGATION_PATTERN = re.compile(r"无|否认|未见|未诉|不伴")
+
+@dataclass
+class RoutingDecision:
+    """一次路由的结果：选中的专家、置信度、依据，以及走的是规则还是 LLM"""
+    agents: List[str]
+    confidence: float
+    reasons: List[str] = field(default_factory=list)
+    path: str = "rules"
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return "；".join(_text(v) for v in value)
+    if isinstance(value, dict):
+        return "；".join(_text(v) for v in value.values())
+    return str(value)
+
+def _is_missing(value) -> bool:
+    return _text(value).strip().lower() in MISSING_VALUES
+
+def _clinical_hits(text: str):
+    """返回 (是否有未被否定的风湿相关症状, 是否有被否定的风湿相关症状)"""
+    positive = negated = False
+    for match in RHEUM_CLINICAL_PATTERN.finditer(text):
+        if NEGATION_PATTERN.search(text[max(0, match.start() - 4):match.start()]):
+            negated = True
+        else:
+            positive = True
+    return positive, negated
+
+class RuleBasedRouter:
+    """
+    基于规则的快速路由 (不调用 LLM)。
+
+    首轮按结构化病例的全貌判定，后续轮次只看本轮新证据 (new_evidence)，
+    与 ROUTING_INSTRUCTION 中的增量路由规则一致。呼吸科始终选中。
+    """
+    def route(self, shared_state: SharedState) -> RoutingDecision:
+        verdicts: Dict[str, tuple] = {}
+        if shared_state.round_count > 1:
+            self._route_follow_up(shared_state.new_evidence, verdicts)
+        else:
+            self._route_first_round(shared_state.structured_info, verdicts)
+
+        agents = ["Pulmonologist"]
+        reasons = ["Pulmonologist: 默认参与"]
+        confidence = CONFIDENCE_HIT
+        for role_name in ROUTING_ORDER[1:]:
+            selected, role_confidence, reason = verdicts[role_name]
+            if selected:
+                agents.append(role_name)
+            reasons.append(f"{role_name}: {reason}")
+            confidence = min(confidence, role_confidence)
+        if "_" in verdicts:
+            confidence = min(confidence, verdicts["_"][1])
+            reasons.append(verdicts["_"][2])
+        return RoutingDecision(agents=agents, confidence=confidence, reasons=reasons)
+
+    def _route_first_round(self, structured_info: Dict, verdicts: Dict[str, tuple]):
+        info = structured_info or {}
+        present = {k: _text(v) for k, v in info.items() if not _is_missing(v)}
+        if not present:
+            verdicts["_"] = (False, 0.0, "结构化病例为空，无法按规则判断")
+        full_text = "\n".join(present.values())
+
+        # 影像科：有影像学描述，或其他字段提到影像检查 / 影像特征
+        if "imaging" in present:
+            verdicts["Radiologist"] = (True, CONFIDENCE_HIT, "有影像学描述")
+        elif IMAGING_PATTERN.search(full_text):
+            verdicts["Radiologist"] = (True, CONFIDENCE_HIT, "其他字段提及影像检查")
+        else:
+            verdicts["Radiologist"] = (False, CONFIDENCE_ABSENT, "无影像学资料")
+
+        # 病理科：明确有活检 / 病理结果才选；计划中的活检交给 LLM 判断
+        pathology = present.get("pathology", "")
+        if pathology:
+            if PENDING_PATTERN.search(pathology):
+                verdicts["Pathologist"] = (False, CONFIDENCE_UNSURE, "病理字段疑似尚未完成的检查")
+            else:
+                verdicts["Pathologist"] = (True, CONFIDENCE_HIT, "有病理检查描述")
+        elif PATHOLOGY_PATTERN.search(full_text):
+            verdicts["Pathologist"] = (False, CONFIDENCE_UNSURE, "病理字段缺失但其他字段提及活检/病理")
+        else:
+            verdicts["Pathologist"] = (False, CONFIDENCE_ABSENT, "无病理相关信息")
+
+        # 风湿免疫科：有免疫指标结果，或有肺外风湿相关表现 / 疑似 CTD
+        verdicts["Rheumatologist"] = self._rheum_verdict(full_text)
+
+    def _route_follow_up(self, new_evidence: Dict, verdicts: Dict[str, tuple]):
+        evidence = {k: _text(v) for k, v in (new_evidence or {}).items() if not _is_missing(v)}
+        if not evidence:
+            verdicts["_"] = (False, CONFIDENCE_UNSURE, "本轮无分类后的新证据，无法按规则判断")
+
+        imaging = evidence.pop("new_imaging_info", "")
+        pathology = evidence.pop("new_pathology_info", "")
+        # 其余类别 (检验、症状、对团队提问的回答等) 按关键词归类
+        other_text = "\n".join(evidence.values())
+
+        if imaging or IMAGING_PATTERN.search(other_text):
+            verdicts["Radiologist"] = (True, CONFIDENCE_HIT, "本轮有新的影像信息")
+        else:
+            verdicts["Radiologist"] = (False, CONFIDENCE_ABSENT, "本轮无新的影像信息")
+
+        if pathology:
+            verdicts["Pathologist"] = (True, CONFIDENCE_HIT, "本轮有新的病理信息")
+        elif PATHOLOGY_PATTERN.search(other_text):
+            verdicts["Pathologist"] = (False, CONFIDENCE_UNSURE, "新证据中提及活检/病理但未归入病理类")
+        else:
+            verdicts["Pathologist"] = (False, CONFIDENCE_ABSENT, "本轮无新的病理信息")
+
+        verdicts["Rheumatologist"] = self._rheum_verdict(other_text)
+
+        # 回答了团队的提问但内容无法归类到任何专科，交给 LLM 判断由谁复核
+        answers = evidence.get("answers_to_team_questions", "")
+        if answers and not any(p.search(answers) for p in (IMAGING_PATTERN, PATHOLOGY_PATTERN, RHEUM_LAB_PATTERN, RHEUM_CLINICAL_PATTERN)):
+            verdicts.setdefault("_", (False, CONFIDENCE_UNSURE, "对团队提问的回答无法按关键词归类"))
+
+    @staticmethod
+    def _rheum_verdict(text: str) -> tuple:
+        if RHEUM_LAB_PATTERN.search(text):
+            return (True, CONFIDENCE_HIT, "有风湿免疫指标")
+        positive, negated = _clinical_hits(text)
+        if positive:
+            return (True, CONFIDENCE_HIT, "有风湿相关的肺外表现或疑似 CTD")
+        if negated:
+            return (False, CONFIDENCE_UNSURE, "仅提及被否定的风湿相关症状")
+        return (False, CONFIDENCE_ABSENT, "无风湿免疫相关信息")
+
+rule_router = RuleBasedRouter()
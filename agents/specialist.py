@@ -0,0 +1,226 @@
+import hashlib
+from typing import List, Optional, Tuple
+from agents.base import BaseAgent
+from config.settings import settings
+from core.shared_state import SharedState
+from core.history import history_builder
+from llm.client import llm_client, async_llm_client
+from llm.streaming import DelimitedStreamSplitter
+import json
+
+# 合并输出模式下详细分析与总结之间的分隔标记
+FUSED_DELIMITER = "<<<SUMMARY>>>"
+# 分析失败时的总结文本 (见 _error_result)
+ERROR_SUMMARY = "分析出错"
+
+class SpecialistAgent(BaseAgent):
+    """
+    专科医生基类 (影像科 / 病理科 / 呼吸科 / 风湿科)
+
+    各专科的流程完全一致：
+    1. 基于结构化病例与往期讨论历史生成详细分析 (stream_callback)
+    2. 基于详细分析生成精简总结 (summary_stream_callback)
+
+    开启 settings.specialist_fused_mode 时两步合并为一次调用：模型先输出详细分析，
+    再输出分隔标记与总结，流式输出由 DelimitedStreamSplitter 分别送往两个回调。
+
+    子类只需提供各自的 Prompt 与用于提示信息的科室名称。
+
+    跨轮次复用 (reuse_previous)：意见与其输入指纹一起保存在 SharedState.specialist_fingerprints 中，
+    后续轮次被唤醒时，若本科室关心的病例字段、模型与 Prompt 均未变化且没有本科室相关的新证据，
+    直接沿用上一轮的意见与总结。
+    """
+    ROLE_DEFINITION: str = ""
+    ANALYSIS_INSTRUCTION: str = ""
+    SUMMARY_INSTRUCTION: str = ""
+    # 用于错误/空信息提示，例如 "影像"、"病理"
+    analysis_label: str = ""
+    # 影响本科室意见的结构化病例字段与新证据类别 (None 表示全部，如呼吸科需要综合全部信息)
+    RELEVANT_SECTIONS: Optional[List[str]] = None
+    RELEVANT_EVIDENCE: Optional[List[str]] = None
+
+    def input_fingerprint(self, shared_state: SharedState) -> str:
+        """本科室意见的输入指纹：相关病例字段 + 模型 + Prompt 版本 (Prompt 文本与输出模式)"""
+        info = shared_state.structured_info or {}
+        sections = self.RELEVANT_SECTIONS if self.RELEVANT_SECTIONS is not None else sorted(info)
+        payload = {
+            "sections": {k: " ".join(str(info.get(k, "")).split()) for k in sections},
+            "model": self.llm_config.model_name,
+            "prompt": [self.ROLE_DEFINITION, self.ANALYSIS_INSTRUCTION, self.SUMMARY_INSTRUCTION, settings.specialist_fused_mode],
+        }
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def has_relevant_evidence(self, shared_state: SharedState) -> bool:
+        """本轮是否有与本科室相关的新证据 (有则必须重新分析)"""
+        evidence = shared_state.new_evidence or {}
+        keys = self.RELEVANT_EVIDENCE if self.RELEVANT_EVIDENCE is not None else evidence.keys()
+        return any(evidence.get(k) for k in keys)
+
+    @staticmethod
+    def is_failed_result(result) -> bool:
+        """
+        分析失败的结果 (_error_result)：不记录指纹，后续轮次必须重新分析。
+        旧版本 LLM 调用失败时以 "[Error] ..." 作为内容返回，这样的意见可能仍保存在会话中，同样视为失败。
+        """
+        if isinstance(result, dict):
+            content, summary = result.get("content") or "", result.get("summary") or ""
+        else:
+            content = summary = result or ""
+        return summary == ERROR_SUMMARY or content.startswith("[Error]") or summary.startswith("[Error]")
+
+    def reuse_previous(self, shared_state: SharedState, fingerprint: str = None) -> Optional[dict]:
+        """输入未变化时返回上一轮的 {"content", "summary"}，否则返回 None"""
+        if not settings.specialist_memoization_enabled or not shared_state.structured_info:
+            return None
+        if shared_state.specialist_fingerprints.get(self.role_name) != (fingerprint or self.input_fingerprint(shared_state)):
+            return None
+        opinion = shared_state.specialist_opinions.get(self.role_name)
+        summary = shared_state.specialist_summaries.get(self.role_name)
+        if not opinion or summary is None or self.has_relevant_evidence(shared_state):
+            return None
+        previous = {"content": opinion, "summary": summary}
+        if self.is_failed_result(previous):
+            return None
+        return previous
+
+    def _build_analysis_messages(self, shared_state: SharedState, history_str: str) -> list:
+        """
+        构造详细分析的 Prompt
+        :param history_str: 往期讨论历史 (由 history_builder 按本角色的 Token 预算生成)
+        """
+        structured_info = shared_state.structured_info
+
+        # 将结构化信息转换为字符串
+        case_str = json.dumps(structured_info, ensure_ascii=False, indent=2)
+
+        content = f"""【结构化病例信息】
+{case_str}
+
+【往期讨论历史】
+{history_str}
+
+{self.ANALYSIS_INSTRUCTION}"""
+
+        return [
+            {"role": "system", "content": self.ROLE_DEFINITION},
+            {"role": "user", "content": content}
+        ]
+
+    def _build_summary_messages(self, detailed_analysis: str) -> list:
+        """构造总结的 Prompt"""
+        return [
+            {"role": "system", "content": self.ROLE_DEFINITION},
+            {"role": "user", "content": f"【详细分析】\n{detailed_analysis}\n\n{self.SUMMARY_INSTRUCTION}"}
+        ]
+
+    def _build_fused_messages(self, shared_state: SharedState, history_str: str) -> list:
+        """构造合并输出模式的 Prompt：详细分析 + 分隔标记 + 总结"""
+        messages = self._build_analysis_messages(shared_state, history_str)
+        messages[-1]["content"] += f"""
+
+完成上述详细分析后，请另起一行单独输出分隔标记 {FUSED_DELIMITER}，然后紧接着按以下要求输出总结 (总结中的"上述分析"即分隔标记之前的详细分析)：
+{self.SUMMARY_INSTRUCTION}"""
+        return messages
+
+    @staticmethod
+    def _split_fused(response: str) -> Tuple[str, Optional[str]]:
+        """拆分合并输出，返回 (详细分析, 总结)；没有分隔标记时总结为 None"""
+        if FUSED_DELIMITER not in response:
+            return response, None
+        detailed_analysis, summary = response.split(FUSED_DELIMITER, 1)
+        return detailed_analysis.strip(), summary.strip()
+
+    def _empty_result(self) -> dict:
+        return {"content": f"暂无结构化病例信息，无法进行{self.analysis_label}分析。", "summary": "暂无信息"}
+
+    def _error_result(self, e: Exception) -> dict:
+        return {"content": f"{self.analysis_label}分析过程中发生错误: {str(e)}", "summary": ERROR_SUMMARY}
+
+    def run(self, shared_state: SharedState, stream_callback: callable = None, summary_stream_callback: callable = None):
+        """
+        专科医生逻辑
+        """
+        if not shared_state.structured_info:
+            return self._empty_result()
+
+        # 用户需求：参考“过去轮数中所有医生的意见”，所以保留所有人的发言 (超出预算的往期轮次以摘要代替)
+        history_str = history_builder.build_for(self.role_name, shared_state.chat_history)
+
+        try:
+            if settings.specialist_fused_mode:
+                # 合并模式：一次调用同时完成分析与总结
+                response = llm_client.get_completion(
+                    messages=self._build_fused_messages(shared_state, history_str),
+                    stream=bool(stream_callback or summary_stream_callback),
+                    stream_callback=DelimitedStreamSplitter(FUSED_DELIMITER, stream_callback, summary_stream_callback),
+                    config=self.llm_config
+                )
+                detailed_analysis, summary = self._split_fused(response)
+                if summary is not None:
+                    return {"content": detailed_analysis, "summary": summary}
+                # 模型没有输出分隔标记：整段作为详细分析，再单独生成总结
+            else:
+                # 1. 详细分析 (流式)
+                detailed_analysis = llm_client.get_completion(
+                    messages=self._build_analysis_messages(shared_state, history_str),
+                    stream=bool(stream_callback),
+                    stream_callback=stream_callback,
+                    config=self.llm_config
+                )
+
+            # 2. 生成总结 (流式)
+            summary = llm_client.get_completion(
+                messages=self._build_summary_messages(detailed_analysis),
+                stream=bool(summary_stream_callback),
+                stream_callback=summary_stream_callback,
+                config=self.llm_config
+            )
+
+            return {"content": detailed_analysis, "summary": summary}
+
+        except InterruptedError:
+            raise
+        except Exception as e:
+            return self._error_result(e)
+
+    async def arun(self, shared_state: SharedState, stream_callback: callable = None, summary_stream_callback: callable = None):
+        """
+        专科医生逻辑 (异步版本)
+        """
+        if not shared_state.structured_info:
+            return self._empty_result()
+
+        history_str = await history_builder.abuild_for(self.role_name, shared_state.chat_history)
+
+        try:
+            if settings.specialist_fused_mode:
+                response = await async_llm_client.get_completion(
+                    messages=self._build_fused_messages(shared_state, history_str),
+                    stream=bool(stream_callback or summary_stream_callback),
+                    stream_callback=DelimitedStreamSplitter(FUSED_DELIMITER, stream_callback, summary_stream_callback),
+                    config=self.llm_config
+                )
+                detailed_analysis, summary = self._split_fused(response)
+                if summary is not None:
+                    return {"content": detailed_analysis, "summary": summary}
+            else:
+                detailed_analysis = await async_llm_client.get_completion(
+                    messages=self._build_analysis_messages(shared_state, history_str),
+                    stream=bool(stream_callback),
+                    stream_callback=stream_callback,
+                    config=self.llm_config
+                )
+
+            summary = await async_llm_client.get_completion(
+                messages=self._build_summary_messages(detailed_analysis),
+                stream=bool(summary_stream_callback),
+                stream_callback=summary_stream_callback,
+                config=self.llm_config
+            )
+
+            return {"content": detailed_analysis, "summary": summary}
+
+        except InterruptedError:
+            raise
+        except Exception as e:
+            return self._error_result(e)
@@ -0,0 +1,8 @@
+from .provider import ModelProfile, SimulatedProvider, SimulatedClient, simulated_backend
+
+__all__ = [
+    "ModelProfile",
+    "SimulatedProvider",
+    "SimulatedClient",
+    "simulated_backend",
+]
@@ -0,0 +1,122 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+from typing import Any, Dict, List
+
+from config.settings import settings
+from benchmarks.provider import ModelProfile, SimulatedProvider
+from benchmarks.load import DEFAULT_AGENTS, run_generator_load, run_websocket_load
+
+# 基准测试入口：
+#   python -m benchmarks --mode generator --sessions 1 10 100 --rounds 2
+#   python -m benchmarks --mode websocket --sessions 50 500 --output report.json
+#   python -m benchmarks --ttft 0 --tokens-per-sec 100000 --baseline report.json   # 只测本项目自身的开销并与基线比较
+
+# 与基线比较的指标：每轮 CPU 与轮次延迟 p95 (越小越好)
+COMPARED_METRICS = [("cpu_ms_per_round",), ("round_latency_ms", "p95")]
+
+def _metric(result: Dict[str, Any], path: tuple):
+    value = result
+    for key in path:
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """与基线 (相同 mode 与会话数) 比较，返回超出容差的回退项"""
+    previous = {(r["mode"], r["sessions"], r["rounds"]): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get((result["mode"], result["sessions"], result["rounds"]))
+        if base is None:
+            continue
+        for path in COMPARED_METRICS:
+            current, before = _metric(result, path), _metric(base, path)
+            if current is None or not before:
+                continue
+            if current > before * (1 + tolerance):
+                regressions.append(f"{result['mode']} x{result['sessions']} {'.'.join(path)}: {before:.1f} -> {current:.1f} (+{(current / before - 1) * 100:.0f}%)")
+    return regressions
+
+def print_table(results: List[Dict[str, Any]]):
+    header = f"{'mode':<10}{'sessions':>9}{'rounds ok/fail':>16}{'wall s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}" \
+             f"{'ttft p50':>10}{'events/s':>10}{'cpu %':>8}{'cpu ms/rd':>11}{'peak MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        latency, first_token = r["round_latency_ms"], r["first_token_ms"]
+        rounds = f"{r['rounds_completed']}/{r['rounds_failed']}"
+        print(f"{r['mode']:<10}{r['sessions']:>9}{rounds:>16}{r['wall_seconds']:>9.1f}{latency['p50']:>10.0f}{latency['p95']:>10.0f}"
+              f"{latency['p99']:>10.0f}{first_token['p50']:>10.0f}{r['events_per_sec']:>10.0f}{r['cpu_percent'] or 0:>8.0f}"
+              f"{r['cpu_ms_per_round'] or 0:>11.1f}{r['peak_rss_mb'] or 0:>9.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会诊流程基准测试 (模拟 LLM Provider)")
+    parser.add_argument("--mode", choices=["generator", "websocket"], default="generator",
+                        help="generator: 进程内驱动 run_mdt_generator；websocket: 独立服务进程 + WebSocket 客户端")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50], help="并发会话数，可给出多个依次测试")
+    parser.add_argument("--rounds", type=int, default=1, help="每个会话的轮数 (第 2 轮起为补充信息)")
+    parser.add_argument("--agents", nargs="+", default=DEFAULT_AGENTS, help="启用的角色")
+    parser.add_argument("--ttft", type=float, default=0.8, help="默认首 Token 延迟 (秒)")
+    parser.add_argument("--tokens-per-sec", type=float, default=40.0, help="默认输出速率")
+    parser.add_argument("--output-tokens", type=int, default=400, help="默认自由文本输出长度 (tokens)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="默认请求失败概率")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟 / 速率 / 长度的相对抖动")
+    parser.add_argument("--profiles", help="按模型覆盖的模拟参数 (JSON 文件: {模型名: {ttft, tokens_per_sec, ...}})")
+    parser.add_argument("--conflict-rate", type=float, default=0.5, help="冲突检测给出真实冲突的概率")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep-rate-limits", action="store_true", help="保留真实 Provider 的限额 (估算部署容量时使用)")
+    parser.add_argument("--workdir", help="存放 checkpoint、会话库与服务日志的目录 (默认新建临时目录)")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="与之前 --output 的结果比较，超出容差时以状态码 1 退出")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="与基线比较的容差 (默认 15%%)")
+    args = parser.parse_args()
+
+    if any(n < 1 for n in args.sessions) or args.rounds < 1:
+        parser.error("--sessions 与 --rounds 必须为正整数")
+
+    profiles = {}
+    if args.profiles:
+        with open(args.profiles, 'r', encoding='utf-8') as f:
+            profiles = {model: ModelProfile(**profile) for model, profile in json.load(f).items()}
+    default_profile = ModelProfile(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, output_tokens=args.output_tokens,
+                                   error_rate=args.error_rate, jitter=args.jitter)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="mdt-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # 进程内模式的 checkpoint 也写到工作目录，不影响仓库中的数据
+    settings.checkpoint_db_path = os.path.join(workdir, "checkpoints.sqlite")
+    lift_rate_limits = not args.keep_rate_limits
+    print(f"[Bench] mode={args.mode} sessions={args.sessions} rounds={args.rounds} workdir={workdir}")
+
+    results = []
+    for sessions in args.sessions:
+        # 每个并发级别使用新的 Provider，保证各级别的模拟输出互不影响
+        provider = SimulatedProvider(profiles, default_profile, seed=args.seed, conflict_rate=args.conflict_rate)
+        if args.mode == "websocket":
+            result = run_websocket_load(provider, sessions, workdir, args.rounds, args.agents, lift_rate_limits=lift_rate_limits)
+        else:
+            # 会诊流程的日志输出量很大，写入工作目录而不是终端
+            with open(os.path.join(workdir, "pipeline.log"), 'a', encoding='utf-8') as log_file, contextlib.redirect_stdout(log_file):
+                result = run_generator_load(provider, sessions, args.rounds, args.agents, lift_rate_limits=lift_rate_limits)
+        results.append(result)
+        print(f"[Bench] {args.mode} x{sessions}: {result['rounds_completed']} rounds in {result['wall_seconds']:.1f}s")
+
+    print()
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n[Bench] Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n[Bench] Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\n[Bench] No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
@@ -0,0 +1,303 @@
+import asyncio
+import contextlib
+import json
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from config.settings import settings
+from benchmarks.provider import SimulatedProvider, simulated_backend
+
+# 负载驱动：以 N 个并发会话 (每个会话 rounds 轮) 驱动 run_mdt_generator (进程内) 或 WebSocket 服务 (独立进程)，
+# 统计每轮延迟分位数、首 Token 延迟、事件吞吐、服务端 CPU 与峰值内存。
+
+DEFAULT_AGENTS = ["Case Organizer", "Radiologist", "Pathologist", "Pulmonologist", "Rheumatologist", "Moderator"]
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def case_text(session_index: int, round_index: int) -> str:
+    """第 session_index 个会话第 round_index 轮 (从 1 开始) 的输入；各会话内容不同，模拟的输出也随之不同"""
+    if round_index == 1:
+        return (f"患者{session_index}，男，62 岁，进行性活动后气促 2 年，干咳。查体双下肺 Velcro 啰音，杵状指。"
+                f"HRCT：双肺胸膜下网格影伴牵拉性支气管扩张，下叶为著。")
+    return f"患者{session_index}第 {round_index} 轮补充：ANA 1:320 (斑点型)，抗 Ro-52 阳性，肺功能 FVC 68% 预计值。"
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50 / p90 / p95 / p99 / max (毫秒，最近秩法)"""
+    if not values:
+        return {"p50": 0.0, "p90": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def rank(q: float) -> float:
+        index = max(0, min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1))
+        return ordered[index] * 1000
+
+    return {"p50": rank(0.50), "p90": rank(0.90), "p95": rank(0.95), "p99": rank(0.99), "max": ordered[-1] * 1000}
+
+def _read_proc(pid: int) -> Optional[tuple]:
+    """(CPU 秒数, 当前 RSS 字节数)，读取 /proc 失败 (非 Linux 或进程已退出) 时返回 None"""
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+    rss_bytes = int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu_seconds, rss_bytes
+
+class ResourceMonitor:
+    """
+    在后台线程中周期性采样目标进程 (默认本进程) 的 CPU 时间与 RSS，
+    stop() 返回采样期间的 CPU 秒数、平均 CPU 占用 (单核 = 100%) 与峰值 RSS。
+    """
+    def __init__(self, pid: Optional[int] = None, interval: float = 0.1):
+        self.pid = pid or os.getpid()
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_cpu = 0.0
+        self._started_at = 0.0
+        self._last: Optional[tuple] = None
+        self.peak_rss = 0
+
+    def _sample(self):
+        sample = _read_proc(self.pid)
+        if sample is not None:
+            self._last = sample
+            self.peak_rss = max(self.peak_rss, sample[1])
+        return sample
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        sample = self._sample()
+        self._start_cpu = sample[0] if sample else 0.0
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="bench-resource-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Dict[str, Optional[float]]:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self._sample()
+        wall = max(time.monotonic() - self._started_at, 1e-6)
+        if self._last is None:
+            return {"cpu_seconds": None, "cpu_percent": None, "peak_rss_mb": None}
+        cpu_seconds = self._last[0] - self._start_cpu
+        return {
+            "cpu_seconds": round(cpu_seconds, 3),
+            "cpu_percent": round(cpu_seconds / wall * 100, 1),
+            "peak_rss_mb": round(self.peak_rss / 1024 / 1024, 1)
+        }
+
+class _Recorder:
+    """线程安全地汇总各会话的轮次延迟、首 Token 延迟与事件数"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.round_latencies: List[float] = []
+        self.first_token_latencies: List[float] = []
+        self.events = 0
+        self.error_events = 0
+        self.failed_rounds = 0
+
+    def round_finished(self, latency: float, first_token: Optional[float], events: int, error_events: int):
+        with self._lock:
+            self.round_latencies.append(latency)
+            if first_token is not None:
+                self.first_token_latencies.append(first_token)
+            self.events += events
+            self.error_events += error_events
+
+    def round_failed(self, error: Exception):
+        with self._lock:
+            self.failed_rounds += 1
+        print(f"[Bench] Round failed: {error!r}", file=sys.__stderr__)
+
+class _RoundTimer:
+    """记录一轮中的事件：首个 token 事件的时间、事件数与 error 事件数"""
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.first_token: Optional[float] = None
+        self.events = 0
+        self.error_events = 0
+
+    def on_event(self, event: Dict[str, Any]):
+        self.events += 1
+        if event.get("type") == "token" and self.first_token is None:
+            self.first_token = time.monotonic() - self.started_at
+        elif event.get("type") == "error":
+            self.error_events += 1
+
+    def finish(self, recorder: _Recorder):
+        recorder.round_finished(time.monotonic() - self.started_at, self.first_token, self.events, self.error_events)
+
+def _summarize(mode: str, sessions: int, rounds: int, wall: float, recorder: _Recorder, resources: Dict[str, Any],
+               provider_stats: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    completed = len(recorder.round_latencies)
+    cpu_seconds = resources.get("cpu_seconds")
+    return {
+        "mode": mode,
+        "sessions": sessions,
+        "rounds": rounds,
+        "wall_seconds": round(wall, 3),
+        "rounds_completed": completed,
+        "rounds_failed": recorder.failed_rounds,
+        "round_latency_ms": percentiles(recorder.round_latencies),
+        "first_token_ms": percentiles(recorder.first_token_latencies),
+        "events": recorder.events,
+        "events_per_sec": round(recorder.events / max(wall, 1e-6), 1),
+        "error_events": recorder.error_events,
+        # 每轮消耗的服务端 CPU：与模拟的模型延迟无关，是衡量本项目自身开销的主要指标
+        "cpu_ms_per_round": round(cpu_seconds * 1000 / completed, 1) if cpu_seconds is not None and completed else None,
+        **resources,
+        "provider": provider_stats
+    }
+
+# --- run_mdt_generator (进程内) ---
+
+def run_generator_load(provider: SimulatedProvider, sessions: int, rounds: int = 1, agents: List[str] = None,
+                       model_configs: Dict[str, str] = None, lift_rate_limits: bool = True) -> Dict[str, Any]:
+    """
+    在本进程中同时启动 sessions 个会话线程，各自通过 run_mdt_generator 跑 rounds 轮。
+    CPU 与内存包含模拟 Provider 本身 (开销很小)，不包含 WebSocket 与 HTTP 层。
+    """
+    from core.pipeline_api import run_mdt_generator
+    from core.shared_state import SharedState
+
+    agents = agents or DEFAULT_AGENTS
+    recorder = _Recorder()
+    barrier = threading.Barrier(sessions + 1)
+
+    def run_session(session_index: int):
+        state = SharedState()
+        session_id = f"bench-{os.getpid()}-{time.monotonic_ns()}-{session_index}"
+        barrier.wait()
+        for round_index in range(1, rounds + 1):
+            state.add_user_input(case_text(session_index, round_index))
+            timer = _RoundTimer()
+            try:
+                for event in run_mdt_generator(state, agents, model_configs=model_configs, session_id=session_id):
+                    timer.on_event(event)
+            except Exception as e:
+                recorder.round_failed(e)
+                return
+            timer.finish(recorder)
+
+    with simulated_backend(provider, lift_rate_limits):
+        threads = [threading.Thread(target=run_session, args=(i,), name=f"bench-session-{i}", daemon=True) for i in range(sessions)]
+        for thread in threads:
+            thread.start()
+        monitor = ResourceMonitor()
+        monitor.start()
+        started_at = time.monotonic()
+        barrier.wait()
+        for thread in threads:
+            thread.join()
+        wall = time.monotonic() - started_at
+        resources = monitor.stop()
+    return _summarize("generator", sessions, rounds, wall, recorder, resources, provider.stats())
+
+# --- WebSocket 服务 (独立进程) ---
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _wait_for_port(port: int, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Benchmark server exited with code {process.returncode}")
+        with contextlib.suppress(OSError), socket.create_connection(("127.0.0.1", port), timeout=0.5):
+            return
+        time.sleep(0.1)
+    raise TimeoutError(f"Benchmark server did not start listening on port {port} within {timeout}s")
+
+@contextlib.contextmanager
+def benchmark_server(provider: SimulatedProvider, workdir: str, lift_rate_limits: bool = True):
+    """
+    在独立进程中启动接入模拟 Provider 的 WebSocket 服务 (python -m benchmarks.serve)，返回 (base_url, pid)。
+    服务进程的工作目录为 workdir，会话库、checkpoint 与会诊日志都写在其中，不影响仓库目录。
+    """
+    port = _free_port()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get("PYTHONPATH")])),
+               OPENAI_API_KEY=settings.openai_api_key)
+    command = [sys.executable, "-m", "benchmarks.serve", "--port", str(port), "--provider", json.dumps(provider.to_config())]
+    if not lift_rate_limits:
+        command.append("--keep-rate-limits")
+    with open(os.path.join(workdir, "server.log"), 'ab') as log_file:
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        try:
+            _wait_for_port(port, process)
+            yield f"127.0.0.1:{port}", process.pid
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+async def _websocket_session(address: str, session_index: int, rounds: int, agents: List[str],
+                             model_configs: Dict[str, str], http, connect: Callable, recorder: _Recorder):
+    response = await http.post(f"http://{address}/api/sessions")
+    response.raise_for_status()
+    session_id = response.json()["session_id"]
+    for round_index in range(1, rounds + 1):
+        try:
+            response = await http.post(f"http://{address}/api/sessions/{session_id}/case",
+                                       json={"case_text": case_text(session_index, round_index)})
+            response.raise_for_status()
+            # 服务过载时握手会排队：放宽握手超时并关闭心跳，以延迟而不是连接失败的形式体现在结果中
+            async with connect(f"ws://{address}/ws/consultation/{session_id}", max_size=None,
+                               open_timeout=None, ping_interval=None) as websocket:
+                timer = _RoundTimer()
+                await websocket.send(json.dumps({"selected_agents": agents, "model_configs": model_configs or {}}))
+                async for message in websocket:
+                    event = json.loads(message)
+                    if event.get("type") == "done":
+                        break
+                    timer.on_event(event)
+        except Exception as e:
+            recorder.round_failed(e)
+            return
+        timer.finish(recorder)
+
+async def _drive_websocket(address: str, sessions: int, rounds: int, agents: List[str], model_configs: Dict[str, str], recorder: _Recorder):
+    import httpx
+    from websockets.asyncio.client import connect
+
+    # 不复用 HTTP 连接：轮次耗时远超服务端的 keep-alive 超时，复用空闲连接会与服务端关闭连接发生竞争
+    limits = httpx.Limits(max_connections=sessions, max_keepalive_connections=0)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as http:
+        await asyncio.gather(*[
+            _websocket_session(address, i, rounds, agents, model_configs, http, connect, recorder) for i in range(sessions)
+        ])
+
+def run_websocket_load(provider: SimulatedProvider, sessions: int, workdir: str, rounds: int = 1, agents: List[str] = None,
+                       model_configs: Dict[str, str] = None, lift_rate_limits: bool = True) -> Dict[str, Any]:
+    """
+    启动接入模拟 Provider 的服务进程，以 sessions 个并发 WebSocket 会话各跑 rounds 轮 (与前端相同的
+    创建会话 -> 提交病例 -> WebSocket 会诊流程)。CPU 与内存只统计服务进程，不包含本进程的压测客户端。
+    """
+    agents = agents or DEFAULT_AGENTS
+    recorder = _Recorder()
+    with benchmark_server(provider, workdir, lift_rate_limits) as (address, pid):
+        monitor = ResourceMonitor(pid)
+        monitor.start()
+        started_at = time.monotonic()
+        asyncio.run(_drive_websocket(address, sessions, rounds, agents, model_configs, recorder))
+        wall = time.monotonic() - started_at
+        resources = monitor.stop()
+    # 模拟 Provider 运行在服务进程中，请求与 token 计数不回传
+    return _summarize("websocket", sessions, rounds, wall, recorder, resources, None)
@@ -0,0 +1,293 @@
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+import types
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import httpx
+import openai
+from pydantic import BaseModel
+
+from config.settings import settings
+from agents.case_organizer.prompts.intake import ROLE_DEFINITION as CASE_ORGANIZER_ROLE
+from agents.case_organizer.prompts.structuring import CASE_FIELDS, PATCHING_INSTRUCTION
+from agents.conflict_detector.prompts.detection import ROLE_DEFINITION as CONFLICT_DETECTOR_ROLE
+from agents.moderator.prompts.routing import ROUTING_ROLE_DEFINITION
+from agents.specialist import FUSED_DELIMITER
+
+# 模拟的 OpenAI 兼容后端：按模型配置首 Token 延迟、输出速率、输出长度与错误率，
+# 替换 LLMClient / AsyncLLMClient 的底层客户端后，整条会诊流程 (重试、限流、流式、取消) 照常运行，
+# 只是不再访问真实的模型服务，基准测试的结果只反映本项目自身的开销。
+
+SPECIALISTS = ["Radiologist", "Pathologist", "Pulmonologist", "Rheumatologist"]
+FILLER = "两肺下叶胸膜下可见网格影及牵拉性支气管扩张，结合临床考虑纤维化型间质性肺病，建议完善自身抗体检查。"
+
+class ModelProfile(BaseModel):
+    """单个模型的模拟参数"""
+    # 首 Token 延迟 (秒)
+    ttft: float = 0.8
+    # 输出速率 (tokens/秒)
+    tokens_per_sec: float = 40.0
+    # 自由文本的输出长度 (tokens)；JSON 输出按内容本身的长度
+    output_tokens: int = 400
+    # 每次请求失败的概率 (瞬时错误，由 LLMClient 重试)
+    error_rate: float = 0.0
+    # 延迟、速率与长度的相对抖动幅度 (±)
+    jitter: float = 0.2
+
+class _Plan:
+    """一次请求的模拟结果：输出的 token 序列与时间安排"""
+    __slots__ = ("tokens", "ttft", "interval", "fail_at")
+
+    def __init__(self, tokens: List[str], ttft: float, interval: float, fail_at: Optional[int]):
+        self.tokens = tokens
+        self.ttft = ttft
+        self.interval = interval
+        # 在第几个 token 之前失败 (0 表示首 Token 之前)，None 表示不失败
+        self.fail_at = fail_at
+
+    def due(self, index: int) -> float:
+        """第 index 个 token 相对请求开始的到达时间"""
+        return self.ttft + index * self.interval
+
+def _simulated_error() -> openai.APIConnectionError:
+    request = httpx.Request("POST", "https://simulated.invalid/v1/chat/completions")
+    return openai.APIConnectionError(message="Simulated provider error", request=request)
+
+def _chunk(text: str):
+    delta = types.SimpleNamespace(content=text)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta, finish_reason=None)])
+
+def _completion(text: str):
+    message = types.SimpleNamespace(content=text, role="assistant")
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message, finish_reason="stop")])
+
+class _SyncStream:
+    """同步流式响应：与 openai.Stream 一样，可在其他线程调用 close() 断开正在阻塞的读取"""
+    def __init__(self, provider: "SimulatedProvider", plan: _Plan):
+        self._provider = provider
+        self._plan = plan
+        self._closed = threading.Event()
+
+    def __iter__(self):
+        started_at = time.monotonic()
+        for index, token in enumerate(self._plan.tokens):
+            if self._closed.wait(max(0.0, started_at + self._plan.due(index) - time.monotonic())):
+                raise httpx.ReadError("Connection closed")
+            if index == self._plan.fail_at:
+                raise _simulated_error()
+            self._provider._count_tokens(1)
+            yield _chunk(token)
+
+    def close(self):
+        self._closed.set()
+
+class _AsyncStream:
+    def __init__(self, provider: "SimulatedProvider", plan: _Plan):
+        self._provider = provider
+        self._plan = plan
+
+    async def _iterate(self):
+        started_at = time.monotonic()
+        for index, token in enumerate(self._plan.tokens):
+            await asyncio.sleep(max(0.0, started_at + self._plan.due(index) - time.monotonic()))
+            if index == self._plan.fail_at:
+                raise _simulated_error()
+            self._provider._count_tokens(1)
+            yield _chunk(token)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def close(self):
+        pass
+
+class _Completions:
+    def __init__(self, provider: "SimulatedProvider"):
+        self._provider = provider
+
+    def create(self, **kwargs):
+        plan = self._provider.plan(kwargs)
+        if kwargs.get("stream"):
+            return _SyncStream(self._provider, plan)
+        if plan.fail_at is not None:
+            time.sleep(plan.due(plan.fail_at))
+            raise _simulated_error()
+        time.sleep(plan.due(len(plan.tokens)))
+        self._provider._count_tokens(len(plan.tokens))
+        return _completion("".join(plan.tokens))
+
+class _AsyncCompletions:
+    def __init__(self, provider: "SimulatedProvider"):
+        self._provider = provider
+
+    async def create(self, **kwargs):
+        plan = self._provider.plan(kwargs)
+        if kwargs.get("stream"):
+            return _AsyncStream(self._provider, plan)
+        if plan.fail_at is not None:
+            await asyncio.sleep(plan.due(plan.fail_at))
+            raise _simulated_error()
+        await asyncio.sleep(plan.due(len(plan.tokens)))
+        self._provider._count_tokens(len(plan.tokens))
+        return _completion("".join(plan.tokens))
+
+class SimulatedClient:
+    """openai.OpenAI / openai.AsyncOpenAI 的替身，只实现 chat.completions.create"""
+    def __init__(self, provider: "SimulatedProvider", use_async: bool = False):
+        completions = _AsyncCompletions(provider) if use_async else _Completions(provider)
+        self.chat = types.SimpleNamespace(completions=completions)
+
+class SimulatedProvider:
+    """
+    确定性的模拟 Provider。
+
+    每次请求的随机量 (抖动、是否出错、路由结果、是否有冲突) 由 (seed, 模型, 消息内容, 同一请求的第几次发送)
+    决定，与并发调度顺序无关：同一组病例在相同参数下得到相同的输出与延迟，重试则会得到新的结果。
+    响应内容按请求类型生成 (病例整理 / 路由 / 冲突检测为合法 JSON，其余为自由文本)，保证流程走完整条路径。
+    """
+    def __init__(self, profiles: Optional[Dict[str, ModelProfile]] = None, default_profile: Optional[ModelProfile] = None,
+                 seed: int = 0, conflict_rate: float = 0.5, chars_per_token: int = 2):
+        """
+        :param profiles: 模型名 -> 模拟参数，未列出的模型使用 default_profile
+        :param conflict_rate: 冲突检测返回真实冲突 (从而触发团队讨论) 的概率
+        :param chars_per_token: 每个流式 token 的字符数
+        """
+        self.profiles = profiles or {}
+        self.default_profile = default_profile or ModelProfile()
+        self.seed = seed
+        self.conflict_rate = conflict_rate
+        self.chars_per_token = max(1, chars_per_token)
+        self._lock = threading.Lock()
+        self._attempts: Dict[str, int] = {}
+        self.requests = 0
+        self.errors = 0
+        self.tokens = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "SimulatedProvider":
+        """由 to_config() 的结果重建 (用于把同一配置传给基准测试启动的服务进程)"""
+        return cls(
+            profiles={model: ModelProfile(**profile) for model, profile in config.get("profiles", {}).items()},
+            default_profile=ModelProfile(**config.get("default_profile", {})),
+            seed=config.get("seed", 0),
+            conflict_rate=config.get("conflict_rate", 0.5),
+            chars_per_token=config.get("chars_per_token", 2)
+        )
+
+    def to_config(self) -> Dict[str, Any]:
+        return {
+            "profiles": {model: profile.model_dump() for model, profile in self.profiles.items()},
+            "default_profile": self.default_profile.model_dump(),
+            "seed": self.seed,
+            "conflict_rate": self.conflict_rate,
+            "chars_per_token": self.chars_per_token
+        }
+
+    def profile_for(self, model: str) -> ModelProfile:
+        return self.profiles.get(model, self.default_profile)
+
+    def _rng(self, request_kwargs: Dict[str, Any]) -> random.Random:
+        digest = hashlib.sha256(json.dumps(
+            [request_kwargs.get("model"), request_kwargs.get("messages")], ensure_ascii=False, sort_keys=True
+        ).encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+            self.requests += 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}")
+
+    def _count_tokens(self, count: int):
+        with self._lock:
+            self.tokens += count
+
+    @staticmethod
+    def _vary(value: float, jitter: float, rng: random.Random) -> float:
+        return value * (1 + rng.uniform(-jitter, jitter))
+
+    def _free_text(self, length: int) -> str:
+        repeats = length // len(FILLER) + 1
+        return (FILLER * repeats)[:length]
+
+    def _respond(self, messages: List[Dict[str, str]], profile: ModelProfile, rng: random.Random) -> str:
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        user = messages[-1]["content"] if messages else ""
+        length = max(1, int(self._vary(profile.output_tokens, profile.jitter, rng))) * self.chars_per_token
+
+        if CASE_ORGANIZER_ROLE in system:
+            case = {field: self._free_text(rng.randint(8, 40)) for field in CASE_FIELDS}
+            if PATCHING_INSTRUCTION.strip() in user:
+                payload = {"patch": [{"op": "replace", "path": "/lab_results", "value": case["lab_results"]}]}
+            elif "【已有结构化病例信息】" in user:
+                payload = {"updated_case": case, "new_evidence": {"new_lab_results": [case["lab_results"]]}}
+            else:
+                payload = case
+            return json.dumps(payload, ensure_ascii=False)
+        if ROUTING_ROLE_DEFINITION in system:
+            return json.dumps(rng.sample(SPECIALISTS, rng.randint(2, len(SPECIALISTS))))
+        if CONFLICT_DETECTOR_ROLE in system:
+            conflicts = []
+            if rng.random() < self.conflict_rate:
+                involved = rng.sample(SPECIALISTS, 2)
+                conflicts.append({"issue": self._free_text(12), "involved_agents": involved,
+                                  "description": self._free_text(60), "severity": rng.choice(["high", "medium", "low"])})
+            return json.dumps({"conflicts": conflicts}, ensure_ascii=False)
+        if FUSED_DELIMITER in user:
+            return f"{self._free_text(length)}\n{FUSED_DELIMITER}\n{self._free_text(max(1, length // 4))}"
+        return self._free_text(length)
+
+    def plan(self, request_kwargs: Dict[str, Any]) -> _Plan:
+        """为一次请求生成输出与时间安排"""
+        rng = self._rng(request_kwargs)
+        profile = self.profile_for(request_kwargs.get("model"))
+        text = self._respond(request_kwargs.get("messages") or [], profile, rng)
+        tokens = [text[i:i + self.chars_per_token] for i in range(0, len(text), self.chars_per_token)]
+        ttft = max(0.0, self._vary(profile.ttft, profile.jitter, rng))
+        tokens_per_sec = max(1e-3, self._vary(profile.tokens_per_sec, profile.jitter, rng))
+        fail_at = None
+        if rng.random() < profile.error_rate:
+            # 一半在首 Token 之前失败，一半在流式输出中途断开
+            fail_at = 0 if rng.random() < 0.5 else rng.randrange(len(tokens))
+            with self._lock:
+                self.errors += 1
+        return _Plan(tokens, ttft, 1.0 / tokens_per_sec, fail_at)
+
+    def client(self) -> SimulatedClient:
+        return SimulatedClient(self)
+
+    def async_client(self) -> SimulatedClient:
+        return SimulatedClient(self, use_async=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"requests": self.requests, "errors": self.errors, "tokens": self.tokens}
+
+@contextmanager
+def simulated_backend(provider: SimulatedProvider, lift_rate_limits: bool = True):
+    """
+    在作用域内让全局的 llm_client / async_llm_client 改用模拟 Provider，并关闭响应缓存
+    (缓存命中会掩盖流程本身的开销)。
+    :param lift_rate_limits: 为 True 时换用不限额的限流器，测量的是本项目自身的吞吐；
+                             为 False 时保留真实 Provider 的限额，用于估算实际部署的容量
+    """
+    import llm.client as client_module
+    from llm.rate_limit import ConcurrencyGovernor
+
+    saved_governor = client_module.governor
+    saved_cache_enabled = settings.llm_cache_enabled
+    client_module.llm_client._get_client = lambda config=None: provider.client()
+    client_module.async_llm_client._get_client = lambda config=None: provider.async_client()
+    if lift_rate_limits:
+        client_module.governor = ConcurrencyGovernor()
+    settings.llm_cache_enabled = False
+    try:
+        yield provider
+    finally:
+        del client_module.llm_client._get_client
+        del client_module.async_llm_client._get_client
+        client_module.governor = saved_governor
+        settings.llm_cache_enabled = saved_cache_enabled
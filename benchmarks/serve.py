@@ -0,0 +1,22 @@
+import argparse
+import json
+
+from benchmarks.provider import SimulatedProvider, simulated_backend
+
+# 基准测试用的服务进程：与 server.py 相同的 FastAPI 应用，但 LLM 调用由模拟 Provider 应答。
+# 由 benchmarks.load.benchmark_server 启动，一般不需要手动运行。
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="接入模拟 Provider 的 WebSocket 服务")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--provider", default="{}", help="SimulatedProvider.to_config() 的 JSON")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="保留真实 Provider 的限额")
+    args = parser.parse_args()
+
+    provider = SimulatedProvider.from_config(json.loads(args.provider))
+    with simulated_backend(provider, lift_rate_limits=not args.keep_rate_limits):
+        from server import app
+        uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+    print(f"[Bench] Simulated provider: {provider.stats()}")
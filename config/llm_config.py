@@ -1,11 +1,28 @@
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 from config.settings import settings
 
+class RateLimitConfig(BaseModel):
+    """限流额度，0 表示不限制"""
+    requests_per_minute: int = 0
+    tokens_per_minute: int = 0
+    max_in_flight: int = 0
+
 class LLMConfig(BaseModel):
     api_key: str
     base_url: str
     model_name: str
     temperature: float = 0.7
+    # 是否启用响应缓存：相同的 (模型, URL, 温度, JSON 模式, 消息) 直接复用上一次的结果
+    cache: bool = False
+    # 模型级限流 (在 Provider 级限流之外额外生效)，None 表示只受 Provider 限额约束
+    rate_limit: Optional[RateLimitConfig] = None
+    # 故障转移列表：本预设重试仍失败时，按顺序改用这些预设
+    fallbacks: List["LLMConfig"] = []
+    # 对冲请求：首个 Token 在 hedge_delay 秒内未到达时，向 hedge_config 再发一份相同的请求，
+    # 先产出 Token 的一路胜出，另一路被取消。None 表示不对冲
+    hedge_delay: Optional[float] = None
+    hedge_config: Optional["LLMConfig"] = None
 
 # --- 基础配置获取 ---
 # 优先使用 ChatAnywhere Key，如果没有则回退到 OpenAI Key (假设用户可能只配了一个)
@@ -16,6 +33,19 @@ CA_URL = settings.chatanywhere_base_url
 DS_KEY = settings.openai_api_key
 DS_URL = settings.openai_base_url
 
+# --- Provider 限流 (Rate Limits) ---
+# 所有预设共享同一个 ChatAnywhere Key/URL，专科并行调用 × 并发会话很容易触发 429，
+# 因此按 (base_url, api_key) 统一限流；未在此列出的 Provider 使用默认限额。
+DEFAULT_PROVIDER_RATE_LIMIT = RateLimitConfig(
+    requests_per_minute=settings.provider_requests_per_minute,
+    tokens_per_minute=settings.provider_tokens_per_minute,
+    max_in_flight=settings.provider_max_in_flight
+)
+
+PROVIDER_RATE_LIMITS: Dict[str, RateLimitConfig] = {
+    CA_URL: DEFAULT_PROVIDER_RATE_LIMIT,
+}
+
 # --- 模型预设 (Presets) ---
 
 # 1. GPT-5.1 (通过 ChatAnywhere)
@@ -72,7 +102,8 @@ QWEN_3_CONFIG = LLMConfig(
 
 AGENT_LLM_CONFIGS = {
     # 整理员：任务相对简单，使用 DeepSeek V3
-    "Case Organizer": DEEPSEEK_V3_CONFIG,
+    # 相同病历的整理结果可直接复用，开启响应缓存
+    "Case Organizer": DEEPSEEK_V3_CONFIG.model_copy(update={"cache": True}),
     
     # 主持人：需要极强的综合能力，使用 GPT-5.1
     "Moderator": GPT5_CONFIG,
@@ -90,9 +121,49 @@ AGENT_LLM_CONFIGS = {
     "Rheumatologist": QWEN_3_CONFIG,
 }
 
+# --- Agent 故障转移配置 ---
+# 主预设在重试后仍失败时，按顺序切换到这些预设 (同一模型会被自动跳过)
+
+AGENT_FAILOVER_CONFIGS: Dict[str, List[LLMConfig]] = {
+    "Case Organizer": [QWEN_3_CONFIG],
+    "Moderator": [DEEPSEEK_V3_CONFIG],
+    "Radiologist": [DEEPSEEK_V3_CONFIG],
+    "Pathologist": [DEEPSEEK_V3_CONFIG],
+    "Pulmonologist": [DEEPSEEK_V3_CONFIG],
+    "Rheumatologist": [DEEPSEEK_V3_CONFIG],
+}
+
+# --- Agent 对冲配置 ---
+# 主持人的总结/回复与路由调用直接决定用户感知的轮次耗时，
+# GPT-5.1 经中转的首 Token 长尾明显，超过 settings.llm_hedge_delay 仍无输出时向备用预设对冲
+
+AGENT_HEDGE_CONFIGS: Dict[str, LLMConfig] = {
+    "Moderator": DEEPSEEK_V3_CONFIG,
+}
+
+def apply_agent_policies(role_name: str, llm_config: LLMConfig) -> LLMConfig:
+    """
+    把按角色定义的策略 (响应缓存、故障转移列表、对冲请求) 附加到 llm_config 上。
+    前端为某个角色切换模型时，只替换模型本身，角色策略保持不变。
+    """
+    default_config = AGENT_LLM_CONFIGS.get(role_name, DEEPSEEK_V3_CONFIG)
+    update = {}
+    if default_config.cache and not llm_config.cache:
+        update["cache"] = True
+    if not llm_config.fallbacks:
+        fallbacks = [c for c in AGENT_FAILOVER_CONFIGS.get(role_name, []) if c.model_name != llm_config.model_name]
+        if fallbacks:
+            update["fallbacks"] = fallbacks
+    hedge_config = AGENT_HEDGE_CONFIGS.get(role_name)
+    if settings.llm_hedging_enabled and hedge_config and not llm_config.hedge_config \
+            and hedge_config.model_name != llm_config.model_name:
+        update["hedge_config"] = hedge_config
+        update["hedge_delay"] = settings.llm_hedge_delay
+    return llm_config.model_copy(update=update) if update else llm_config
+
 def get_config_for_agent(role_name: str) -> LLMConfig:
-    """根据角色名获取 LLM 配置，默认返回 DeepSeek V3"""
-    return AGENT_LLM_CONFIGS.get(role_name, DEEPSEEK_V3_CONFIG)
+    """根据角色名获取 LLM 配置 (含故障转移列表)，默认返回 DeepSeek V3"""
+    return apply_agent_policies(role_name, AGENT_LLM_CONFIGS.get(role_name, DEEPSEEK_V3_CONFIG))
 
 def create_config_from_model_name(model_name: str) -> LLMConfig:
     """根据模型名称创建配置对象"""
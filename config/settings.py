@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     """
@@ -21,6 +21,132 @@ class Settings(BaseSettings):
     # test_mode: bool = True 
     test_mode: bool = False
 
+    # LLM 响应缓存 (仅对 LLMConfig.cache=True 的调用生效)
+    # llm_cache_enabled: 全局开关
+    # llm_cache_max_entries: 内存 LRU 容量
+    # llm_cache_dir: 磁盘缓存目录 (留空则只使用内存缓存)
+    llm_cache_enabled: bool = True
+    llm_cache_max_entries: int = 512
+    llm_cache_dir: str = ".cache/llm"
+
+    # Provider 限流 (0 表示不限制)
+    # 默认额度作用于每个 (base_url, api_key)，可在 config/llm_config.py 中按 Provider 覆盖
+    llm_rate_limit_enabled: bool = True
+    provider_requests_per_minute: int = 0
+    provider_tokens_per_minute: int = 0
+    provider_max_in_flight: int = 16
+    # 预估单次调用的输出 Token 数 (用于 tokens/min 预扣，调用结束后按实际用量结算)
+    llm_output_token_estimate: int = 1024
+
+    # 重试策略 (超时、429、5xx、流中断等瞬时故障)
+    # llm_max_attempts: 每个预设的最大尝试次数 (含首次)，仍失败则切换到故障转移预设
+    llm_max_attempts: int = 3
+    llm_retry_base_delay: float = 1.0
+    llm_retry_max_delay: float = 20.0
+
+    # 对冲请求 (Hedged Request)：首 Token 超过 llm_hedge_delay 秒仍未到达时向备用预设再发一份请求
+    # 作用于 config/llm_config.py 中 AGENT_HEDGE_CONFIGS 列出的角色
+    llm_hedging_enabled: bool = True
+    llm_hedge_delay: float = 4.0
+
+    # 可取消传输：会诊以 CancellationToken 作为停止信号时，没有 stream_callback 的调用 (路由、冲突检测等)
+    # 也以流式传输并在本地拼接，停止时可立即关闭其 HTTP 连接，而不是等待完整回复
+    llm_cancellable_transport: bool = True
+
+    # 流式输出合并 (按 token 事件的 target 配置)：距上次发送超过 N 毫秒或攒够 M 个字符时才发送一次，
+    # 减少逐 Token 的事件与 WebSocket 发送开销。未列出的 target 使用 "default"，两者均为 0 表示不合并
+    stream_flush_interval_ms: Dict[str, int] = {
+        "opinion": 100,
+        "specialist_summary": 100,
+        "summary": 60,
+        "chat": 40,
+        "default": 50,
+    }
+    stream_flush_chars: Dict[str, int] = {
+        "opinion": 96,
+        "specialist_summary": 96,
+        "summary": 64,
+        "chat": 32,
+        "default": 64,
+    }
+
+    # 往期讨论历史的 Token 预算 (按角色，未列出的角色使用 "default")
+    # 完整历史超出预算时，最近 history_verbatim_rounds 轮保留原文，更早的轮次替换为滚动摘要
+    history_token_budgets: Dict[str, int] = {
+        "Radiologist": 6000,
+        "Pathologist": 6000,
+        "Pulmonologist": 6000,
+        "Rheumatologist": 6000,
+        "Moderator": 8000,
+        "default": 6000,
+    }
+    history_verbatim_rounds: int = 2
+    # 生成滚动摘要时输入的 Token 上限
+    history_summary_input_budget: int = 12000
+
+    # 专科医生合并输出模式：一次调用同时输出详细分析与总结 (以分隔标记分开)，
+    # 省去第二次调用及其对详细分析的重复输入；模型未输出分隔标记时自动退回单独生成总结
+    specialist_fused_mode: bool = False
+
+    # 条件跳过：本轮参与的专家少于 2 位时跳过冲突检测与团队讨论；
+    # 冲突检测未发现真实冲突时跳过团队讨论。被跳过的节点会收到 "skipped" 状态事件
+    skip_detection_below_two_specialists: bool = True
+    skip_discussion_without_conflicts: bool = True
+
+    # 规则路由：按路由 Prompt 中的触发条件在本地判定需要的专家，整体置信度低于阈值时才调用 LLM 路由
+    rule_router_enabled: bool = True
+    rule_router_min_confidence: float = 0.8
+
+    # 投机执行：路由 (Moderator_Router) 调用期间提前启动这些专家，未被选中则中止并丢弃结果
+    # 路由 Prompt 中呼吸科几乎总会被选中，默认只投机执行呼吸科；留空表示关闭
+    speculative_specialists: List[str] = ["Pulmonologist"]
+
+    # 专科意见跨轮次复用：相关病例字段、模型与 Prompt 均未变化且无相关新证据时，直接沿用上一轮意见
+    specialist_memoization_enabled: bool = True
+
+    # 病例整理补丁模式：后续轮次只让模型输出变化字段的补丁 (RFC 6902 风格)，在本地校验后应用；
+    # 补丁不合法时自动改用完整更新
+    organizer_patch_mode: bool = True
+
+    # 断点续跑：会诊图的每一步写入本地 SQLite checkpoint (每个会话每轮一个 thread)，
+    # 轮次中断 (断线、节点出错) 后可只执行未完成的节点；轮次正常结束后删除该轮的 checkpoint
+    checkpoint_enabled: bool = True
+    checkpoint_db_path: str = ".cache/checkpoints.sqlite"
+
+    # 专科节点截止时间 (秒)，按节点名配置，未配置的取 default；None 表示不限。默认关闭 (等待全部专家)，
+    # 例如 {"default": {"soft": 90.0, "hard": 240.0}}
+    # soft: 之后若本轮已达到法定人数即放弃该专家；hard: 之后无条件放弃 (状态 timed_out，取消在途调用)
+    node_deadlines: Dict[str, Dict[str, Optional[float]]] = {}
+    # 法定人数：被分派的 N 位专家中 K 位完成即可推进 (超过软截止时间的其余专家被放弃)，<= 0 表示需要全部完成
+    specialist_quorum: int = 0
+    # 分派专家后的最长等待时间 (秒)，到期后仍未完成的专家一律放弃；None 表示不限
+    specialist_quorum_window: Optional[float] = None
+
+    # 服务端会话存储：内存中最多保留 session_store_max_entries 个会话，空闲超过 session_ttl_seconds 秒即淘汰；
+    # 会话同时写入持久化后端 (session_backend: "sqlite" / "redis" / "none")，淘汰或服务重启后按需重新加载
+    session_store_max_entries: int = 200
+    session_ttl_seconds: Optional[float] = 1800.0
+    session_backend: str = "sqlite"
+    session_db_path: str = ".cache/sessions.sqlite"
+    session_redis_url: str = "redis://localhost:6379/0"
+
+    # 会诊日志 (logs/sessions/*.jsonl) 由后台线程追加写入：每批等待该秒数收集更多记录后统一 fsync
+    session_log_flush_interval: float = 0.2
+
+    # 会诊档案库：每轮同时写入带索引的 SQLite (core/archive.py)，可按日期、专家、模型、冲突严重程度查询
+    archive_enabled: bool = True
+    archive_db_path: str = "logs/archive.sqlite"
+
+    # 离线批量会诊 (python -m core.batch) 默认同时处理的病例数；实际吞吐仍受各模型提供方的限流约束
+    batch_concurrency: int = 4
+
+    # 编译后会诊图的 LRU 缓存容量 (按启用角色组合缓存)
+    graph_cache_size: int = 32
+
+    # WebSocket 会诊 (run_mdt_stream) 使用异步图：在服务的事件循环中以 astream 驱动，等待模型输出时不占用线程；
+    # False 时退回每轮一个工作线程驱动同步图
+    stream_async_graph: bool = True
+
     class Config:
         env_file = ".env"
         extra = "ignore" # 忽略多余的环境变量
@@ -0,0 +1,350 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+# 会诊档案库：把每轮会诊拆成带索引的表，支持按日期、专家、模型、冲突严重程度筛选，
+# 无需逐个打开 logs/sessions 下的日志文件。由 SessionLogger 的后台写入线程写入。
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    last_updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    session_id TEXT NOT NULL,
+    round_index INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    user_input TEXT,
+    summary TEXT,
+    discussion_notes TEXT,
+    structured_info TEXT,
+    new_evidence TEXT,
+    questions_to_user TEXT,
+    PRIMARY KEY (session_id, round_index)
+);
+CREATE INDEX IF NOT EXISTS idx_rounds_timestamp ON rounds (timestamp);
+CREATE TABLE IF NOT EXISTS agent_outputs (
+    session_id TEXT NOT NULL,
+    round_index INTEGER NOT NULL,
+    agent TEXT NOT NULL,
+    model TEXT,
+    selected INTEGER NOT NULL,
+    opinion TEXT,
+    summary TEXT,
+    PRIMARY KEY (session_id, round_index, agent)
+);
+CREATE INDEX IF NOT EXISTS idx_agent_outputs_agent ON agent_outputs (agent);
+CREATE INDEX IF NOT EXISTS idx_agent_outputs_model ON agent_outputs (model);
+CREATE TABLE IF NOT EXISTS selected_agents (
+    session_id TEXT NOT NULL,
+    round_index INTEGER NOT NULL,
+    agent TEXT NOT NULL,
+    PRIMARY KEY (session_id, round_index, agent)
+);
+CREATE INDEX IF NOT EXISTS idx_selected_agents_agent ON selected_agents (agent);
+CREATE TABLE IF NOT EXISTS conflicts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    round_index INTEGER NOT NULL,
+    issue TEXT,
+    severity TEXT,
+    description TEXT,
+    involved_agents TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_conflicts_round ON conflicts (session_id, round_index);
+CREATE INDEX IF NOT EXISTS idx_conflicts_severity ON conflicts (severity);
+"""
+
+# 每轮拆分出的子表 (重新保存同一轮时先整体删除再写入)
+ROUND_TABLES = ["rounds", "agent_outputs", "selected_agents", "conflicts"]
+
+# 批量查询各轮附加信息时每条语句包含的轮次数 (每轮占 2 个参数，远低于 SQLite 的参数上限)
+FACET_BATCH_SIZE = 400
+
+def _as_list(value: Union[str, Iterable[str], None]) -> List[str]:
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+class ConsultationArchive:
+    """
+    SQLite 会诊档案库。
+
+    写入：record_rounds() 接收 SessionLogger.build_round 生成的轮次数据 (附带 models: 角色 -> 模型名)，
+    同一轮重复写入时以最后一次为准。
+    查询：query_rounds() 按日期、专家、模型、冲突严重程度筛选轮次；get_round() 取一轮的完整内容。
+    """
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.commit()
+
+    # --- 写入 ---
+
+    def record_rounds(self, records: List[Dict[str, Any]]):
+        """
+        在一个事务中写入多轮会诊。
+        :param records: [{"session_id": ..., "round": build_round(...) 的结果, "models": {角色: 模型名}}]
+        """
+        with self._lock:
+            try:
+                for record in records:
+                    self._insert_round(record["session_id"], record["round"], record.get("models") or {})
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def delete_session(self, session_id: str):
+        """删除一个会话的全部轮次"""
+        with self._lock:
+            try:
+                for table in ROUND_TABLES + ["sessions"]:
+                    self._conn.execute(f"DELETE FROM {table} WHERE session_id = ?", (session_id,))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def _insert_round(self, session_id: str, round_data: Dict[str, Any], models: Dict[str, str]):
+        """写入一轮 (调用方需持有锁并负责提交)"""
+        round_index = round_data["round_index"]
+        timestamp = round_data["timestamp"]
+        process = round_data.get("process", {})
+        output = round_data.get("output", {})
+        key = (session_id, round_index)
+
+        for table in ROUND_TABLES:
+            self._conn.execute(f"DELETE FROM {table} WHERE session_id = ? AND round_index = ?", key)
+
+        self._conn.execute(
+            "INSERT INTO sessions (session_id, created_at, last_updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET "
+            "created_at = MIN(created_at, excluded.created_at), last_updated = MAX(last_updated, excluded.last_updated)",
+            (session_id, timestamp, timestamp)
+        )
+        self._conn.execute(
+            "INSERT INTO rounds VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            key + (
+                timestamp,
+                round_data.get("user_input"),
+                output.get("summary"),
+                process.get("discussion_notes"),
+                json.dumps(process.get("structured_info", {}), ensure_ascii=False),
+                json.dumps(round_data.get("new_evidence", {}), ensure_ascii=False),
+                json.dumps(output.get("questions_to_user", []), ensure_ascii=False)
+            )
+        )
+
+        selected = process.get("selected_agents") or []
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO selected_agents VALUES (?, ?, ?)",
+            [key + (agent,) for agent in selected]
+        )
+
+        opinions = process.get("specialist_opinions") or {}
+        summaries = process.get("specialist_summaries") or {}
+        outputs = [
+            key + (agent, models.get(agent), int(agent in selected), opinion, summaries.get(agent))
+            for agent, opinion in opinions.items()
+        ]
+        if output.get("summary"):
+            outputs.append(key + ("Moderator", models.get("Moderator"), 1, None, output.get("summary")))
+        self._conn.executemany("INSERT INTO agent_outputs VALUES (?, ?, ?, ?, ?, ?, ?)", outputs)
+
+        conflicts = [c for c in process.get("conflicts") or [] if isinstance(c, dict)]
+        self._conn.executemany(
+            "INSERT INTO conflicts (session_id, round_index, issue, severity, description, involved_agents) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                key + (c.get("issue"), c.get("severity"), c.get("description"), json.dumps(c.get("involved_agents", []), ensure_ascii=False))
+                for c in conflicts
+            ]
+        )
+
+    # --- 查询 ---
+
+    def query_rounds(self,
+                     since: Optional[str] = None,
+                     until: Optional[str] = None,
+                     agent: Union[str, Iterable[str], None] = None,
+                     model: Union[str, Iterable[str], None] = None,
+                     severity: Union[str, Iterable[str], None] = None,
+                     session_id: Optional[str] = None,
+                     limit: int = 100,
+                     offset: int = 0) -> List[Dict[str, Any]]:
+        """
+        按条件筛选轮次，按时间倒序返回。
+
+        :param since / until: ISO 日期或时间 (如 "2026-01-01")，按轮次时间筛选；until 只给出日期时包含当天
+        :param agent: 本轮被选中的专家 (任一匹配)
+        :param model: 本轮任一角色使用的模型 (任一匹配)
+        :param severity: 本轮检测到的冲突严重程度 ("high" / "medium" / "low"，任一匹配)
+        :return: [{session_id, round_index, timestamp, user_input, summary, selected_agents, models, conflict_severities}]
+        """
+        conditions, params = [], []
+        if since:
+            conditions.append("r.timestamp >= ?")
+            params.append(since)
+        if until:
+            conditions.append("r.timestamp < ?")
+            # 只给出日期时包含当天：取次日零点作为上界
+            params.append((date.fromisoformat(until) + timedelta(days=1)).isoformat() if "T" not in until else until)
+        if session_id:
+            conditions.append("r.session_id = ?")
+            params.append(session_id)
+        for values, table, column in (
+            (_as_list(agent), "selected_agents", "agent"),
+            (_as_list(model), "agent_outputs", "model"),
+            (_as_list(severity), "conflicts", "severity"),
+        ):
+            if not values:
+                continue
+            placeholders = ", ".join("?" for _ in values)
+            conditions.append(
+                f"EXISTS (SELECT 1 FROM {table} t WHERE t.session_id = r.session_id "
+                f"AND t.round_index = r.round_index AND t.{column} IN ({placeholders}))"
+            )
+            params.extend(values)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = (
+            "SELECT r.session_id, r.round_index, r.timestamp, r.user_input, r.summary FROM rounds r "
+            f"{where} ORDER BY r.timestamp DESC LIMIT ? OFFSET ?"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit, offset]).fetchall()
+            facets = self._round_facets([(row["session_id"], row["round_index"]) for row in rows])
+        results = []
+        for row in rows:
+            result = dict(row)
+            result.update(facets[(row["session_id"], row["round_index"])])
+            results.append(result)
+        return results
+
+    def _round_facets(self, keys: List[Tuple[str, int]]) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        """
+        多轮的选中专家、各角色模型与冲突严重程度 (调用方需持有锁)。
+        每张子表按轮次批量查询一次，而不是每轮各查三次。
+        """
+        facets = {key: {"selected_agents": [], "models": {}, "conflict_severities": []} for key in keys}
+        keys = list(facets)
+        for start in range(0, len(keys), FACET_BATCH_SIZE):
+            batch = keys[start:start + FACET_BATCH_SIZE]
+            in_keys = f"(session_id, round_index) IN (VALUES {', '.join('(?, ?)' for _ in batch)})"
+            params = [value for key in batch for value in key]
+            for r in self._conn.execute(f"SELECT session_id, round_index, agent FROM selected_agents WHERE {in_keys}", params):
+                facets[(r[0], r[1])]["selected_agents"].append(r[2])
+            for r in self._conn.execute(f"SELECT session_id, round_index, agent, model FROM agent_outputs WHERE {in_keys}", params):
+                facets[(r[0], r[1])]["models"][r[2]] = r[3]
+            for r in self._conn.execute(f"SELECT session_id, round_index, severity FROM conflicts WHERE {in_keys} ORDER BY id", params):
+                facets[(r[0], r[1])]["conflict_severities"].append(r[2])
+        return facets
+
+    def get_round(self, session_id: str, round_index: int) -> Optional[Dict[str, Any]]:
+        """一轮会诊的完整内容 (各角色输出与冲突明细)，不存在时返回 None"""
+        key = (session_id, round_index)
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM rounds WHERE session_id = ? AND round_index = ?", key).fetchone()
+            if row is None:
+                return None
+            result = dict(row)
+            for field in ("structured_info", "new_evidence", "questions_to_user"):
+                result[field] = json.loads(result[field]) if result[field] else None
+            result["selected_agents"] = self._round_facets([key])[key]["selected_agents"]
+            result["agent_outputs"] = [dict(r) for r in self._conn.execute(
+                "SELECT agent, model, selected, opinion, summary FROM agent_outputs WHERE session_id = ? AND round_index = ?", key)]
+            result["conflicts"] = []
+            for r in self._conn.execute(
+                    "SELECT issue, severity, description, involved_agents FROM conflicts WHERE session_id = ? AND round_index = ? ORDER BY id", key):
+                conflict = dict(r)
+                conflict["involved_agents"] = json.loads(conflict["involved_agents"] or "[]")
+                result["conflicts"].append(conflict)
+        return result
+
+    # --- 导入已有日志 ---
+
+    def import_logs(self, log_dir: str) -> int:
+        """
+        把日志目录中已有的会诊记录导入档案库 (JSONL 日志与旧的嵌套 JSON 日志均可)，返回导入的轮数。
+        两种格式同时存在时以 JSONL 为准 (在 JSON 之后导入)。
+        """
+        count = 0
+        for path in sorted(glob.glob(os.path.join(log_dir, "*.json"))):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    log_data = json.load(f)
+            except Exception as e:
+                print(f"[Archive] Skipping {path}: {e}")
+                continue
+            records = [{"session_id": log_data["session_id"], "round": r} for r in log_data.get("rounds", [])]
+            self.record_rounds(records)
+            count += len(records)
+
+        for path in sorted(glob.glob(os.path.join(log_dir, "*.jsonl"))):
+            session_id = os.path.splitext(os.path.basename(path))[0]
+            records = []
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    records.append({"session_id": session_id, "round": record["round"], "models": record.get("models")})
+            self.record_rounds(records)
+            count += len(records)
+        return count
+
+_archive = None
+_archive_lock = threading.Lock()
+
+def get_archive() -> Optional[ConsultationArchive]:
+    """懒加载全局档案库 (settings.archive_db_path)；未启用时返回 None"""
+    global _archive
+    from config.settings import settings
+
+    if not settings.archive_enabled:
+        return None
+    with _archive_lock:
+        if _archive is None:
+            _archive = ConsultationArchive(settings.archive_db_path)
+    return _archive
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="会诊档案库")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="导入已有的会诊日志")
+    import_parser.add_argument("log_dir", nargs="?", default="logs/sessions")
+    query_parser = subparsers.add_parser("query", help="筛选轮次 (JSON 输出)")
+    query_parser.add_argument("--since")
+    query_parser.add_argument("--until")
+    query_parser.add_argument("--agent", action="append")
+    query_parser.add_argument("--model", action="append")
+    query_parser.add_argument("--severity", action="append")
+    query_parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    archive = get_archive()
+    if archive is None:
+        parser.error("settings.archive_enabled 未开启")
+    if args.command == "import":
+        print(f"Imported {archive.import_logs(args.log_dir)} rounds from {args.log_dir}")
+    else:
+        results = archive.query_rounds(since=args.since, until=args.until, agent=args.agent,
+                                       model=args.model, severity=args.severity, limit=args.limit)
+        print(json.dumps(results, ensure_ascii=False, indent=2))
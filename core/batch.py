@@ -0,0 +1,249 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from config.settings import settings
+from core.shared_state import SharedState
+from core.pipeline_api import run_mdt_round
+from core.session_logger import SessionLogger, session_logger
+from llm.cancellation import CancellationToken
+
+# 离线批量会诊：从 JSONL 文件逐行读取病例，用工作线程池并发跑完整的会诊流程 (含多轮补充信息)，
+# 每完成一个病例立即追加一行结果。中断后重新运行同一命令即可续跑：已成功的病例会被跳过。
+#
+# 输入 (每行一个病例)：
+#   {"case_id": "...", "case_text": "...", "follow_ups": ["第二轮补充信息", ...],
+#    "agents": [...] (可选), "model_configs": {"Radiologist": "gpt-5.1"} (可选)}
+# 输出 (每行一个病例)：
+#   {"case_id", "status": "ok" / "error", "rounds": [...], "errors": [...], "elapsed"}
+#   rounds 中每轮的格式与会诊日志相同 (SessionLogger.build_round)。
+
+# 与前端默认勾选的角色一致
+DEFAULT_AGENTS = ["Case Organizer", "Radiologist", "Pathologist", "Pulmonologist", "Rheumatologist", "Moderator"]
+
+def read_cases(input_path: str) -> Iterator[Dict[str, Any]]:
+    """逐行读取病例 (不把整个文件读入内存)；缺少 case_id 时以行号代替，无法解析的行跳过"""
+    with open(input_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                case = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"[Batch] Skipping malformed line {line_number} in {input_path}: {e}")
+                continue
+            if not case.get("case_text"):
+                print(f"[Batch] Skipping line {line_number} in {input_path}: missing case_text")
+                continue
+            case["case_id"] = str(case.get("case_id") or f"line-{line_number}")
+            yield case
+
+def load_completed(output_path: str) -> Set[str]:
+    """已有结果文件中成功完成的病例 ID (同一病例有多行时以最后一行为准)"""
+    latest: Dict[str, str] = {}
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 进程被强制结束时可能留下写了一半的最后一行
+                continue
+            latest[record["case_id"]] = record.get("status")
+    return {case_id for case_id, status in latest.items() if status == "ok"}
+
+def failed_outputs(state: SharedState) -> List[str]:
+    """
+    本轮执行失败的角色及其错误信息：节点在 agent_status 中报告 error (如 LLM 调用失败)。
+    这类失败不会以 error 事件上报，但带着错误文本的轮次不能算作成功，否则续跑时不会重做。
+    """
+    # 各角色本轮的输出 (专科意见，或 chat_history 中最后一条发言) 中带有具体的错误原因
+    messages = {msg["role"]: msg["content"] for msg in state.chat_history}
+    return [
+        f"{role}: {state.specialist_opinions.get(role) or messages.get(role) or '执行失败'}"
+        for role, status in state.agent_status.items() if status == "error"
+    ]
+
+class BatchRunner:
+    """
+    批量会诊运行器。
+
+    - 病例按需从输入文件读取，在途病例最多为并发数的两倍，输入文件再大也不会全部驻留内存；
+    - 每个病例在独立的 SharedState 上按 case_text + follow_ups 依次跑多轮会诊；
+    - 结果由主线程逐行追加并 fsync，进程随时被中断都不会丢失已写入的结果；
+    - 续跑粒度为病例：已成功的病例跳过，失败或中断的病例从第一轮重新开始；
+      任一角色的输出为失败结果 (见 failed_outputs) 时该病例记为失败。
+    """
+    def __init__(self, input_path: str, output_path: str, concurrency: Optional[int] = None,
+                 agents: Optional[List[str]] = None, model_configs: Optional[Dict[str, str]] = None,
+                 log_sessions: bool = False):
+        """
+        :param concurrency: 同时处理的病例数，默认 settings.batch_concurrency
+        :param agents: 默认启用的角色 (病例可用 "agents" 覆盖)
+        :param model_configs: 默认的模型选择 (病例可用 "model_configs" 覆盖)
+        :param log_sessions: 为 True 时每轮同时写入会诊日志与档案库 (会话 ID 为 batch-{case_id})；
+            病例重新运行时先清除上次运行留下的日志与档案记录
+        """
+        self.input_path = input_path
+        self.output_path = output_path
+        self.concurrency = max(1, concurrency or settings.batch_concurrency)
+        self.agents = agents or DEFAULT_AGENTS
+        self.model_configs = model_configs or {}
+        self.log_sessions = log_sessions
+        # 所有病例共用一个取消令牌：stop() 时中止全部在途的 LLM 调用
+        self.stop_event = CancellationToken()
+        self.counts = {"ok": 0, "error": 0, "skipped": 0, "interrupted": 0}
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run_case(self, case: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """在当前线程中跑完一个病例的全部轮次；被中断时返回 None (不写入结果，续跑时重做)"""
+        started_at = time.monotonic()
+        agents = case.get("agents") or self.agents
+        model_configs = {**self.model_configs, **(case.get("model_configs") or {})}
+        inputs = [case["case_text"]] + list(case.get("follow_ups") or [])
+        state = SharedState()
+        rounds, errors = [], []
+        session_id = f"batch-{case['case_id']}"
+        if self.log_sessions:
+            # 失败或中断后重跑时从第一轮重新开始，不能与上次运行的轮次混在同一会话中
+            session_logger.delete_session(session_id)
+
+        for case_text in inputs:
+            if self.stop_event.is_set():
+                return None
+            state.add_user_input(case_text)
+            try:
+                errors.extend(run_mdt_round(state, agents, model_configs, self.stop_event))
+            except Exception as e:
+                errors.append(f"Pipeline error: {e}")
+            if self.stop_event.is_set():
+                return None
+            errors.extend(failed_outputs(state))
+            rounds.append(SessionLogger.build_round(state))
+            if self.log_sessions:
+                session_logger.save_round(session_id, state, model_configs)
+            if errors:
+                # 本轮失败时后续轮次缺少可靠的前提，不再继续
+                break
+
+        return {
+            "case_id": case["case_id"],
+            "status": "error" if errors else "ok",
+            "rounds": rounds,
+            "errors": errors,
+            "elapsed": round(time.monotonic() - started_at, 3)
+        }
+
+    def _write(self, output, record: Dict[str, Any]):
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+        os.fsync(output.fileno())
+
+    def _report(self, record: Dict[str, Any], started_at: float):
+        finished = self.counts["ok"] + self.counts["error"]
+        minutes = max(time.monotonic() - started_at, 1e-6) / 60
+        print(f"[Batch] {record['case_id']}: {record['status']} ({len(record['rounds'])} rounds, {record['elapsed']:.1f}s) | "
+              f"done {finished} (ok {self.counts['ok']}, error {self.counts['error']}), {finished / minutes:.1f} cases/min")
+
+    def run(self) -> Dict[str, int]:
+        """处理输入文件中所有未完成的病例，返回各状态的病例数"""
+        completed = load_completed(self.output_path)
+        directory = os.path.dirname(self.output_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        needs_newline = os.path.exists(self.output_path) and os.path.getsize(self.output_path) > 0
+        if needs_newline:
+            with open(self.output_path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+
+        cases = read_cases(self.input_path)
+        seen: Set[str] = set()
+        pending: Dict[Future, str] = {}
+        started_at = time.monotonic()
+        print(f"[Batch] {self.input_path} -> {self.output_path} (concurrency {self.concurrency}, {len(completed)} cases already done)")
+
+        def submit_more(executor):
+            while len(pending) < self.concurrency * 2 and not self.stop_event.is_set():
+                case = next(cases, None)
+                if case is None:
+                    return
+                case_id = case["case_id"]
+                if case_id in completed:
+                    self.counts["skipped"] += 1
+                    continue
+                if case_id in seen:
+                    print(f"[Batch] Skipping duplicate case_id {case_id}")
+                    continue
+                seen.add(case_id)
+                pending[executor.submit(self.run_case, case)] = case_id
+
+        with open(self.output_path, 'a', encoding='utf-8') as output, \
+                ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="mdt-batch") as executor:
+            if needs_newline:
+                output.write("\n")
+            try:
+                submit_more(executor)
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        case_id = pending.pop(future)
+                        try:
+                            record = future.result()
+                        except Exception as e:
+                            record = {"case_id": case_id, "status": "error", "rounds": [], "errors": [str(e)], "elapsed": 0.0}
+                        if record is None:
+                            self.counts["interrupted"] += 1
+                            continue
+                        self.counts[record["status"]] += 1
+                        self._write(output, record)
+                        self._report(record, started_at)
+                    submit_more(executor)
+            except KeyboardInterrupt:
+                print("[Batch] Interrupted, cancelling in-flight cases (rerun the same command to resume)...")
+                self.stop()
+                for future in pending:
+                    future.cancel()
+                self.counts["interrupted"] += len(pending)
+                raise
+            finally:
+                if self.stop_event.is_set():
+                    stats = self.stop_event.latency_stats()
+                    print(f"[Batch] Aborted {stats['count']} in-flight LLM calls")
+
+        elapsed = time.monotonic() - started_at
+        print(f"[Batch] Finished in {elapsed:.1f}s: {self.counts}")
+        return self.counts
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="离线批量会诊 (可中断续跑)")
+    parser.add_argument("input", help="病例文件 (JSONL)")
+    parser.add_argument("--output", required=True, help="结果文件 (JSONL，追加写入；再次运行时跳过已成功的病例)")
+    parser.add_argument("--concurrency", type=int, default=None, help=f"同时处理的病例数 (默认 {settings.batch_concurrency})")
+    parser.add_argument("--agents", nargs="+", default=None, help="启用的角色 (默认全部)")
+    parser.add_argument("--model", action="append", default=[], metavar="ROLE=MODEL", help="为角色指定模型，可重复")
+    parser.add_argument("--log-sessions", action="store_true", help="同时写入会诊日志与档案库")
+    args = parser.parse_args()
+
+    model_configs = {}
+    for item in args.model:
+        role, _, model_name = item.partition("=")
+        if not model_name:
+            parser.error(f"--model 格式应为 ROLE=MODEL: {item}")
+        model_configs[role] = model_name
+
+    runner = BatchRunner(args.input, args.output, concurrency=args.concurrency, agents=args.agents,
+                         model_configs=model_configs, log_sessions=args.log_sessions)
+    try:
+        counts = runner.run()
+    except KeyboardInterrupt:
+        sys.exit(130)
+    sys.exit(1 if counts["error"] else 0)
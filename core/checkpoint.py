@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+from config.settings import settings
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+except ImportError:  # 需要 langgraph-checkpoint-sqlite，缺失时关闭断点续跑
+    SqliteSaver = None
+
+if SqliteSaver is not None:
+    class _ThreadedSqliteSaver(SqliteSaver):
+        """
+        SqliteSaver 只实现了同步接口；异步图 (astream) 调用的 a* 方法在这里转到线程中执行同步版本，
+        同步图与异步图因此可以共用同一个 checkpoint 库 (SqliteSaver 内部对连接加锁)。
+        """
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, *, filter=None, before=None, limit=None):
+            items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+            for item in items:
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id):
+            await asyncio.to_thread(self.delete_thread, thread_id)
+
+_checkpointer = None
+_checkpointer_loaded = False
+_checkpointer_lock = threading.Lock()
+
+def get_checkpointer():
+    """
+    懒加载全局的 SQLite Checkpointer (settings.checkpoint_db_path)。
+    未启用或依赖缺失时返回 None，此时图不做 checkpoint，行为与之前一致。
+    SqliteSaver 内部对连接加锁，可在多个会话线程间共享；同时支持同步图与异步图。
+    """
+    global _checkpointer, _checkpointer_loaded
+    if _checkpointer_loaded:
+        return _checkpointer
+    with _checkpointer_lock:
+        if not _checkpointer_loaded:
+            if settings.checkpoint_enabled:
+                if SqliteSaver is None:
+                    print("[Checkpoint] langgraph-checkpoint-sqlite not installed, checkpointing disabled")
+                else:
+                    directory = os.path.dirname(settings.checkpoint_db_path)
+                    if directory:
+                        os.makedirs(directory, exist_ok=True)
+                    conn = sqlite3.connect(settings.checkpoint_db_path, check_same_thread=False)
+                    _checkpointer = _ThreadedSqliteSaver(conn)
+            _checkpointer_loaded = True
+    return _checkpointer
+
+def thread_id_for(session_id: str, round_count: int) -> str:
+    """每个会话的每一轮对应一个 LangGraph thread"""
+    return f"{session_id}:round-{round_count}"
+
+def delete_thread(thread_id: Optional[str]):
+    """删除某一轮的全部 checkpoint (轮次正常结束、或重新开始该轮时调用)"""
+    checkpointer = get_checkpointer()
+    if checkpointer is None or not thread_id:
+        return
+    try:
+        checkpointer.delete_thread(thread_id)
+    except Exception as e:
+        print(f"[Checkpoint] Failed to delete thread {thread_id}: {e}")
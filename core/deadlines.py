@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, wait as wait_futures
+from typing import Callable, Dict, List, Optional
+
+from config.settings import settings
+
+# 等待专家结果时检查截止时间的间隔 (秒)；法定人数达成后，仍在运行的专家最迟在一个间隔内被放弃
+POLL_INTERVAL = 0.2
+
+def node_limits(role_name: str) -> Dict[str, Optional[float]]:
+    """某个节点的 soft / hard 截止时间 (秒，None 表示不限)，未单独配置时取 default"""
+    deadlines = settings.node_deadlines
+    limits = {**deadlines.get("default", {}), **deadlines.get(role_name, {})}
+    return {"soft": limits.get("soft"), "hard": limits.get("hard")}
+
+class RoundDeadlines:
+    """
+    单轮会诊的专家截止时间与法定人数 (quorum) 策略，每次运行一个实例，经 RunContext 传给节点。
+
+    每位专家从节点开始执行起计时，在以下任一时刻被放弃 (状态 timed_out，在途的 LLM 调用被取消)：
+    - 超过 hard 截止时间；
+    - 路由分派专家 (begin) 之后超过 window 秒；
+    - 被分派的 N 位专家中已有 K 位完成 (quorum)，且该专家已超过 soft 截止时间。
+    未达成法定人数时，超过 soft 截止时间只记录一条警告；未配置 soft 的专家不会因法定人数被放弃。
+    """
+    def __init__(self, specialists: List[str], quorum: int = 0, window: Optional[float] = None):
+        """
+        :param specialists: 本次运行启用的专科医生 (路由选中的专家中只有这些会被执行)
+        :param quorum: 法定人数 K (<= 0 表示需要全部完成)，超过本轮被分派人数 N 时按 N 计
+        :param window: 分派后的最长等待时间 (秒)，None 表示不限
+        """
+        self.specialists = specialists
+        self.quorum = quorum
+        self.window = window
+        self.dispatched: List[str] = []
+        self.dispatched_at: Optional[float] = None
+        self.finished: List[str] = []
+        self.quorum_reached_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def begin(self, selected_agents: List[str]):
+        """路由完成、专家开始并行执行时调用"""
+        with self._lock:
+            self.dispatched = [name for name in selected_agents if name in self.specialists]
+            self.dispatched_at = time.monotonic()
+            self.finished = []
+            self.quorum_reached_at = None
+
+    def mark_finished(self, role_name: str):
+        """专家完成 (包括直接复用上一轮意见) 时调用；超时放弃的专家不计入"""
+        with self._lock:
+            if role_name in self.finished:
+                return
+            self.finished.append(role_name)
+            needed = len(self.dispatched)
+            if self.quorum > 0:
+                needed = min(self.quorum, needed)
+            if self.dispatched and self.quorum_reached_at is None and len(self.finished) >= needed:
+                self.quorum_reached_at = time.monotonic()
+
+    def cutoff(self, role_name: str, started_at: float) -> Optional[float]:
+        """该专家当前的放弃时刻 (time.monotonic 时间)，None 表示不限"""
+        limits = node_limits(role_name)
+        candidates = []
+        if limits["hard"] is not None:
+            candidates.append(started_at + limits["hard"])
+        with self._lock:
+            if self.window is not None and self.dispatched_at is not None:
+                candidates.append(self.dispatched_at + self.window)
+            if self.quorum_reached_at is not None and limits["soft"] is not None:
+                candidates.append(max(self.quorum_reached_at, started_at + limits["soft"]))
+        return min(candidates) if candidates else None
+
+    def reason(self, role_name: str, started_at: float) -> str:
+        """放弃原因 (用于日志)"""
+        limits = node_limits(role_name)
+        now = time.monotonic()
+        if limits["hard"] is not None and now >= started_at + limits["hard"]:
+            return f"超过硬截止时间 {limits['hard']:g}s"
+        if self.quorum_reached_at is not None:
+            return f"已有 {len(self.finished)}/{len(self.dispatched)} 位专家完成，且超过软截止时间"
+        return f"超过分派后的等待窗口 {self.window:g}s"
+
+    def _check(self, role_name: str, started_at: float, warned: List[bool], log_callback: Optional[Callable]) -> bool:
+        """返回是否已到放弃时刻；首次超过 soft 截止时间时记录警告"""
+        now = time.monotonic()
+        soft = node_limits(role_name)["soft"]
+        if soft is not None and not warned[0] and now >= started_at + soft:
+            warned[0] = True
+            if log_callback:
+                log_callback(f"[{role_name}] 已超过软截止时间 {soft:g}s，仍在等待")
+        cutoff = self.cutoff(role_name, started_at)
+        return cutoff is not None and now >= cutoff
+
+    def wait(self, future: Future, role_name: str, started_at: float, log_callback: Optional[Callable] = None) -> bool:
+        """等待专家结果 (同步)：完成返回 True，到达放弃时刻返回 False (调用方负责取消)"""
+        warned = [False]
+        while True:
+            done, _ = wait_futures([future], timeout=POLL_INTERVAL)
+            if done:
+                return True
+            if self._check(role_name, started_at, warned, log_callback):
+                return False
+
+    async def await_done(self, awaitable, role_name: str, started_at: float, log_callback: Optional[Callable] = None) -> bool:
+        """wait 的异步版本 (awaitable 为 asyncio Task / Future)"""
+        warned = [False]
+        while True:
+            done, _ = await asyncio.wait({awaitable}, timeout=POLL_INTERVAL)
+            if done:
+                return True
+            if self._check(role_name, started_at, warned, log_callback):
+                return False
+
+def make_round_deadlines(enabled_agents: List[str], specialists) -> Optional[RoundDeadlines]:
+    """按配置为本次运行创建 RoundDeadlines；未配置任何截止时间与窗口时返回 None (保持等待全部专家)"""
+    has_limits = any(v is not None for limits in settings.node_deadlines.values() for v in limits.values())
+    if not has_limits and settings.specialist_quorum_window is None:
+        return None
+    return RoundDeadlines(
+        [name for name in enabled_agents if name in specialists],
+        quorum=settings.specialist_quorum,
+        window=settings.specialist_quorum_window
+    )
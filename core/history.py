@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from config.settings import settings
+from config.llm_config import get_config_for_agent
+from llm.client import llm_client
+from llm.tokenizer import count_tokens, truncate_to_tokens
+
+SUMMARIZER_ROLE = "History Summarizer"
+
+SUMMARY_ROLE_DEFINITION = "你是 MDT 会诊的记录员，负责把往期会诊记录压缩为供专家快速回顾的摘要。"
+
+SUMMARY_INSTRUCTION = """请将以上往期会诊记录压缩为一份要点摘要：
+1. 保留每轮基层医生提供的关键新信息 (症状、检查、检验、病理结果等)；
+2. 保留 MDT 的主要诊断倾向、鉴别诊断与建议，以及意见的变化过程；
+3. 保留尚未解决的问题和待补充的检查；
+4. 不要编造记录中没有的内容，使用简洁的条目形式。"""
+
+def format_history_message(msg: Dict[str, str]) -> Optional[str]:
+    """默认的历史格式：所有角色的发言"""
+    return f"【{msg['role']}】: {msg['content']}"
+
+def split_rounds(chat_history: List[Dict[str, str]]) -> List[List[Dict[str, str]]]:
+    """按轮次切分对话历史：每一轮以基层医生 (role == "user") 的输入开始"""
+    rounds = []
+    for msg in chat_history:
+        if msg.get("role") == "user" or not rounds:
+            rounds.append([])
+        rounds[-1].append(msg)
+    return rounds
+
+def _render(rounds: List[List[Dict[str, str]]], formatter: Callable = format_history_message) -> str:
+    lines = []
+    for round_messages in rounds:
+        for msg in round_messages:
+            line = formatter(msg)
+            if line is not None:
+                lines.append(line)
+    return "\n".join(lines)
+
+class RollingSummaryCache:
+    """
+    往期轮次的滚动摘要缓存。
+
+    - 摘要以 "前 n 轮记录的内容哈希" 为键，同一会话同一轮内所有 Agent 共用一份；
+    - 新一轮的摘要在上一份摘要的基础上只追加新落入 "往期" 的轮次 (滚动更新)；
+    - 并发请求同一份摘要时只有一个线程调用 LLM，其余线程等待其结果 (single-flight)。
+    """
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._done: "OrderedDict[str, str]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(rounds: List[List[Dict[str, str]]]) -> str:
+        return hashlib.sha256(_render(rounds).encode("utf-8")).hexdigest()
+
+    def peek(self, rounds: List[List[Dict[str, str]]]) -> Optional[str]:
+        with self._lock:
+            return self._done.get(self._key(rounds))
+
+    def get(self, rounds: List[List[Dict[str, str]]]) -> Optional[str]:
+        """获取 (必要时生成) 这些轮次的摘要；生成失败时返回 None"""
+        key = self._key(rounds)
+        with self._lock:
+            if key in self._done:
+                self._done.move_to_end(key)
+                return self._done[key]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                future = self._pending[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        summary = None
+        try:
+            summary = self._summarize(rounds)
+        except Exception as e:
+            print(f"[History] Failed to summarize {len(rounds)} earlier rounds: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+                if summary:
+                    self._done[key] = summary
+                    while len(self._done) > self.max_entries:
+                        self._done.popitem(last=False)
+            future.set_result(summary)
+        return summary
+
+    def _summarize(self, rounds: List[List[Dict[str, str]]]) -> Optional[str]:
+        # 滚动更新：若已有前 n-1 轮的摘要，只需把第 n 轮并入
+        previous = self.peek(rounds[:-1]) if len(rounds) > 1 else None
+        if previous:
+            new_text = _render(rounds[-1:])
+            source = f"【已有往期摘要 (第 1-{len(rounds) - 1} 轮)】\n{previous}\n\n【新增第 {len(rounds)} 轮记录】\n{new_text}"
+        else:
+            source = f"【往期会诊记录 (第 1-{len(rounds)} 轮)】\n{_render(rounds)}"
+        source = truncate_to_tokens(source, settings.history_summary_input_budget) or ""
+
+        response = llm_client.get_completion(
+            messages=[
+                {"role": "system", "content": SUMMARY_ROLE_DEFINITION},
+                {"role": "user", "content": f"{source}\n\n{SUMMARY_INSTRUCTION}"}
+            ],
+            stream=False,
+            config=get_config_for_agent(SUMMARIZER_ROLE),
+            use_cache=True
+        )
+        # 调用失败时抛出 LLMCallFailed，由 get 记录并放弃本次摘要
+        if not response:
+            print("[History] Summarizer returned no usable output")
+            return None
+        return response
+
+class HistoryContextBuilder:
+    """
+    为 Agent 构造 "往期讨论历史" 上下文，并控制在各 Agent 的 Token 预算之内。
+
+    - 完整历史不超过预算时原样使用；
+    - 超过预算时，最近 verbatim_rounds 轮保留原文 (仍超出则从较早的消息开始省略)，
+      更早的轮次替换为滚动摘要 (RollingSummaryCache，每轮只生成一次，所有 Agent 共用)。
+    """
+    def __init__(self, summary_cache: RollingSummaryCache, verbatim_rounds: int = 2):
+        self.summary_cache = summary_cache
+        self.verbatim_rounds = max(1, verbatim_rounds)
+
+    @staticmethod
+    def budget_for(role_name: str) -> int:
+        budgets = settings.history_token_budgets
+        return budgets.get(role_name, budgets.get("default", 6000))
+
+    def _split(self, chat_history: List[Dict[str, str]]):
+        rounds = split_rounds(chat_history)
+        return rounds[:-self.verbatim_rounds], rounds[-self.verbatim_rounds:]
+
+    def build(self, chat_history: List[Dict[str, str]], budget: int, formatter: Callable = format_history_message, empty_text: str = "无往期讨论记录。") -> str:
+        """
+        :param budget: 历史部分允许占用的 Token 数
+        :param formatter: 把一条消息格式化为一行文本，返回 None 表示跳过该消息
+        """
+        if not chat_history:
+            return empty_text
+
+        full_text = _render([chat_history], formatter)
+        if count_tokens(full_text) <= budget:
+            return full_text or empty_text
+
+        older, recent = self._split(chat_history)
+        sections = []
+        remaining = budget
+        if older:
+            summary = self.summary_cache.get(older)
+            if summary:
+                header = truncate_to_tokens(f"【往期讨论摘要 (第 1-{len(older)} 轮)】\n{summary}", budget // 2)
+            else:
+                header = f"(更早的 {len(older)} 轮讨论已省略)"
+            if header:
+                sections.append(header)
+                remaining -= count_tokens(header)
+
+        # 从最新的消息往前保留，放不下的较早消息省略
+        kept = []
+        lines = [line for line in (formatter(m) for r in recent for m in r) if line is not None]
+        for line in reversed(lines):
+            cost = count_tokens(line) + 1
+            if cost <= remaining:
+                kept.append(line)
+                remaining -= cost
+                continue
+            if not kept:
+                # 最新的一条消息本身就超出预算：截断保留开头部分
+                truncated = truncate_to_tokens(line, max(remaining, 0))
+                if truncated:
+                    kept.append(truncated)
+            break
+        if len(kept) < len(lines):
+            kept.append("(较早的部分消息已省略)")
+        sections.append("\n".join(reversed(kept)))
+        return "\n\n".join(s for s in sections if s) or empty_text
+
+    def build_for(self, role_name: str, chat_history: List[Dict[str, str]], formatter: Callable = format_history_message, empty_text: str = "无往期讨论记录。") -> str:
+        return self.build(chat_history, self.budget_for(role_name), formatter, empty_text)
+
+    async def abuild_for(self, role_name: str, chat_history: List[Dict[str, str]], formatter: Callable = format_history_message, empty_text: str = "无往期讨论记录。") -> str:
+        """build_for 的异步版本：可能需要等待摘要生成，放到线程中执行以免阻塞事件循环"""
+        return await asyncio.to_thread(self.build_for, role_name, chat_history, formatter, empty_text)
+
+    def prefetch(self, chat_history: List[Dict[str, str]]):
+        """
+        轮次开始时在后台预先生成往期摘要，
+        等专科医生开始分析时摘要通常已经就绪，不占用关键路径。
+        """
+        older, _ = self._split(chat_history)
+        if not older:
+            return
+        min_budget = min(settings.history_token_budgets.values() or [0])
+        if count_tokens(_render([chat_history])) <= min_budget:
+            return
+        threading.Thread(target=self.summary_cache.get, args=(older,), daemon=True).start()
+
+history_builder = HistoryContextBuilder(
+    RollingSummaryCache(),
+    verbatim_rounds=settings.history_verbatim_rounds
+)
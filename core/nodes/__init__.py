@@ -1,14 +1,25 @@
-from .organizer import case_organizer_node
-from .specialists import specialist_node_factory
-from .moderator import moderator_node, moderator_router_node
-from .conflict_detector import conflict_detector_node
-from .discussion import discussion_node
+from .organizer import case_organizer_node, case_organizer_node_async
+from .specialists import specialist_node_factory, create_specialist, SPECIALIST_AGENTS
+from .moderator import moderator_node, moderator_router_node, moderator_node_async, moderator_router_node_async
+from .conflict_detector import conflict_detector_node, conflict_detector_node_async, has_real_conflicts
+from .discussion import discussion_node, discussion_node_async
+from .context import RunContext, get_run_context
 
 __all__ = [
     "case_organizer_node",
     "specialist_node_factory",
+    "create_specialist",
+    "SPECIALIST_AGENTS",
     "moderator_node",
     "moderator_router_node",
     "conflict_detector_node",
-    "discussion_node"
+    "discussion_node",
+    "case_organizer_node_async",
+    "moderator_node_async",
+    "moderator_router_node_async",
+    "conflict_detector_node_async",
+    "discussion_node_async",
+    "has_real_conflicts",
+    "RunContext",
+    "get_run_context"
 ]
@@ -1,37 +1,49 @@
 from typing import Dict, Callable, Optional
+from langchain_core.runnables import RunnableConfig
 from core.shared_state import SharedState, AgentGraphState
+from core.nodes.context import get_run_context
 from agents.conflict_detector.agent import ConflictDetectorAgent
 from config.llm_config import create_config_from_model_name
 
-def conflict_detector_node(state: AgentGraphState, ui_callback=None, stream_callback_factory: Optional[Callable] = None, log_callback=None, model_configs: Dict[str, str] = None, stop_event=None) -> Dict:
-    """冲突检测节点函数"""
-    print("DEBUG: Entering conflict_detector_node")
-    if stop_event and stop_event.is_set():
-        return {}
+# _finish_detector 为 UI 展示注入的说明条目，并非真正的冲突
+SYNTHETIC_SEVERITIES = {"info", "success"}
 
+def has_real_conflicts(conflicts: list) -> bool:
+    """冲突列表中是否有需要团队讨论的真实冲突 (排除 info / success 说明条目)"""
+    return any(c.get("severity") not in SYNTHETIC_SEVERITIES for c in conflicts or [] if isinstance(c, dict))
+
+def _prepare_detector(state: AgentGraphState, ui_callback=None, stream_callback_factory: Optional[Callable] = None, log_callback=None, model_configs: Dict[str, str] = None):
     llm_config = None
     if model_configs and "Conflict Detector" in model_configs:
         llm_config = create_config_from_model_name(model_configs["Conflict Detector"])
-        
+
     agent = ConflictDetectorAgent(llm_config=llm_config)
-    
+
     if ui_callback:
         ui_callback("Conflict Detector", "working")
-        
+
     if log_callback:
         log_callback(f"[Conflict Detector] 正在检测意见冲突... (Model: {agent.llm_config.model_name})")
-        
-    temp_state = SharedState(**state)
-    
+
+    temp_state = SharedState.from_graph_state(state)
+
     # 准备流式输出 (虽然通常不需要，但为了 UI 统一)
     stream_callback = None
     if stream_callback_factory:
         stream_callback = stream_callback_factory("Conflict Detector", agent.llm_config.model_name)
-    
-    conflicts = agent.run(temp_state, stream_callback=stream_callback)
-    
+
+    return agent, temp_state, stream_callback
+
+def _finish_detector(temp_state: SharedState, conflicts: list, ui_callback=None, log_callback=None, error: Optional[str] = None) -> Dict:
+    status = "error" if error else "done"
     # 如果没有冲突，为了 UI 显示，添加一条说明信息
-    if not conflicts:
+    if error:
+        conflicts = [{
+            "issue": "冲突检测失败",
+            "description": f"未能完成冲突检测: {error}",
+            "severity": "info"
+        }]
+    elif not conflicts:
         summaries = temp_state.specialist_summaries
         if len(summaries) < 2:
              conflicts = [{
@@ -47,16 +59,39 @@ def conflict_detector_node(state: AgentGraphState, ui_callback=None, stream_call
              }]
 
     if log_callback:
-        if conflicts:
+        if error:
+            log_callback(f"[Conflict Detector] 冲突检测失败: {error}")
+        elif conflicts:
             log_callback(f"[Conflict Detector] 检测到 {len(conflicts)} 个冲突点。")
         else:
             log_callback(f"[Conflict Detector] 未检测到明显冲突。")
-            
+
     if ui_callback:
-        ui_callback("Conflict Detector", "done")
+        ui_callback("Conflict Detector", status)
 
     print(f"DEBUG: Exiting conflict_detector_node with {len(conflicts)} conflicts")
     return {
         "conflicts": conflicts,
-        "agent_status": {"Conflict Detector": "done"}
+        "agent_status": {"Conflict Detector": status}
     }
+
+def conflict_detector_node(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+    """冲突检测节点函数"""
+    ctx = get_run_context(config)
+    print("DEBUG: Entering conflict_detector_node")
+    if ctx.stopped():
+        return {}
+
+    agent, temp_state, stream_callback = _prepare_detector(state, ctx.ui_callback, ctx.stream_callback_factory, ctx.log_callback, ctx.model_configs)
+    conflicts = agent.run(temp_state, stream_callback=stream_callback)
+    return _finish_detector(temp_state, conflicts, ctx.ui_callback, ctx.log_callback, agent.last_error)
+
+async def conflict_detector_node_async(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+    """conflict_detector_node 的异步版本"""
+    ctx = get_run_context(config)
+    if ctx.stopped():
+        return {}
+
+    agent, temp_state, stream_callback = _prepare_detector(state, ctx.ui_callback, ctx.stream_callback_factory, ctx.log_callback, ctx.model_configs)
+    conflicts = await agent.arun(temp_state, stream_callback=stream_callback)
+    return _finish_detector(temp_state, conflicts, ctx.ui_callback, ctx.log_callback, agent.last_error)
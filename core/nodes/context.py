@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from langchain_core.runnables import RunnableConfig
+
+# RunContext 在 config["configurable"] 中的键名
+RUN_CONTEXT_KEY = "mdt_run_context"
+
+@dataclass
+class RunContext:
+    """
+    单次会诊运行的上下文：UI / 日志 / 流式回调、前端选择的模型、停止信号与投机执行调度器。
+
+    编译后的图在多个会话、多个轮次之间复用，因此这些每次运行都不同的对象
+    不再通过 partial 绑定到节点函数上，而是随 app.stream(..., config=ctx.to_config()) 传入，
+    节点通过 get_run_context(config) 取回。
+    """
+    ui_callback: Optional[Callable] = None
+    stream_callback_factory: Optional[Callable] = None
+    log_callback: Optional[Callable] = None
+    # 节点的部分结果回调 partial_callback(role, data)，例如病例整理过程中已完成的字段
+    partial_callback: Optional[Callable] = None
+    model_configs: Optional[Dict[str, str]] = None
+    stop_event: Optional[object] = None
+    # 投机执行调度器 (core.speculation.SpeculativeDispatcher)，None 表示不投机
+    speculation: Optional[object] = None
+    # 专家截止时间与法定人数策略 (core.deadlines.RoundDeadlines)，None 表示等待全部专家
+    deadlines: Optional[object] = None
+    # 使用 checkpoint 的图需要的 thread_id (见 core.checkpoint)
+    thread_id: Optional[str] = None
+
+    def stopped(self) -> bool:
+        return bool(self.stop_event and self.stop_event.is_set())
+
+    def to_config(self) -> RunnableConfig:
+        configurable = {RUN_CONTEXT_KEY: self}
+        if self.thread_id:
+            configurable["thread_id"] = self.thread_id
+        return {"configurable": configurable}
+
+_EMPTY_CONTEXT = RunContext()
+
+def get_run_context(config: Optional[RunnableConfig]) -> RunContext:
+    """从 LangGraph 注入的 config 中取出 RunContext，未提供时返回空上下文 (无回调)"""
+    if not config:
+        return _EMPTY_CONTEXT
+    return config.get("configurable", {}).get(RUN_CONTEXT_KEY) or _EMPTY_CONTEXT
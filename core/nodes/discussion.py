@@ -1,36 +1,60 @@
+from langchain_core.runnables import RunnableConfig
 from core.shared_state import AgentGraphState, SharedState
+from core.nodes.context import get_run_context
 from agents.discussion.agent import DiscussionAgent
 from core.schemas import StreamEvent
 from config.llm_config import create_config_from_model_name
 
-def discussion_node(state: AgentGraphState, ui_callback=None, stream_callback_factory=None, log_callback=None, model_configs=None, stop_event=None):
-    """
-    Team Discussion 节点
-    """
-    print("DEBUG: Entering discussion_node")
+def _prepare_discussion(state: AgentGraphState, ui_callback=None, stream_callback_factory=None, model_configs=None):
     # 检查是否有冲突，如果没有冲突，可能不需要讨论 (或者讨论只是确认一致)
     # 但为了流程完整性，我们总是运行，让 Agent 自己判断
-    
+
     if ui_callback:
         ui_callback("Team Discussion", "working")
-        
+
     llm_config = None
     if model_configs and "Team Discussion" in model_configs:
         llm_config = create_config_from_model_name(model_configs["Team Discussion"])
-        
+
     agent = DiscussionAgent(llm_config=llm_config)
-    
+
     stream_callback = None
     if stream_callback_factory:
         stream_callback = stream_callback_factory("Team Discussion", agent.llm_config.model_name)
-    
+
     # 将 AgentGraphState (dict) 转换为 SharedState (Pydantic model)
-    temp_state = SharedState(**state)
-        
-    result = agent.run(temp_state, stream_callback=stream_callback)
-    
+    temp_state = SharedState.from_graph_state(state)
+
+    return agent, temp_state, stream_callback
+
+def _finish_discussion(result, ui_callback=None, log_callback=None, error=None):
+    if error and log_callback:
+        log_callback(f"[Team Discussion] 团队讨论失败: {error}")
     if ui_callback:
-        ui_callback("Team Discussion", "done")
-        
+        ui_callback("Team Discussion", "error" if error else "done")
+
     print(f"DEBUG: Exiting discussion_node with result: {str(result)[:50]}...")
-    return {"discussion_notes": result}
+    output = {"discussion_notes": result}
+    if error:
+        # 讨论失败时状态报告为 error (纪要为空，Moderator 仍基于各专科意见总结)
+        output["agent_status"] = {"Team Discussion": "error"}
+    return output
+
+def discussion_node(state: AgentGraphState, config: RunnableConfig = None):
+    """
+    Team Discussion 节点
+    """
+    print("DEBUG: Entering discussion_node")
+    ctx = get_run_context(config)
+    agent, temp_state, stream_callback = _prepare_discussion(state, ctx.ui_callback, ctx.stream_callback_factory, ctx.model_configs)
+    result = agent.run(temp_state, stream_callback=stream_callback)
+    return _finish_discussion(result, ctx.ui_callback, ctx.log_callback, agent.last_error)
+
+async def discussion_node_async(state: AgentGraphState, config: RunnableConfig = None):
+    """
+    Team Discussion 节点 (异步版本)
+    """
+    ctx = get_run_context(config)
+    agent, temp_state, stream_callback = _prepare_discussion(state, ctx.ui_callback, ctx.stream_callback_factory, ctx.model_configs)
+    result = await agent.arun(temp_state, stream_callback=stream_callback)
+    return _finish_discussion(result, ctx.ui_callback, ctx.log_callback, agent.last_error)
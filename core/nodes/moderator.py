@@ -1,37 +1,40 @@
 from typing import Dict, Callable, Optional
+from langchain_core.runnables import RunnableConfig
 from core.shared_state import SharedState, AgentGraphState
+from core.nodes.context import RunContext, get_run_context
 from agents.moderator.agent import ModeratorAgent
+from agents.specialist import SpecialistAgent
 from config.llm_config import create_config_from_model_name
 
-def moderator_node(state: AgentGraphState, ui_callback=None, stream_callback_factory: Optional[Callable] = None, log_callback=None, model_configs: Dict[str, str] = None, stop_event=None) -> Dict:
-    """Moderator 节点函数"""
-    if stop_event and stop_event.is_set():
-        return {}
-
+def _create_moderator(model_configs: Dict[str, str] = None) -> ModeratorAgent:
     llm_config = None
     if model_configs and "Moderator" in model_configs:
         llm_config = create_config_from_model_name(model_configs["Moderator"])
-        
-    agent = ModeratorAgent(llm_config=llm_config)
-    
+    return ModeratorAgent(llm_config=llm_config)
+
+def _prepare_moderator(state: AgentGraphState, ui_callback=None, stream_callback_factory: Optional[Callable] = None, log_callback=None, model_configs: Dict[str, str] = None):
+    """准备总结阶段的 Agent、临时状态和流式回调"""
+    agent = _create_moderator(model_configs)
+
     if ui_callback:
         ui_callback("Moderator", "working")
-        
+
     if log_callback:
         log_callback(f"[Moderator] 开始总结会诊意见... (Model: {agent.llm_config.model_name})")
-        
-    temp_state = SharedState(**state)
-    
+
+    temp_state = SharedState.from_graph_state(state)
+
     # 准备流式输出
     chat_stream_callback = None
     summary_stream_callback = None
-    
+
     if stream_callback_factory:
         chat_stream_callback = stream_callback_factory("Moderator", agent.llm_config.model_name, target="chat")
         summary_stream_callback = stream_callback_factory("Moderator", agent.llm_config.model_name, target="summary")
-    
-    result = agent.run(temp_state, stream_callback=chat_stream_callback, summary_stream_callback=summary_stream_callback)
-    
+
+    return agent, temp_state, chat_stream_callback, summary_stream_callback
+
+def _finish_moderator(result, ui_callback=None, log_callback=None) -> Dict:
     # 处理返回结果
     if isinstance(result, dict):
         patient_reply = result.get("content", "")
@@ -39,42 +42,107 @@ def moderator_node(state: AgentGraphState, ui_callback=None, stream_callback_fac
     else:
         patient_reply = result
         medical_summary = result
-    
+
+    # 总结失败 (如 LLM 调用失败) 时状态报告为 error
+    status = "error" if SpecialistAgent.is_failed_result(result) else "done"
     if log_callback:
-        log_callback(f"[Moderator] 完成总结。")
-        
+        log_callback(f"[Moderator] 总结失败: {patient_reply}" if status == "error" else f"[Moderator] 完成总结。")
+
     if ui_callback:
-        ui_callback("Moderator", "done")
+        ui_callback("Moderator", status)
 
     return {
         "moderator_summary": medical_summary,
         "chat_history": [{"role": "Moderator", "content": patient_reply}],
-        "agent_status": {"Moderator": "done"}
+        "agent_status": {"Moderator": status}
     }
 
-def moderator_router_node(state: AgentGraphState, ui_callback=None, stream_callback_factory=None, log_callback=None, model_configs: Dict[str, str] = None, stop_event=None) -> Dict:
-    """Moderator 路由节点函数"""
-    if stop_event and stop_event.is_set():
+def moderator_node(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+    """Moderator 节点函数"""
+    ctx = get_run_context(config)
+    if ctx.stopped():
         return {}
 
-    llm_config = None
-    if model_configs and "Moderator" in model_configs:
-        llm_config = create_config_from_model_name(model_configs["Moderator"])
-        
-    agent = ModeratorAgent(llm_config=llm_config)
-    
+    agent, temp_state, chat_stream_callback, summary_stream_callback = _prepare_moderator(state, ctx.ui_callback, ctx.stream_callback_factory, ctx.log_callback, ctx.model_configs)
+    result = agent.run(temp_state, stream_callback=chat_stream_callback, summary_stream_callback=summary_stream_callback)
+    return _finish_moderator(result, ctx.ui_callback, ctx.log_callback)
+
+async def moderator_node_async(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+    """moderator_node 的异步版本"""
+    ctx = get_run_context(config)
+    if ctx.stopped():
+        return {}
+
+    agent, temp_state, chat_stream_callback, summary_stream_callback = _prepare_moderator(state, ctx.ui_callback, ctx.stream_callback_factory, ctx.log_callback, ctx.model_configs)
+    result = await agent.arun(temp_state, stream_callback=chat_stream_callback, summary_stream_callback=summary_stream_callback)
+    return _finish_moderator(result, ctx.ui_callback, ctx.log_callback)
+
+def _prepare_router(state: AgentGraphState, ui_callback=None, log_callback=None, model_configs: Dict[str, str] = None):
+    agent = _create_moderator(model_configs)
+
     if ui_callback:
         ui_callback("Moderator", "planning")
-        
+
     if log_callback:
         log_callback(f"[Moderator] 正在规划会诊流程... (Model: {agent.llm_config.model_name})")
-        
-    temp_state = SharedState(**state)
-    
-    selected_agents = agent.plan(temp_state)
-    
-    if log_callback:
-        log_callback(f"[Moderator] 决定邀请以下专家: {', '.join(selected_agents)}")
-        
+
+    return agent, SharedState.from_graph_state(state)
+
+def _start_speculation(state: AgentGraphState, ctx: RunContext):
+    """与 LLM 路由调用并行，提前启动先验概率高的专家 (见 core.speculation)；规则路由命中时不需要"""
+    if not ctx.speculation:
+        return
+    started = ctx.speculation.start(state)
+    if started and ctx.log_callback:
+        ctx.log_callback(f"[Moderator] 路由期间提前启动: {', '.join(started)}")
+
+def _report_routing(agent: ModeratorAgent, ctx: RunContext):
+    """记录本次路由走的是规则还是 LLM"""
+    decision = agent.last_routing
+    if not decision:
+        return
+    if decision.path == "rules":
+        message = f"[Moderator] 规则路由 (置信度 {decision.confidence:.2f})，未调用 LLM"
+    elif not decision.reasons:
+        message = "[Moderator] 已由 LLM 路由 (规则路由未启用)"
+    else:
+        message = f"[Moderator] 规则路由置信度不足 ({decision.confidence:.2f})，已由 LLM 路由"
+    print(f"{message} | " + "; ".join(decision.reasons))
+    if ctx.log_callback:
+        ctx.log_callback(message)
+
+def _finish_router(agent: ModeratorAgent, selected_agents, ctx: RunContext) -> Dict:
+    _report_routing(agent, ctx)
+    # 专家开始并行执行：截止时间窗口与法定人数从此刻起算
+    if ctx.deadlines:
+        ctx.deadlines.begin(selected_agents)
+    if ctx.log_callback:
+        ctx.log_callback(f"[Moderator] 决定邀请以下专家: {', '.join(selected_agents)}")
+
+    # 未被选中的投机任务立即中止，结果丢弃
+    if ctx.speculation:
+        discarded = ctx.speculation.discard_unselected(selected_agents)
+        if discarded and ctx.log_callback:
+            ctx.log_callback(f"[Moderator] 丢弃未被选中的提前执行: {', '.join(discarded)}")
+
     return {"selected_agents": selected_agents}
 
+def moderator_router_node(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+    """Moderator 路由节点函数"""
+    ctx = get_run_context(config)
+    if ctx.stopped():
+        return {}
+
+    agent, temp_state = _prepare_router(state, ctx.ui_callback, ctx.log_callback, ctx.model_configs)
+    selected_agents = agent.plan(temp_state, before_llm=lambda: _start_speculation(state, ctx))
+    return _finish_router(agent, selected_agents, ctx)
+
+async def moderator_router_node_async(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+    """moderator_router_node 的异步版本"""
+    ctx = get_run_context(config)
+    if ctx.stopped():
+        return {}
+
+    agent, temp_state = _prepare_router(state, ctx.ui_callback, ctx.log_callback, ctx.model_configs)
+    selected_agents = await agent.aplan(temp_state, before_llm=lambda: _start_speculation(state, ctx))
+    return _finish_router(agent, selected_agents, ctx)
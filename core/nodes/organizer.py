@@ -1,55 +1,85 @@
 from typing import Dict, Callable, Optional
+from langchain_core.runnables import RunnableConfig
 from core.shared_state import SharedState, AgentGraphState
+from core.nodes.context import RunContext, get_run_context
 from agents.case_organizer.agent import CaseOrganizerAgent
 from config.llm_config import create_config_from_model_name
 
-def case_organizer_node(state: AgentGraphState, ui_callback=None, stream_callback_factory: Optional[Callable] = None, log_callback=None, model_configs: Dict[str, str] = None, stop_event=None) -> Dict:
-    # 检查是否已停止
-    if stop_event and stop_event.is_set():
-        return {}
-
+def _prepare_organizer(state: AgentGraphState, ui_callback=None, stream_callback_factory: Optional[Callable] = None, log_callback=None, model_configs: Dict[str, str] = None):
+    """准备 Agent、临时状态和流式回调"""
     llm_config = None
     if model_configs and "Case Organizer" in model_configs:
         llm_config = create_config_from_model_name(model_configs["Case Organizer"])
-        
+
     agent = CaseOrganizerAgent(llm_config=llm_config)
-    
+
     # UI 更新：开始工作
     if ui_callback:
         ui_callback(agent.role_name, "working")
-    
+
     # 获取当前使用的模型名称
     model_name = agent.llm_config.model_name
     start_log = f"[{agent.role_name}] 开始整理病例... (Model: {model_name})"
     if log_callback:
         log_callback(start_log)
-        
-    temp_state = SharedState(**state)
-    
+
+    temp_state = SharedState.from_graph_state(state)
+
     # 准备流式输出
     stream_callback = None
     if stream_callback_factory:
         stream_callback = stream_callback_factory(agent.role_name, model_name)
 
-    result = agent.run(temp_state, stream_callback=stream_callback)
-    
-    end_log = f"[{agent.role_name}] 完成: {result[:50]}..."
+    return agent, temp_state, stream_callback
+
+def _finish_organizer(agent: CaseOrganizerAgent, temp_state: SharedState, result: str, ui_callback=None, log_callback=None) -> Dict:
+    """汇报完成状态并构造节点输出"""
+    model_name = agent.llm_config.model_name
+    # 整理失败 (LLM 调用失败、输出格式错误) 时状态报告为 error，structured_info 保持不变
+    status = "error" if agent.last_error else "idle"
+    end_log = f"[{agent.role_name}] 整理失败: {agent.last_error[:200]}" if agent.last_error else f"[{agent.role_name}] 完成: {result[:50]}..."
     if log_callback:
         log_callback(end_log)
 
     # UI 更新：完成工作
     if ui_callback:
-        ui_callback(agent.role_name, "idle")
-    
+        ui_callback(agent.role_name, status)
+
     return {
         "structured_info": temp_state.structured_info,
         "new_evidence": temp_state.new_evidence,
         "chat_history": [
             {"role": agent.role_name, "content": result, "model": model_name}
         ],
-        "agent_status": {agent.role_name: "idle"},
+        "agent_status": {agent.role_name: status},
         # execution_logs 已经在 log_callback 中处理了，这里返回空或者不返回
         # 但为了兼容性，还是返回，虽然可能会重复如果外部也处理
         # 我们修改 run_mdt_round 不再依赖这里的 execution_logs 来更新 UI
-        "execution_logs": [] 
+        "execution_logs": []
     }
+
+def _partial_callback(agent: CaseOrganizerAgent, ctx: RunContext):
+    """把生成过程中已完成的病例字段作为部分结果上报 (前端可提前展示)"""
+    if not ctx.partial_callback:
+        return None
+    return lambda structured_info: ctx.partial_callback(agent.role_name, {"structured_info": structured_info})
+
+def case_organizer_node(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+    ctx = get_run_context(config)
+    # 检查是否已停止
+    if ctx.stopped():
+        return {}
+
+    agent, temp_state, stream_callback = _prepare_organizer(state, ctx.ui_callback, ctx.stream_callback_factory, ctx.log_callback, ctx.model_configs)
+    result = agent.run(temp_state, stream_callback=stream_callback, partial_callback=_partial_callback(agent, ctx))
+    return _finish_organizer(agent, temp_state, result, ctx.ui_callback, ctx.log_callback)
+
+async def case_organizer_node_async(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+    """case_organizer_node 的异步版本 (用于 astream 驱动的图)"""
+    ctx = get_run_context(config)
+    if ctx.stopped():
+        return {}
+
+    agent, temp_state, stream_callback = _prepare_organizer(state, ctx.ui_callback, ctx.stream_callback_factory, ctx.log_callback, ctx.model_configs)
+    result = await agent.arun(temp_state, stream_callback=stream_callback, partial_callback=_partial_callback(agent, ctx))
+    return _finish_organizer(agent, temp_state, result, ctx.ui_callback, ctx.log_callback)
@@ -1,44 +1,106 @@
+import asyncio
+import time
 from typing import Dict, Callable, Optional
+from langchain_core.runnables import RunnableConfig
 from core.shared_state import SharedState, AgentGraphState
+from core.nodes.context import RunContext, get_run_context
+from core.speculation import SpeculativeRun
 from config.llm_config import create_config_from_model_name
 
-def specialist_node_factory(agent_cls, role_name: str, ui_callback=None, stream_callback_factory: Optional[Callable] = None, log_callback=None, model_configs: Dict[str, str] = None, stop_event=None):
-    """工厂函数，用于生成各专科医生的节点函数"""
-    def node_func(state: AgentGraphState) -> Dict:
-        # 检查是否已停止
-        if stop_event and stop_event.is_set():
-            return {}
+from agents.radiologist.agent import RadiologistAgent
+from agents.pathologist.agent import PathologistAgent
+from agents.pulmonologist.agent import PulmonologistAgent
+from agents.rheumatologist.agent import RheumatologistAgent
+
+# 专科医生映射
+SPECIALIST_AGENTS = {
+    "Radiologist": RadiologistAgent,
+    "Pathologist": PathologistAgent,
+    "Pulmonologist": PulmonologistAgent,
+    "Rheumatologist": RheumatologistAgent
+}
+
+def create_specialist(role_name: str, model_configs: Dict[str, str] = None, agent_cls=None):
+    """按前端选择的模型 (如有) 创建专科医生 Agent"""
+    llm_config = None
+    if model_configs and role_name in model_configs:
+        llm_config = create_config_from_model_name(model_configs[role_name])
+    return (agent_cls or SPECIALIST_AGENTS[role_name])(llm_config=llm_config)
+
+def specialist_node_factory(agent_cls, role_name: str, use_async: bool = False):
+    """
+    工厂函数，用于生成各专科医生的节点函数
+    回调、模型选择与停止信号在运行时通过 config 中的 RunContext 传入 (见 core.nodes.context)。
+    :param use_async: 为 True 时返回协程节点 (基于 agent.arun)，用于 astream 驱动的图
+    """
+    def prepare(state: AgentGraphState, ctx: RunContext):
+        # 路由期间已投机启动的任务直接接管，否则按前端选择的模型创建 Agent
+        speculative_run = ctx.speculation.claim(role_name) if ctx.speculation else None
+        agent = speculative_run.agent if speculative_run else create_specialist(role_name, ctx.model_configs, agent_cls)
+        temp_state = SharedState.from_graph_state(state)
+        fingerprint = agent.input_fingerprint(temp_state)
+        return agent, temp_state, fingerprint, speculative_run
+
+    def reuse(agent, temp_state: SharedState, fingerprint: str, speculative_run, ctx: RunContext) -> Optional[Dict]:
+        """输入未变化时直接返回上一轮的意见 (状态报告为 cached)，否则返回 None"""
+        cached = agent.reuse_previous(temp_state, fingerprint)
+        if cached is None:
+            return None
+        if speculative_run:
+            speculative_run.cancel()
+        if ctx.ui_callback:
+            ctx.ui_callback(agent.role_name, "cached")
+        if ctx.log_callback:
+            ctx.log_callback(f"[{agent.role_name}] 相关病例信息未变化，沿用上一轮意见 (cached)")
+        return finish(agent, cached, fingerprint, ctx)
+
+    def give_up(agent, started_at: float, ctx: RunContext) -> Dict:
+        """
+        超过截止时间被放弃：状态报告为 timed_out，并撤回该专家上一轮沿用下来的意见、总结与指纹
+        (值为 None，见 merge_dicts)，本轮冲突检测、讨论与总结都不包含该专家，下一轮被唤醒时重新分析。
+        """
+        if ctx.log_callback:
+            ctx.log_callback(f"[{agent.role_name}] 放弃等待 ({ctx.deadlines.reason(agent.role_name, started_at)})，已取消在途调用 (timed_out)")
+        if ctx.ui_callback:
+            ctx.ui_callback(agent.role_name, "timed_out")
+        return {
+            "specialist_opinions": {agent.role_name: None},
+            "specialist_summaries": {agent.role_name: None},
+            "specialist_fingerprints": {agent.role_name: None},
+            "chat_history": [],
+            "agent_status": {agent.role_name: "timed_out"},
+            "execution_logs": []
+        }
+
+    def start_streams(agent, speculative_run, ctx: RunContext):
+        ui_callback, stream_callback_factory, log_callback = ctx.ui_callback, ctx.stream_callback_factory, ctx.log_callback
 
-        # 确定 LLM 配置
-        llm_config = None
-        if model_configs and role_name in model_configs:
-            llm_config = create_config_from_model_name(model_configs[role_name])
-            
-        agent = agent_cls(llm_config=llm_config)
-        
         if ui_callback:
             ui_callback(agent.role_name, "working")
-            
+
         # 获取当前使用的模型名称
         model_name = agent.llm_config.model_name
         start_log = f"[{agent.role_name}] 开始分析... (Model: {model_name})"
+        if speculative_run:
+            start_log += " [已在路由期间提前开始]"
         if log_callback:
             log_callback(start_log)
-            
-        temp_state = SharedState(**state)
-        
+
         # 准备流式输出
         chat_stream_callback = None
         summary_stream_callback = None
-        
+
         if stream_callback_factory:
             # 详细分析 -> 专科意见 (target="opinion")
             chat_stream_callback = stream_callback_factory(agent.role_name, model_name, target="opinion")
             # 总结 -> 专科总结 (target="specialist_summary")
             summary_stream_callback = stream_callback_factory(agent.role_name, model_name, target="specialist_summary")
-            
-        result = agent.run(temp_state, stream_callback=chat_stream_callback, summary_stream_callback=summary_stream_callback)
-        
+
+        return chat_stream_callback, summary_stream_callback
+
+    def finish(agent, result, fingerprint: str, ctx: RunContext) -> Dict:
+        ui_callback, log_callback = ctx.ui_callback, ctx.log_callback
+
         # 处理返回结果
         if isinstance(result, dict):
             detailed_opinion = result.get("content", "")
@@ -46,19 +108,85 @@ def specialist_node_factory(agent_cls, role_name: str, ui_callback=None, stream_
         else:
             detailed_opinion = result
             summary_opinion = result
-        
-        end_log = f"[{agent.role_name}] 提交意见: {len(detailed_opinion)} chars"
+
+        # 分析失败 (如 LLM 调用失败) 时状态报告为 error；
+        # 失败的结果不记录指纹 (清空上一轮的指纹)，下一轮被唤醒时重新分析而不是沿用错误
+        failed = agent.is_failed_result(result)
+        status = "error" if failed else "idle"
+        if failed:
+            fingerprint = ""
+
+        end_log = f"[{agent.role_name}] 分析失败: {detailed_opinion}" if failed else f"[{agent.role_name}] 提交意见: {len(detailed_opinion)} chars"
         if log_callback:
             log_callback(end_log)
-            
+
         if ui_callback:
-            ui_callback(agent.role_name, "idle")
-            
+            ui_callback(agent.role_name, status)
+
+        if ctx.deadlines:
+            ctx.deadlines.mark_finished(agent.role_name)
+
         return {
             "specialist_opinions": {agent.role_name: detailed_opinion},
             "specialist_summaries": {agent.role_name: summary_opinion},
+            "specialist_fingerprints": {agent.role_name: fingerprint},
             "chat_history": [], # 专科医生的详细意见不再放入 chat_history，而是只在右侧显示
-            "agent_status": {agent.role_name: "idle"},
+            "agent_status": {agent.role_name: status},
             "execution_logs": []
         }
-    return node_func
+
+    def node_func(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+        ctx = get_run_context(config)
+        # 检查是否已停止
+        if ctx.stopped():
+            return {}
+
+        agent, temp_state, fingerprint, speculative_run = prepare(state, ctx)
+        cached_output = reuse(agent, temp_state, fingerprint, speculative_run, ctx)
+        if cached_output is not None:
+            return cached_output
+
+        chat_stream_callback, summary_stream_callback = start_streams(agent, speculative_run, ctx)
+        started_at = time.monotonic()
+        if ctx.deadlines:
+            # 有截止时间时在后台线程中运行 (与投机执行相同)，以便超时后取消并立即返回
+            run = speculative_run
+            if not run:
+                run = SpeculativeRun(role_name, agent, ctx.stop_event)
+                run.start(temp_state)
+            future = run.attach(chat_stream_callback, summary_stream_callback)
+            if not ctx.deadlines.wait(future, role_name, started_at, ctx.log_callback):
+                run.cancel()
+                return give_up(agent, started_at, ctx)
+            result = future.result()
+        elif speculative_run:
+            result = speculative_run.attach(chat_stream_callback, summary_stream_callback).result()
+        else:
+            result = agent.run(temp_state, stream_callback=chat_stream_callback, summary_stream_callback=summary_stream_callback)
+        return finish(agent, result, fingerprint, ctx)
+
+    async def async_node_func(state: AgentGraphState, config: RunnableConfig = None) -> Dict:
+        ctx = get_run_context(config)
+        if ctx.stopped():
+            return {}
+
+        agent, temp_state, fingerprint, speculative_run = prepare(state, ctx)
+        cached_output = reuse(agent, temp_state, fingerprint, speculative_run, ctx)
+        if cached_output is not None:
+            return cached_output
+
+        chat_stream_callback, summary_stream_callback = start_streams(agent, speculative_run, ctx)
+        started_at = time.monotonic()
+        if speculative_run:
+            pending = asyncio.wrap_future(speculative_run.attach(chat_stream_callback, summary_stream_callback))
+            cancel = speculative_run.cancel
+        else:
+            pending = asyncio.ensure_future(agent.arun(temp_state, stream_callback=chat_stream_callback, summary_stream_callback=summary_stream_callback))
+            cancel = pending.cancel
+        if ctx.deadlines and not await ctx.deadlines.await_done(pending, role_name, started_at, ctx.log_callback):
+            cancel()
+            return give_up(agent, started_at, ctx)
+        result = await pending
+        return finish(agent, result, fingerprint, ctx)
+
+    return async_node_func if use_async else node_func
@@ -1,42 +1,39 @@
-from typing import List, Dict
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Tuple
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph, END
+from config.settings import settings
 from core.shared_state import SharedState, AgentGraphState
+from core.checkpoint import get_checkpointer
 from core.nodes import case_organizer_node, specialist_node_factory, moderator_node, moderator_router_node, conflict_detector_node, discussion_node
-
-# 导入各 Agent (仅需专科医生，因为 Organizer 和 Moderator 封装在节点函数中)
-from agents.radiologist.agent import RadiologistAgent
-from agents.pathologist.agent import PathologistAgent
-from agents.pulmonologist.agent import PulmonologistAgent
-from agents.rheumatologist.agent import RheumatologistAgent
+from core.nodes import case_organizer_node_async, moderator_node_async, moderator_router_node_async, conflict_detector_node_async, discussion_node_async
+from core.nodes import get_run_context, has_real_conflicts
+from core.nodes import SPECIALIST_AGENTS
 
 # --- Graph Construction ---
 
-def build_mdt_graph(enabled_agents: List[str], ui_callback=None, stream_callback_factory=None, log_callback=None, model_configs: Dict[str, str] = None, stop_event=None):
-    """构建 LangGraph 图结构 (Agentic Pattern: Router-Workers)"""
+def _report_skipped(config: RunnableConfig, roles: List[str], reason: str):
+    """条件边跳过节点时，向 UI 发出 skipped 状态与日志"""
+    ctx = get_run_context(config)
+    for role in roles:
+        if ctx.ui_callback:
+            ctx.ui_callback(role, "skipped")
+        if ctx.log_callback:
+            ctx.log_callback(f"[{role}] 已跳过：{reason}")
+
+def build_mdt_graph(enabled_agents: List[str], use_async: bool = False, checkpointer=None):
+    """
+    构建 LangGraph 图结构 (Agentic Pattern: Router-Workers)
+    图只取决于启用的角色；回调、模型选择与停止信号在运行时通过
+    config=RunContext(...).to_config() 传入 (见 core.nodes.context)，因此编译结果可以跨会话复用。
+    :param use_async: 为 True 时使用异步节点 (基于 AsyncLLMClient)，返回的图需通过 astream / ainvoke 驱动
+    :param checkpointer: (可选) LangGraph Checkpointer，传入后运行时 config 中必须带 thread_id
+    """
     workflow = StateGraph(AgentGraphState)
     
-    # 辅助函数：绑定 callback 和 container
-    from functools import partial
-    
     # 去重 enabled_agents
     enabled_agents = list(dict.fromkeys(enabled_agents))
-    
-    def bind_args(func):
-        kwargs = {}
-        if ui_callback:
-            kwargs['ui_callback'] = ui_callback
-        if stream_callback_factory:
-            kwargs['stream_callback_factory'] = stream_callback_factory
-        if log_callback:
-            kwargs['log_callback'] = log_callback
-        if model_configs:
-            kwargs['model_configs'] = model_configs
-        if stop_event:
-            kwargs['stop_event'] = stop_event
-        
-        if kwargs:
-            return partial(func, **kwargs)
-        return func
 
     # 识别启用的角色
     has_organizer = "Case Organizer" in enabled_agents
@@ -46,49 +43,41 @@ def build_mdt_graph(enabled_agents: List[str], ui_callback=None, stream_callback
     # 默认启用团队讨论 (如果启用了 Moderator)
     has_discussion = has_moderator
     
-    # 专科医生映射
-    agent_map = {
-        "Radiologist": RadiologistAgent,
-        "Pathologist": PathologistAgent,
-        "Pulmonologist": PulmonologistAgent,
-        "Rheumatologist": RheumatologistAgent
-    }
-    
     active_specialists = []
     for name in enabled_agents:
-        if name in agent_map:
+        if name in SPECIALIST_AGENTS:
             node_name = name 
-            # 使用 factory 生成并绑定 callback
-            node_func = specialist_node_factory(
-                agent_map[name], 
-                role_name=node_name,
-                ui_callback=ui_callback, 
-                stream_callback_factory=stream_callback_factory,
-                log_callback=log_callback,
-                model_configs=model_configs,
-                stop_event=stop_event
-            )
+            # 使用 factory 生成节点函数
+            node_func = specialist_node_factory(SPECIALIST_AGENTS[name], role_name=node_name, use_async=use_async)
             workflow.add_node(node_name, node_func)
             active_specialists.append(node_name)
 
+    # 选择同步 / 异步节点实现
+    if use_async:
+        organizer_fn, router_fn, moderator_fn = case_organizer_node_async, moderator_router_node_async, moderator_node_async
+        detector_fn, discussion_fn = conflict_detector_node_async, discussion_node_async
+    else:
+        organizer_fn, router_fn, moderator_fn = case_organizer_node, moderator_router_node, moderator_node
+        detector_fn, discussion_fn = conflict_detector_node, discussion_node
+
     # 添加 Organizer 节点
     if has_organizer:
-        workflow.add_node("Case Organizer", bind_args(case_organizer_node))
+        workflow.add_node("Case Organizer", organizer_fn)
         
     # 添加 Moderator 节点 (Router 和 Aggregator)
     if has_moderator:
         # 1. Router: 负责规划
-        workflow.add_node("Moderator_Router", bind_args(moderator_router_node))
+        workflow.add_node("Moderator_Router", router_fn)
         # 2. Aggregator: 负责总结 (沿用 "Moderator" 名称以保持 UI 兼容)
-        workflow.add_node("Moderator", bind_args(moderator_node))
+        workflow.add_node("Moderator", moderator_fn)
         
     # 添加 Conflict Detector 节点
     if has_conflict_detector:
-        workflow.add_node("Conflict Detector", bind_args(conflict_detector_node))
+        workflow.add_node("Conflict Detector", detector_fn)
 
     # 添加 Team Discussion 节点
     if has_discussion:
-        workflow.add_node("Team Discussion", bind_args(discussion_node))
+        workflow.add_node("Team Discussion", discussion_fn)
 
     # --- 定义边 (Edges) ---
     
@@ -133,12 +122,38 @@ def build_mdt_graph(enabled_agents: List[str], ui_callback=None, stream_callback
             route_specialists
         )
         
-        # Specialists -> Conflict Detector (汇聚)
+        def submitted(state: AgentGraphState) -> List[str]:
+            """本轮被选中且未因超时被放弃 (timed_out) 的专家"""
+            status = state.get("agent_status", {})
+            return [name for name in state.get("selected_agents", []) if name in active_specialists and status.get(name) != "timed_out"]
+
+        def route_after_specialists(state: AgentGraphState, config: RunnableConfig = None):
+            # 本轮只有不足 2 位专家参与时没有可比对的意见，直接去总结。
+            # 各专家的条件边分别求值，只能看到自身的输出：这里按选中人数判断 (各分支结论一致)，
+            # 被放弃的专家在汇聚后的 route_after_detection 中扣除
+            ran = [name for name in state.get("selected_agents", []) if name in active_specialists]
+            if settings.skip_detection_below_two_specialists and len(ran) < 2:
+                _report_skipped(config, ["Conflict Detector", "Team Discussion"], f"本轮仅 {len(ran)} 位专家参与")
+                return "Moderator"
+            return "Conflict Detector"
+
+        def route_after_detection(state: AgentGraphState, config: RunnableConfig = None):
+            ran = submitted(state)
+            if settings.skip_detection_below_two_specialists and len(ran) < 2:
+                _report_skipped(config, ["Team Discussion"], f"本轮仅 {len(ran)} 位专家提交意见")
+                return "Moderator"
+            # 没有真实冲突 (只有说明条目) 时无需讨论
+            if settings.skip_discussion_without_conflicts and not has_real_conflicts(state.get("conflicts", [])):
+                _report_skipped(config, ["Team Discussion"], "未发现需要讨论的意见冲突")
+                return "Moderator"
+            return "Team Discussion"
+
+        # Specialists -> Conflict Detector (汇聚)；参与专家不足时直接 -> Moderator
         for spec in active_specialists:
-            workflow.add_edge(spec, "Conflict Detector")
+            workflow.add_conditional_edges(spec, route_after_specialists, ["Conflict Detector", "Moderator"])
             
-        # Conflict Detector -> Team Discussion
-        workflow.add_edge("Conflict Detector", "Team Discussion")
+        # Conflict Detector -> Team Discussion；没有真实冲突时直接 -> Moderator
+        workflow.add_conditional_edges("Conflict Detector", route_after_detection, ["Team Discussion", "Moderator"])
         
         # Team Discussion -> Moderator
         workflow.add_edge("Team Discussion", "Moderator")
@@ -154,4 +169,35 @@ def build_mdt_graph(enabled_agents: List[str], ui_callback=None, stream_callback
         if active_specialists:
             workflow.add_edge(active_specialists[-1], END)
 
-    return workflow.compile()
+    return workflow.compile(checkpointer=checkpointer)
+
+# --- Compiled Graph Cache ---
+
+# {(enabled_agents, use_async, checkpointed): compiled_graph}，按最近使用顺序排列
+_graph_cache: "OrderedDict[Tuple, object]" = OrderedDict()
+_graph_cache_lock = threading.Lock()
+
+def get_mdt_graph(enabled_agents: List[str], use_async: bool = False, checkpointed: bool = False):
+    """
+    获取编译好的会诊图 (LRU 缓存)。
+    同一组启用角色只编译一次，缓存容量由 settings.graph_cache_size 控制；
+    模型选择通过 RunContext 在运行时传入，不影响图结构，因此不计入缓存键。
+    :param checkpointed: 为 True 时编译带 SQLite checkpoint 的版本 (见 core.checkpoint)；
+        checkpoint 未启用或不可用时返回普通图
+    """
+    checkpointer = get_checkpointer() if checkpointed else None
+    key = (tuple(dict.fromkeys(enabled_agents)), use_async, checkpointer is not None)
+    with _graph_cache_lock:
+        if key in _graph_cache:
+            _graph_cache.move_to_end(key)
+            return _graph_cache[key]
+
+    # 编译在锁外进行；并发首次编译同一张图时结果等价，保留先写入的一份即可
+    app = build_mdt_graph(list(key[0]), use_async=use_async, checkpointer=checkpointer)
+
+    with _graph_cache_lock:
+        app = _graph_cache.setdefault(key, app)
+        _graph_cache.move_to_end(key)
+        while len(_graph_cache) > max(1, settings.graph_cache_size):
+            _graph_cache.popitem(last=False)
+    return app
@@ -1,37 +1,97 @@
-from typing import List, Dict
+from typing import List, Dict, Callable
+import asyncio
+import threading
+import time
 import traceback
-from core.shared_state import SharedState
-from core.pipeline import build_mdt_graph
+from config.settings import settings
+from core.shared_state import SharedState, merge_dicts
+from core.history import history_builder
+from core.pipeline import get_mdt_graph
+from core.nodes import SPECIALIST_AGENTS, create_specialist
+from core.nodes.context import RunContext
+from core.speculation import SpeculativeDispatcher
+from core.checkpoint import get_checkpointer, thread_id_for, delete_thread
+from core.deadlines import make_round_deadlines
+from llm.streaming import ChunkCoalescer
+from llm.cancellation import CancellationToken, cancellation_scope
 
-# --- API Generator ---
+# --- Event Bridge ---
 
-def run_mdt_generator(shared_state: SharedState, enabled_agents: List[str], model_configs: Dict[str, str] = None, stop_event=None):
+class AsyncEventBridge:
     """
-    Generator function for API usage. Yields events.
+    线程 → asyncio 的事件桥。
+
+    图在工作线程中执行，事件通过 loop.call_soon_threadsafe 直接投递到事件循环中的
+    asyncio.Queue，消费方 (WebSocket 端点) 只需 await get()，
+    无需为每个事件 (每个 token) 都向线程池提交一次 next(generator)。
     """
-    import queue
-    from threading import Thread
-    
-    event_queue = queue.Queue()
-    
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._loop_thread = threading.get_ident() if loop is None else None
+
+    def put(self, item):
+        """线程安全：可在任意线程中调用"""
+        if threading.get_ident() == self._loop_thread:
+            # 异步图在事件循环线程中发出事件：直接入队，无需经由 call_soon_threadsafe 唤醒事件循环
+            self._queue.put_nowait(item)
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭 (例如服务正在退出)，丢弃事件
+            pass
+
+    async def get(self):
+        return await self._queue.get()
+
+# --- Round Helpers ---
+
+def _make_callbacks(emit: Callable, stop_event=None):
+    """构造传入图节点的 UI / 日志 / 流式 / 部分结果回调，所有事件通过 emit 发出"""
     def ui_callback(role, status):
-        event_queue.put({"type": "status", "role": role, "content": status})
-        
+        emit({"type": "status", "role": role, "content": status})
+
     def log_callback(message):
-        event_queue.put({"type": "log", "content": message})
-        
+        emit({"type": "log", "content": message})
+
     def stream_callback_factory(role, model, target="chat"):
+        def send(text):
+            emit({"type": "token", "role": role, "content": text, "target": target})
+
+        # 逐 Token 的片段先合并再发出，每个 token 事件携带一小段文本
+        coalescer = ChunkCoalescer(
+            send,
+            interval_ms=settings.stream_flush_interval_ms.get(target, settings.stream_flush_interval_ms.get("default", 0)),
+            max_chars=settings.stream_flush_chars.get(target, settings.stream_flush_chars.get("default", 0))
+        )
+
         def callback(chunk):
             if stop_event and stop_event.is_set():
                 raise InterruptedError("Generation stopped by user")
-            event_queue.put({"type": "token", "role": role, "content": chunk, "target": target})
+            coalescer(chunk)
+
+        def reset():
+            # LLM 流中途断开并重试：丢弃未发出的缓冲，并通知前端丢弃该目标已接收的部分内容
+            coalescer.reset()
+            emit({"type": "stream_reset", "role": role, "target": target})
+
+        callback.flush = coalescer.flush
+        callback.reset = reset
         return callback
 
-    # Initialize round state logic (similar to run_mdt_round)
+    def partial_callback(role, data):
+        # 节点尚未结束时的部分结果 (例如已生成完毕的病例字段)，格式与 node_finished 的 data 相同
+        emit({"type": "node_partial", "role": role, "data": data})
+
+    return ui_callback, log_callback, stream_callback_factory, partial_callback
+
+def _prepare_round(shared_state: SharedState, enabled_agents: List[str], emit: Callable) -> int:
+    """初始化本轮状态 (similar to run_mdt_round)，返回当前轮次"""
     current_round = shared_state.round_count
     if current_round not in shared_state.specialist_opinions_history:
         shared_state.specialist_opinions_history[current_round] = {}
-    
+
     # 增量更新逻辑：如果是后续轮次，先加载上一轮的意见作为基准
     # 这样未被唤醒的 Agent 的意见将保持不变
     if current_round > 1 and (current_round - 1) in shared_state.specialist_opinions_history:
@@ -42,85 +102,316 @@ def run_mdt_generator(shared_state: SharedState, enabled_agents: List[str], mode
     else:
         shared_state.specialist_opinions = {}
         shared_state.specialist_summaries = {}
-    
+        shared_state.specialist_fingerprints = {}
+
     shared_state.moderator_summary = ""
-    
+    # 本轮由 Moderator_Router 重新选择专家 (未启用 Moderator 时保持为空)
+    shared_state.selected_agents = []
+    # 冲突与讨论纪要只属于本轮；这两个节点可能被条件跳过，先清空以免沿用上一轮的结果
+    shared_state.conflicts = []
+    shared_state.discussion_notes = ""
+
+    # 往期讨论超出 Token 预算时，提前在后台生成滚动摘要，供本轮各专科与主持人共用
+    history_builder.prefetch(shared_state.chat_history)
+
     for agent in enabled_agents:
         shared_state.update_agent_status(agent, "idle")
-        event_queue.put({"type": "status", "role": agent, "content": "idle"})
+        emit({"type": "status", "role": agent, "content": "idle"})
+
+    return current_round
+
+def _make_speculation(enabled_agents: List[str], model_configs: Dict[str, str] = None, stop_event=None):
+    """为本次运行创建投机执行调度器 (未启用路由或没有可投机的专家时返回 None)"""
+    roles = [r for r in settings.speculative_specialists if r in enabled_agents and r in SPECIALIST_AGENTS]
+    if not roles or "Moderator" not in enabled_agents:
+        return None
+    return SpeculativeDispatcher(
+        roles,
+        agent_factory=lambda role_name: create_specialist(role_name, model_configs),
+        stop_event=stop_event
+    )
+
+def _apply_node_output(shared_state: SharedState, current_round: int, node_name: str, output: Dict, emit: Callable):
+    """把一个节点的输出写回 SharedState 并发出 node_finished / idle 事件 (实时执行与断点续跑回放共用)"""
+    # Update SharedState
+    if "structured_info" in output:
+        shared_state.structured_info = output["structured_info"]
+    if "new_evidence" in output:
+        shared_state.new_evidence = output["new_evidence"]
+    if "selected_agents" in output:
+        shared_state.selected_agents = output["selected_agents"]
+    # 与图状态相同的合并规则 (merge_dicts)：值为 None 表示撤回该专家的意见
+    if "specialist_opinions" in output:
+        shared_state.specialist_opinions = merge_dicts(shared_state.specialist_opinions, output["specialist_opinions"])
+        shared_state.specialist_opinions_history[current_round] = merge_dicts(
+            shared_state.specialist_opinions_history[current_round], output["specialist_opinions"])
+    if "specialist_summaries" in output:
+        shared_state.specialist_summaries = merge_dicts(shared_state.specialist_summaries, output["specialist_summaries"])
+    if "specialist_fingerprints" in output:
+        shared_state.specialist_fingerprints = merge_dicts(shared_state.specialist_fingerprints, output["specialist_fingerprints"])
+    if "moderator_summary" in output:
+        shared_state.moderator_summary = output["moderator_summary"]
+        shared_state.moderator_summary_history[current_round] = output["moderator_summary"]
+    if "conflicts" in output:
+        shared_state.conflicts = output["conflicts"]
+    if "discussion_notes" in output:
+        shared_state.discussion_notes = output["discussion_notes"]
+        print(f"DEBUG: Pipeline received discussion_notes: {output['discussion_notes'][:50]}...")
+    if "chat_history" in output:
+        for msg in output["chat_history"]:
+            shared_state.chat_history.append(msg)
+
+    # Emit result event
+    print(f"DEBUG: Emitting node_finished for {node_name}")
+    if node_name == "Conflict Detector":
+        print(f"DEBUG: Conflict Detector output: {output}")
+
+    emit({"type": "node_finished", "role": node_name, "data": output})
+
+    # Reset status (节点可在 agent_status 中报告最终状态，例如 timed_out)
+    status = output.get("agent_status", {}).get(node_name, "idle")
+    shared_state.update_agent_status(node_name, status)
+    emit({"type": "status", "role": node_name, "content": status})
+
+def _execute_graph(app, graph_input, run_context: RunContext, shared_state: SharedState, current_round: int, emit: Callable):
+    """
+    执行图并把节点输出写回 SharedState，结束时发出 None 作为哨兵
+    :param graph_input: 初始状态；断点续跑时为 None (从最近的 checkpoint 继续)
+    """
+    completed = False
+    # stop_event 为 CancellationToken 时，图中发起的 LLM 调用会在停止时被立即中止
+    token = run_context.stop_event if isinstance(run_context.stop_event, CancellationToken) else None
+    try:
+        with cancellation_scope(token):
+            _stream_graph(app, graph_input, run_context, shared_state, current_round, emit)
+        completed = not run_context.stopped()
+
+    except InterruptedError:
+        # Gracefully stop
+        pass
+    except Exception as e:
+        print("Error in pipeline execution:")
+        traceback.print_exc()
+        emit({"type": "error", "content": str(e)})
+    finally:
+        _finish_run(run_context, token, completed, emit)
+
+async def _aexecute_graph(app, graph_input, run_context: RunContext, shared_state: SharedState, current_round: int, emit: Callable):
+    """_execute_graph 的异步版本：以 astream 驱动 build_mdt_graph(use_async=True) 编译的图"""
+    completed = False
+    token = run_context.stop_event if isinstance(run_context.stop_event, CancellationToken) else None
+    try:
+        with cancellation_scope(token):
+            async for event in app.astream(graph_input, config=run_context.to_config()):
+                _apply_graph_event(event, shared_state, current_round, emit)
+        completed = not run_context.stopped()
+
+    except InterruptedError:
+        pass
+    except Exception as e:
+        print("Error in pipeline execution:")
+        traceback.print_exc()
+        emit({"type": "error", "content": str(e)})
+    finally:
+        # 删除 checkpoint 需要访问 SQLite，放到线程中执行
+        await asyncio.to_thread(_finish_run, run_context, token, completed, emit)
+
+def _finish_run(run_context: RunContext, token, completed: bool, emit: Callable):
+    """图执行结束后的清理 (同步 / 异步执行共用)，最后发出 None 作为哨兵"""
+    if run_context.speculation:
+        run_context.speculation.cancel_all()
+    # 轮次正常结束后不再需要续跑，删除该轮的 checkpoint；中断或出错时保留
+    if completed:
+        delete_thread(run_context.thread_id)
+    if token and token.is_set():
+        _report_cancellation(token)
+    emit(None) # Sentinel
+
+def _stream_graph(app, graph_input, run_context: RunContext, shared_state: SharedState, current_round: int, emit: Callable):
+    """驱动图执行，逐个节点把输出写回 SharedState 并发出事件"""
+    for event in app.stream(graph_input, config=run_context.to_config()):
+        _apply_graph_event(event, shared_state, current_round, emit)
+
+def _apply_graph_event(event: Dict, shared_state: SharedState, current_round: int, emit: Callable):
+    # event is dict {node_name: output}
+    for node_name, output in event.items():
+        # 续跑时 LangGraph 会重新发出中断那一步中已完成的节点输出，并附带 __metadata__
+        if node_name == "__metadata__":
+            continue
+        if output is None:
+            print(f"WARNING: Node '{node_name}' returned None!")
+            continue
+        _apply_node_output(shared_state, current_round, node_name, output, emit)
+
+def _report_cancellation(token: CancellationToken):
+    """记录取消延迟：在途调用从停止到真正中止的时间，以及图从停止到退出的时间"""
+    stats = token.latency_stats()
+    exit_ms = (time.monotonic() - token.cancelled_at) * 1000
+    print(f"[Cancel] Aborted {stats['count']} in-flight LLM calls (mean {stats['mean_ms']:.0f}ms, max {stats['max_ms']:.0f}ms), graph exited {exit_ms:.0f}ms after stop")
+
+def _replay_checkpoint(app, run_context: RunContext, shared_state: SharedState, emit: Callable) -> int:
+    """
+    断点续跑的准备：从 checkpoint 恢复本轮开始时的状态，并按顺序回放已完成节点的输出。
+    返回当前轮次；没有可续跑的内容时抛出 ValueError。
+
+    中断那一步 (最新 checkpoint) 中已完成的节点不在这里回放：LangGraph 续跑时会直接重新发出它们的输出。
+    """
+    config = run_context.to_config()
+    snapshot = app.get_state(config)
+    if not snapshot.values or not snapshot.next:
+        raise ValueError("本轮没有可恢复的会诊进度")
+
+    history = list(reversed(list(app.get_state_history(config))))
+    # 第一个 checkpoint (source == "input") 的 __start__ 任务结果即本轮的初始状态
+    initial_state = next(
+        (t.result for h in history for t in h.tasks if t.name == "__start__" and t.result),
+        None
+    )
+    if initial_state is None:
+        raise ValueError("找不到本轮的初始状态")
+
+    for field in SharedState.model_fields:
+        if field in initial_state:
+            setattr(shared_state, field, initial_state[field])
+    current_round = shared_state.round_count
+    shared_state.specialist_opinions_history.setdefault(current_round, {})
 
-    app = build_mdt_graph(
-        enabled_agents,
+    for h in history[:-1]:
+        for task in h.tasks:
+            if task.name != "__start__" and task.result:
+                _apply_node_output(shared_state, current_round, task.name, task.result, emit)
+
+    if run_context.log_callback:
+        run_context.log_callback(f"[System] 从断点恢复第 {current_round} 轮，待执行: {', '.join(snapshot.next)}")
+    return current_round
+
+def _start_run(shared_state: SharedState, enabled_agents: List[str], model_configs: Dict[str, str], stop_event, emit: Callable, session_id: str = None, resume: bool = False, use_async: bool = False):
+    """
+    准备一次图运行，返回 (app, graph_input, run_context, current_round)；无法运行时 app 为 None 并发出 error 事件。
+    提供 session_id 且启用 checkpoint 时，图的每一步都会写入 SQLite (thread = 会话 + 轮次)。
+    :param use_async: 为 True 时返回异步图 (需通过 _aexecute_graph 执行)
+    """
+    ui_callback, log_callback, stream_callback_factory, partial_callback = _make_callbacks(emit, stop_event)
+    checkpointed = bool(session_id) and get_checkpointer() is not None
+    app = get_mdt_graph(enabled_agents, use_async=use_async, checkpointed=checkpointed)
+    run_context = RunContext(
         ui_callback=ui_callback,
         stream_callback_factory=stream_callback_factory,
         log_callback=log_callback,
+        partial_callback=partial_callback,
         model_configs=model_configs,
-        stop_event=stop_event
+        stop_event=stop_event,
+        speculation=_make_speculation(enabled_agents, model_configs, stop_event),
+        deadlines=make_round_deadlines(enabled_agents, SPECIALIST_AGENTS),
+        thread_id=thread_id_for(session_id, shared_state.round_count) if checkpointed else None
     )
-    
+
     if not app:
-        yield {"type": "error", "content": "No agents selected"}
-        return
+        emit({"type": "error", "content": "No agents selected"})
+        return None, None, run_context, shared_state.round_count
 
-    initial_state = shared_state.model_dump()
-    
-    def runner():
+    if resume:
+        if not checkpointed:
+            emit({"type": "error", "content": "断点续跑需要 session_id 且启用 checkpoint"})
+            return None, None, run_context, shared_state.round_count
         try:
-            for event in app.stream(initial_state):
-                # event is dict {node_name: output}
-                for node_name, output in event.items():
-                    if output is None:
-                        print(f"WARNING: Node '{node_name}' returned None!")
-                        continue
-                        
-                    # Update SharedState
-                    if "structured_info" in output:
-                        shared_state.structured_info = output["structured_info"]
-                    if "specialist_opinions" in output:
-                        shared_state.specialist_opinions.update(output["specialist_opinions"])
-                        shared_state.specialist_opinions_history[current_round].update(output["specialist_opinions"])
-                    if "specialist_summaries" in output:
-                        shared_state.specialist_summaries.update(output["specialist_summaries"])
-                    if "moderator_summary" in output:
-                        shared_state.moderator_summary = output["moderator_summary"]
-                        shared_state.moderator_summary_history[current_round] = output["moderator_summary"]
-                    if "conflicts" in output:
-                        shared_state.conflicts = output["conflicts"]
-                    if "discussion_notes" in output:
-                        shared_state.discussion_notes = output["discussion_notes"]
-                        print(f"DEBUG: Pipeline received discussion_notes: {output['discussion_notes'][:50]}...")
-                    if "chat_history" in output:
-                        for msg in output["chat_history"]:
-                            shared_state.chat_history.append(msg)
-                    
-                    # Emit result event
-                    print(f"DEBUG: Emitting node_finished for {node_name}")
-                    if node_name == "Conflict Detector":
-                        print(f"DEBUG: Conflict Detector output: {output}")
-                    
-                    event_queue.put({"type": "node_finished", "role": node_name, "data": output})
-                    
-                    # Reset status
-                    shared_state.update_agent_status(node_name, "idle")
-                    event_queue.put({"type": "status", "role": node_name, "content": "idle"})
-                    
-        except InterruptedError:
-            # Gracefully stop
-            pass
-        except Exception as e:
-            print("Error in pipeline execution:")
-            traceback.print_exc()
-            event_queue.put({"type": "error", "content": str(e)})
-        finally:
-            event_queue.put(None) # Sentinel
-
-    t = Thread(target=runner)
-    t.start()
-    
+            current_round = _replay_checkpoint(app, run_context, shared_state, emit)
+        except ValueError as e:
+            emit({"type": "error", "content": str(e)})
+            return None, None, run_context, shared_state.round_count
+        return app, None, run_context, current_round
+
+    # 重新开始本轮：丢弃该轮之前遗留的 checkpoint
+    delete_thread(run_context.thread_id)
+    current_round = _prepare_round(shared_state, enabled_agents, emit)
+    return app, shared_state.model_dump(), run_context, current_round
+
+def run_mdt_round(shared_state: SharedState, enabled_agents: List[str], model_configs: Dict[str, str] = None, stop_event=None, on_event: Callable = None) -> List[str]:
+    """
+    在当前线程中同步执行一轮会诊 (不经过事件队列)，返回本轮的错误信息列表。
+    供批量运行等非交互场景使用；调用方需事先通过 SharedState.add_user_input 写入本轮输入。
+    :param on_event: (可选) 接收与 run_mdt_generator 相同的事件
+    """
+    errors = []
+
+    def emit(event):
+        if event is None:
+            return
+        if event["type"] == "error":
+            errors.append(event["content"])
+        if on_event:
+            on_event(event)
+
+    app, graph_input, run_context, current_round = _start_run(shared_state, enabled_agents, model_configs, stop_event, emit)
+    if app:
+        _execute_graph(app, graph_input, run_context, shared_state, current_round, emit)
+    return errors
+
+# --- API Generator ---
+
+def run_mdt_generator(shared_state: SharedState, enabled_agents: List[str], model_configs: Dict[str, str] = None, stop_event=None, session_id: str = None, resume: bool = False):
+    """
+    Generator function for API usage. Yields events.
+    :param session_id: (可选) 会话 ID，提供时启用本轮的 checkpoint
+    :param resume: 为 True 时从本轮最近的 checkpoint 续跑：先回放已完成节点的事件，再只执行未完成的节点
+    """
+    import queue
+    from threading import Thread
+
+    event_queue = queue.Queue()
+    emit = event_queue.put
+
+    app, graph_input, run_context, current_round = _start_run(shared_state, enabled_agents, model_configs, stop_event, emit, session_id, resume)
+    if not app:
+        emit(None)
+    else:
+        t = Thread(target=_execute_graph, args=(app, graph_input, run_context, shared_state, current_round, emit))
+        t.start()
+
     while True:
         item = event_queue.get()
         if item is None:
             break
         yield item
-        
-    t.join()
+
+    if app:
+        t.join()
+
+# 正在执行的异步图任务 (事件循环只持有任务的弱引用)
+_background_runs = set()
+
+async def run_mdt_stream(shared_state: SharedState, enabled_agents: List[str], model_configs: Dict[str, str] = None, stop_event=None, session_id: str = None, resume: bool = False):
+    """
+    Async generator for the WebSocket endpoint. Yields events.
+
+    与 run_mdt_generator 产生完全相同的事件序列。settings.stream_async_graph 开启时，
+    异步图 (build_mdt_graph(use_async=True)) 直接在当前事件循环中以 astream 驱动，
+    等待模型输出期间不占用线程；否则同步图在工作线程中执行。
+    两种方式的事件都经由 AsyncEventBridge 投递到事件循环，消费时只需 await。
+    """
+    from threading import Thread
+
+    bridge = AsyncEventBridge()
+    emit = bridge.put
+    use_async = settings.stream_async_graph
+
+    # 准备阶段可能读写 checkpoint (SQLite)，不在事件循环中执行
+    app, graph_input, run_context, current_round = await asyncio.to_thread(
+        _start_run, shared_state, enabled_agents, model_configs, stop_event, emit, session_id, resume, use_async
+    )
+    if not app:
+        emit(None)
+    elif use_async:
+        # 与同步模式的后台线程一致：消费方提前退出时本轮仍继续执行 (由 stop_event 负责中止)
+        task = asyncio.create_task(_aexecute_graph(app, graph_input, run_context, shared_state, current_round, emit))
+        _background_runs.add(task)
+        task.add_done_callback(_background_runs.discard)
+    else:
+        t = Thread(target=_execute_graph, args=(app, graph_input, run_context, shared_state, current_round, emit), daemon=True)
+        t.start()
+
+    while True:
+        item = await bridge.get()
+        if item is None:
+            break
+        yield item
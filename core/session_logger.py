@@ -1,27 +1,144 @@
+import atexit
+import glob
 import json
 import os
+import queue
+import threading
+import time
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from config.settings import settings
+from config.llm_config import get_config_for_agent
 from core.shared_state import SharedState
+from core.archive import get_archive
+
+# 队列中表示“删除该会话日志”的标记 (与追加按提交顺序处理)
+_DELETE = object()
+
+class _LogWriter:
+    """
+    后台写入线程：把日志行追加到各自的文件末尾。
+    每批先等待 flush_interval 秒收集更多记录，再按文件合并写入并各做一次 fsync (批量 fsync)。
+    """
+    def __init__(self, flush_interval: float = 0.2, archive=None):
+        """
+        :param archive: (可选) core.archive.ConsultationArchive，每批记录同时在一个事务中写入档案库
+        """
+        self.flush_interval = flush_interval
+        self.archive = archive
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        # 本进程已检查过结尾的文件 (见 _needs_newline)
+        self._checked = set()
+        self._thread = threading.Thread(target=self._run, name="session-log-writer", daemon=True)
+        self._thread.start()
+
+    def append(self, file_path: str, line: str, record: Dict[str, Any] = None):
+        self._queue.put((file_path, line, record))
+
+    def delete(self, file_path: str, session_id: str):
+        """删除日志文件及档案库中的记录；在此之前提交的追加被丢弃，之后提交的追加写入新文件"""
+        self._queue.put((file_path, _DELETE, session_id))
+
+    def flush(self):
+        """阻塞直到已提交的记录全部写入磁盘"""
+        self._queue.join()
+
+    def _collect(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _needs_newline(self, file_path: str) -> bool:
+        """进程崩溃可能留下写了一半的最后一行：首次追加前检查，避免新记录接在半行后面"""
+        if file_path in self._checked:
+            return False
+        self._checked.add(file_path)
+        if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
+            return False
+        with open(file_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            lines_by_file: Dict[str, List[str]] = {}
+            records, deleted = [], []
+            for file_path, line, record in batch:
+                if line is _DELETE:
+                    lines_by_file.pop(file_path, None)
+                    records = [r for r in records if r["session_id"] != record]
+                    deleted.append((file_path, record))
+                    continue
+                lines_by_file.setdefault(file_path, []).append(line)
+                if record is not None:
+                    records.append(record)
+            for file_path, session_id in deleted:
+                self._delete(file_path, session_id)
+            for file_path, lines in lines_by_file.items():
+                try:
+                    prefix = "\n" if self._needs_newline(file_path) else ""
+                    with open(file_path, 'a', encoding='utf-8') as f:
+                        f.write(prefix + "".join(lines))
+                        f.flush()
+                        os.fsync(f.fileno())
+                except Exception as e:
+                    print(f"Error saving session log {file_path}: {e}")
+            if self.archive and records:
+                try:
+                    self.archive.record_rounds(records)
+                except Exception as e:
+                    print(f"Error archiving session rounds: {e}")
+            for _ in batch:
+                self._queue.task_done()
+
+    def _delete(self, file_path: str, session_id: str):
+        self._checked.discard(file_path)
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except Exception as e:
+            print(f"Error deleting session log {file_path}: {e}")
+        if self.archive:
+            try:
+                self.archive.delete_session(session_id)
+            except Exception as e:
+                print(f"Error deleting archived session {session_id}: {e}")
 
 class SessionLogger:
-    def __init__(self, log_dir: str = "logs/sessions"):
+    """
+    会诊日志：每个会话一个只追加的 JSONL 文件 (logs/sessions/{session_id}.jsonl)，每保存一轮追加一行。
+
+    保存一轮的开销与已有轮数无关，且写入在后台线程完成，不阻塞事件循环。
+    同一轮保存多次 (例如重试) 时追加多行，以最后一行为准。
+    需要原来的嵌套 JSON 格式时，用 compact() / write_compacted() 生成 (也可通过命令行：
+    python -m core.session_logger compact --all)；合并时保留旧版 {session_id}.json 日志中的轮次。
+    """
+    def __init__(self, log_dir: str = "logs/sessions", flush_interval: Optional[float] = None, archive=None):
+        """
+        :param archive: (可选) core.archive.ConsultationArchive，每轮同时写入档案库以便按条件查询
+        """
         self.log_dir = log_dir
         os.makedirs(self.log_dir, exist_ok=True)
+        if flush_interval is None:
+            flush_interval = settings.session_log_flush_interval
+        self.archive = archive
+        self._writer = _LogWriter(flush_interval, archive)
+        atexit.register(self.flush)
 
     def _get_file_path(self, session_id: str) -> str:
-        return os.path.join(self.log_dir, f"{session_id}.json")
+        return os.path.join(self.log_dir, f"{session_id}.jsonl")
 
-    def _load_log(self, session_id: str) -> Dict[str, Any]:
-        file_path = self._get_file_path(session_id)
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception as e:
-                print(f"Error loading log file {file_path}: {e}")
-                return self._create_new_log_structure(session_id)
-        return self._create_new_log_structure(session_id)
+    def _get_compacted_path(self, session_id: str) -> str:
+        return os.path.join(self.log_dir, f"{session_id}.json")
 
     def _create_new_log_structure(self, session_id: str) -> Dict[str, Any]:
         return {
@@ -31,17 +148,11 @@ class SessionLogger:
             "rounds": []
         }
 
-    def save_round(self, session_id: str, state: SharedState):
-        """
-        保存当前轮次的状态到日志文件。
-        如果该轮次已存在（例如重试），则更新；否则追加。
-        """
-        log_data = self._load_log(session_id)
-        current_round_index = state.round_count
-        
-        # 构建当前轮次的数据对象
-        round_data = {
-            "round_index": current_round_index,
+    @staticmethod
+    def build_round(state: SharedState) -> Dict[str, Any]:
+        """构建当前轮次的数据对象"""
+        return {
+            "round_index": state.round_count,
             "timestamp": datetime.now().isoformat(),
             "user_input": state.raw_case_text, # 当前轮的输入
             "new_evidence": state.new_evidence, # 当前轮的新证据
@@ -60,28 +171,118 @@ class SessionLogger:
             }
         }
 
-        # 检查是否已经存在该轮次的记录
-        round_exists = False
-        for i, r in enumerate(log_data["rounds"]):
-            if r["round_index"] == current_round_index:
-                log_data["rounds"][i] = round_data # 更新
-                round_exists = True
-                break
-        
-        if not round_exists:
-            log_data["rounds"].append(round_data) # 追加
-
-        # 更新元数据
-        log_data["last_updated"] = datetime.now().isoformat()
+    @staticmethod
+    def resolve_models(state: SharedState, model_configs: Dict[str, str] = None) -> Dict[str, str]:
+        """本轮各角色使用的模型：前端选择的模型，未选择时为该角色的默认模型"""
+        model_configs = model_configs or {}
+        roles = list(state.specialist_opinions) + ["Moderator"]
+        return {role: model_configs.get(role) or get_config_for_agent(role).model_name for role in roles}
 
-        # 写入文件
+    def save_round(self, session_id: str, state: SharedState, model_configs: Dict[str, str] = None):
+        """
+        保存当前轮次的状态：在调用线程中序列化本轮数据 (之后的修改不会影响已保存的内容)，
+        由后台线程追加到日志文件，并写入档案库 (如有)。
+        :param model_configs: (可选) 本轮前端选择的模型 (角色 -> 模型名)，记录到日志与档案库
+        """
+        record = {
+            "session_id": session_id,
+            "round": self.build_round(state),
+            "models": self.resolve_models(state, model_configs)
+        }
+        # 序列化即快照：档案库使用反序列化后的副本
+        line = json.dumps(record, ensure_ascii=False)
         file_path = self._get_file_path(session_id)
+        self._writer.append(file_path, line + "\n", json.loads(line) if self.archive else None)
+        print(f"Session log queued for {file_path}")
+
+    def flush(self):
+        """等待已提交的日志全部写入磁盘"""
+        self._writer.flush()
+
+    def delete_session(self, session_id: str):
+        """
+        清除一个会话已保存的全部轮次 (日志文件、旧版 / 合并后的 {session_id}.json 与档案库)，例如重新运行同一会话之前。
+        与 save_round 一样在后台线程中按提交顺序执行：此后保存的轮次写入新的日志。
+        """
+        compacted_path = self._get_compacted_path(session_id)
+        if os.path.exists(compacted_path):
+            os.remove(compacted_path)
+        self._writer.delete(self._get_file_path(session_id), session_id)
+
+    def _read_compacted_rounds(self, session_id: str) -> Dict[int, Dict[str, Any]]:
+        """
+        {session_id}.json 中已有的轮次。改用 JSONL 之前的会话日志就是这个文件 (旧轮次只记录在这里)；
+        write_compacted 的输出也写到同一路径，其中的轮次都来自 JSONL，合并时以 JSONL 为准即可。
+        """
+        compacted_path = self._get_compacted_path(session_id)
+        if not os.path.exists(compacted_path):
+            return {}
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(log_data, f, ensure_ascii=False, indent=2)
-            print(f"Session log saved to {file_path}")
-        except Exception as e:
-            print(f"Error saving session log: {e}")
+            with open(compacted_path, 'r', encoding='utf-8') as f:
+                return {r["round_index"]: r for r in json.load(f).get("rounds", [])}
+        except (json.JSONDecodeError, KeyError, AttributeError, TypeError) as e:
+            print(f"Skipping unreadable session log {compacted_path}: {e}")
+            return {}
+
+    def compact(self, session_id: str) -> Dict[str, Any]:
+        """
+        把 JSONL 日志合并为嵌套 JSON 格式 ({session_id, created_at, last_updated, rounds: [...]})，
+        同一轮的多条记录以最后一条为准，rounds 按轮次排序。
+        {session_id}.json 中的轮次 (旧版日志) 一并保留，同一轮以 JSONL 中的记录为准。
+        """
+        self.flush()
+        log_data = self._create_new_log_structure(session_id)
+        rounds = self._read_compacted_rounds(session_id)
+        file_path = self._get_file_path(session_id)
+
+        if os.path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        round_data = json.loads(line)["round"]
+                    except (json.JSONDecodeError, KeyError) as e:
+                        # 进程崩溃可能留下写了一半的最后一行
+                        print(f"Skipping malformed line {line_number} in {file_path}: {e}")
+                        continue
+                    rounds[round_data["round_index"]] = round_data
+
+        timestamps = [r["timestamp"] for r in rounds.values()]
+        if timestamps:
+            log_data["created_at"] = min(timestamps)
+            log_data["last_updated"] = max(timestamps)
+        log_data["rounds"] = [rounds[index] for index in sorted(rounds)]
+        return log_data
+
+    def write_compacted(self, session_id: str, output_path: str = None) -> str:
+        """生成嵌套 JSON 格式的日志文件 (默认 logs/sessions/{session_id}.json)，返回文件路径"""
+        log_data = self.compact(session_id)
+        output_path = output_path or self._get_compacted_path(session_id)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(log_data, f, ensure_ascii=False, indent=2)
+        return output_path
+
+    def session_ids(self) -> List[str]:
+        """日志目录中的全部会话 ID (包括只有旧版 {session_id}.json 日志的会话)"""
+        paths = glob.glob(os.path.join(self.log_dir, "*.jsonl")) + glob.glob(os.path.join(self.log_dir, "*.json"))
+        return sorted({os.path.splitext(os.path.basename(p))[0] for p in paths})
 
 # 全局实例
-session_logger = SessionLogger()
+session_logger = SessionLogger(archive=get_archive())
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="把 JSONL 会诊日志合并为嵌套 JSON 格式")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser("compact", help="生成 {session_id}.json")
+    compact_parser.add_argument("session_ids", nargs="*", help="要合并的会话 ID")
+    compact_parser.add_argument("--all", action="store_true", help="合并日志目录中的全部会话")
+    args = parser.parse_args()
+
+    targets = session_logger.session_ids() if args.all else args.session_ids
+    if not targets:
+        parser.error("请指定会话 ID 或 --all")
+    for target in targets:
+        print(f"{target} -> {session_logger.write_compacted(target)}")
@@ -0,0 +1,310 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from config.settings import settings
+from core.shared_state import SharedState
+
+try:
+    import redis
+except ImportError:  # 可选依赖：仅 session_backend="redis" 时需要
+    redis = None
+
+class SessionStore(ABC):
+    """
+    会话存储接口：session_id -> SharedState。
+
+    实现：
+    - InMemorySessionStore：进程内 LRU + TTL，可挂接一个持久化后端，被淘汰的会话写入后端、下次访问时再加载
+    - SQLiteSessionStore：本地 SQLite 持久化
+    - RedisSessionStore：Redis 兼容存储 (任何提供 get / set / delete / exists 的客户端均可替换)
+    """
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[SharedState]:
+        pass
+
+    @abstractmethod
+    def put(self, session_id: str, state: SharedState):
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        pass
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+class SQLiteSessionStore(SessionStore):
+    """把会话以 JSON 存入本地 SQLite，服务重启后仍可继续会诊"""
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    def get(self, session_id: str) -> Optional[SharedState]:
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        return SharedState.model_validate_json(row[0])
+
+    def put(self, session_id: str, state: SharedState):
+        payload = state.model_dump_json()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?)",
+                (session_id, payload, time.time())
+            )
+            self._conn.commit()
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def purge(self, older_than: float) -> int:
+        """删除超过 older_than 秒未更新的会话，返回删除数量"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - older_than,))
+            self._conn.commit()
+        return cursor.rowcount
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis 兼容存储。client 只需提供 get / set / delete / exists (redis-py 接口)，
+    本地开发可用 fakeredis 等替身代替真实的 Redis。
+    """
+    def __init__(self, client, key_prefix: str = "mdt:session:", expire_seconds: Optional[int] = None):
+        """
+        :param expire_seconds: (可选) 键的过期时间，None 表示永久保存
+        """
+        self.client = client
+        self.key_prefix = key_prefix
+        self.expire_seconds = expire_seconds
+
+    def _key(self, session_id: str) -> str:
+        return f"{self.key_prefix}{session_id}"
+
+    def get(self, session_id: str) -> Optional[SharedState]:
+        payload = self.client.get(self._key(session_id))
+        if payload is None:
+            return None
+        return SharedState.model_validate_json(payload)
+
+    def put(self, session_id: str, state: SharedState):
+        self.client.set(self._key(session_id), state.model_dump_json(), ex=self.expire_seconds)
+
+    def delete(self, session_id: str):
+        self.client.delete(self._key(session_id))
+
+    def __contains__(self, session_id: str) -> bool:
+        return bool(self.client.exists(self._key(session_id)))
+
+class _Entry:
+    __slots__ = ("state", "last_access", "leases")
+
+    def __init__(self, state: SharedState):
+        self.state = state
+        self.last_access = time.monotonic()
+        self.leases = 0
+
+class InMemorySessionStore(SessionStore):
+    """
+    进程内的会话缓存：容量上限 (LRU) + 空闲过期 (TTL)。
+
+    - put 时写入内存并同步写入持久化后端 (如有)，服务重启后会话可从后端恢复；
+    - 超出容量或空闲超过 TTL 的会话从内存中淘汰，淘汰前把最新状态写入后端；
+    - get 未命中内存时从后端加载 (lazily rehydrate) 并重新放入内存；
+    - 正在会诊的会话通过 acquire() / release() 固定在内存中，不会被淘汰 (避免同一会话出现两个 SharedState 对象)。
+
+    后端读写都在内存锁之外进行，慢速的后端不会阻塞其他会话；后端写入由单独的锁串行化，
+    每次写入的都是该会话当时的最新状态，因此并发写入不会让旧状态覆盖新状态。
+    没有后端时，被淘汰的会话直接丢弃。
+    """
+    def __init__(self, max_entries: int = 200, ttl_seconds: Optional[float] = 1800, backend: Optional[SessionStore] = None):
+        """
+        :param max_entries: 内存中最多保留的会话数
+        :param ttl_seconds: 空闲多少秒后淘汰，None 表示不按时间淘汰
+        :param backend: (可选) 持久化后端
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # 已从内存淘汰、但尚未写入后端的会话：写入完成前 get 仍从这里取，避免读到后端中的旧状态
+        self._spilling: Dict[str, SharedState] = {}
+        self._lock = threading.RLock()
+        self._backend_lock = threading.Lock()
+
+    def _evict(self) -> List[str]:
+        """
+        按 TTL 与容量淘汰 (调用方需持有锁)，返回需要写入后端的会话 ID (由调用方在释放锁后调用 _write_back)；
+        _entries 按最近访问排序，最久未访问的在最前
+        """
+        now = time.monotonic()
+        spilled = []
+        for session_id, entry in list(self._entries.items()):
+            over_capacity = len(self._entries) > self.max_entries
+            expired = self.ttl_seconds is not None and now - entry.last_access > self.ttl_seconds
+            if not over_capacity and not expired:
+                break
+            if entry.leases:
+                continue
+            del self._entries[session_id]
+            if self.backend is not None:
+                self._spilling[session_id] = entry.state
+                spilled.append(session_id)
+        return spilled
+
+    def _write_back(self, session_ids: List[str]):
+        """把会话的最新状态写入后端 (调用方不能持有 self._lock)；写入失败只记录日志"""
+        if self.backend is None:
+            return
+        for session_id in session_ids:
+            with self._backend_lock:
+                with self._lock:
+                    entry = self._entries.get(session_id)
+                    state = entry.state if entry is not None else self._spilling.get(session_id)
+                if state is None:
+                    # 写入前会话已被删除
+                    continue
+                try:
+                    self.backend.put(session_id, state)
+                except Exception as e:
+                    print(f"[SessionStore] Failed to write session {session_id} to backend: {e}")
+                with self._lock:
+                    if self._spilling.get(session_id) is state:
+                        del self._spilling[session_id]
+
+    def _touch(self, session_id: str, entry: _Entry):
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(session_id)
+
+    def _get_cached(self, session_id: str) -> Optional[SharedState]:
+        """从内存 (含等待写入后端的会话) 取出会话并标记为最近访问 (调用方需持有锁)"""
+        entry = self._entries.get(session_id)
+        if entry is None and session_id in self._spilling:
+            entry = self._entries[session_id] = _Entry(self._spilling.pop(session_id))
+        if entry is None:
+            return None
+        self._touch(session_id, entry)
+        return entry.state
+
+    def get(self, session_id: str) -> Optional[SharedState]:
+        with self._lock:
+            spilled = self._evict()
+            state = self._get_cached(session_id)
+        self._write_back(spilled)
+        if state is not None or self.backend is None:
+            return state
+
+        state = self.backend.get(session_id)
+        if state is None:
+            return None
+        with self._lock:
+            # 加载期间其他线程可能已放入同一会话：以内存中的为准
+            cached = self._get_cached(session_id)
+            if cached is not None:
+                return cached
+            self._entries[session_id] = _Entry(state)
+            spilled = self._evict()
+        self._write_back(spilled)
+        return state
+
+    def put(self, session_id: str, state: SharedState):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                self._spilling.pop(session_id, None)
+                entry = self._entries[session_id] = _Entry(state)
+            entry.state = state
+            self._touch(session_id, entry)
+            spilled = self._evict()
+        self._write_back([session_id] + spilled)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._entries.pop(session_id, None)
+            self._spilling.pop(session_id, None)
+        if self.backend is not None:
+            with self._backend_lock:
+                self.backend.delete(session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id in self._entries or session_id in self._spilling:
+                return True
+        return self.backend is not None and session_id in self.backend
+
+    def acquire(self, session_id: str) -> Optional[SharedState]:
+        """取出会话并固定在内存中 (不会因容量或 TTL 被淘汰)，直到 release；会话不存在时返回 None"""
+        state = self.get(session_id)
+        if state is None:
+            return None
+        with self._lock:
+            if self._get_cached(session_id) is None:
+                # 刚加载即被淘汰 (容量已被其他固定的会话占满)：仍放回内存并固定
+                self._entries[session_id] = _Entry(state)
+            entry = self._entries[session_id]
+            entry.leases += 1
+            return entry.state
+
+    def release(self, session_id: str):
+        """解除 acquire 的固定，并把会话的最新状态写回后端"""
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            entry.leases = max(0, entry.leases - 1)
+            self._touch(session_id, entry)
+            spilled = self._evict()
+        self._write_back([session_id] + spilled)
+
+    @contextmanager
+    def lease(self, session_id: str):
+        """acquire / release 的 with 写法"""
+        state = self.acquire(session_id)
+        try:
+            yield state
+        finally:
+            if state is not None:
+                self.release(session_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+def create_session_store() -> InMemorySessionStore:
+    """按 settings 创建服务端使用的会话存储"""
+    backend = None
+    if settings.session_backend == "sqlite":
+        backend = SQLiteSessionStore(settings.session_db_path)
+    elif settings.session_backend == "redis":
+        if redis is None:
+            print("[SessionStore] redis not installed, sessions are kept in memory only")
+        else:
+            backend = RedisSessionStore(redis.Redis.from_url(settings.session_redis_url))
+    return InMemorySessionStore(
+        max_entries=settings.session_store_max_entries,
+        ttl_seconds=settings.session_ttl_seconds,
+        backend=backend
+    )
@@ -21,6 +21,10 @@ class SharedState(BaseModel):
     # key: 专科角色名, value: 总结文本
     specialist_summaries: Dict[str, str] = Field(default_factory=dict, description="各专科医生的总结意见")
     
+    # 各专科意见对应的输入指纹 (用于后续轮次输入未变化时直接复用意见)
+    # key: 专科角色名, value: SpecialistAgent.input_fingerprint
+    specialist_fingerprints: Dict[str, str] = Field(default_factory=dict, description="各专科意见的输入指纹")
+
     # 主持专家总结
     moderator_summary: str = Field(default="", description="主持专家的最终总结")
     
@@ -55,6 +59,28 @@ class SharedState(BaseModel):
     specialist_opinions_history: Dict[int, Dict[str, str]] = Field(default_factory=dict, description="历史轮次的专科意见")
     moderator_summary_history: Dict[int, str] = Field(default_factory=dict, description="历史轮次的专家总结")
 
+    @classmethod
+    def from_graph_state(cls, state: "AgentGraphState") -> "SharedState":
+        """
+        从图状态 (AgentGraphState) 快速构造 SharedState，供节点传给 Agent 使用。
+
+        图状态由 SharedState.model_dump() 生成并经 reducer 合并，字段类型已经可信，
+        因此这里用 model_construct 跳过校验，且直接引用原有的 dict / list 而不复制：
+        chat_history、*_history 等随轮次增长的字段不再在每个节点重复校验和拷贝。
+        缺失的字段取默认值。
+
+        注意：返回对象与图状态共享容器，只能整体赋值字段 (如 structured_info = {...})，
+        不要原地修改 (append / update)，否则会改动图状态本身。
+        """
+        return cls.model_construct(**{k: v for k, v in state.items() if k in cls.model_fields})
+
+    def add_user_input(self, case_text: str):
+        """开始新一轮：记录用户本轮输入 (病例或补充信息) 并递增轮次"""
+        self.raw_case_text = case_text
+        self.round_count += 1
+        self.raw_case_history.append(f"【第 {self.round_count} 轮输入】\n{case_text}")
+        self.chat_history.append({"role": "user", "content": case_text})
+
     def update_opinion(self, role: str, opinion: str):
         self.specialist_opinions[role] = opinion
         self.chat_history.append({"role": role, "content": opinion})
@@ -77,8 +103,9 @@ class SharedState(BaseModel):
 # --- LangGraph 专用状态定义 ---
 
 def merge_dicts(a: Dict, b: Dict) -> Dict:
-    """合并字典的 reducer"""
-    return {**a, **b}
+    """合并字典的 reducer；b 中值为 None 的键表示删除该项 (例如撤回超时专家上一轮的意见)"""
+    merged = {**a, **b}
+    return {k: v for k, v in merged.items() if v is not None}
 
 def add_messages(left: List, right: List) -> List:
     """合并列表的 reducer"""
@@ -96,6 +123,8 @@ class AgentGraphState(TypedDict):
     specialist_opinions: Annotated[Dict[str, str], merge_dicts]
     # 专科总结：合并更新
     specialist_summaries: Annotated[Dict[str, str], merge_dicts]
+    # 专科意见输入指纹：合并更新
+    specialist_fingerprints: Annotated[Dict[str, str], merge_dicts]
     # 总结：覆盖更新
     moderator_summary: str
     # 历史记录：追加更新
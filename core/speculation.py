@@ -0,0 +1,180 @@
+import contextvars
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+from core.shared_state import SharedState, AgentGraphState
+from llm.cancellation import CancellationToken, cancellation_scope, current_token
+
+class SpeculationCancelled(InterruptedError):
+    """投机执行的专家未被路由选中，中止其 LLM 调用"""
+
+class _BufferedStream:
+    """
+    投机执行期间使用的流式回调。
+    被确认 (attach) 之前，输出缓存在内存中；确认后先按原顺序回放缓存，再直接转发给真实回调。
+    被丢弃 (cancel) 或用户停止后，下一个 chunk 到达时抛出异常中止调用。
+    """
+    def __init__(self, cancelled: threading.Event, stop_event=None):
+        self._cancelled = cancelled
+        self._stop_event = stop_event
+        self._lock = threading.Lock()
+        self._events = []
+        self._attached = False
+        self._target = None
+
+    def _check(self):
+        if self._cancelled.is_set():
+            raise SpeculationCancelled("Speculative run discarded")
+        if self._stop_event and self._stop_event.is_set():
+            raise InterruptedError("Generation stopped by user")
+
+    def _forward(self, kind: str, chunk: str = None):
+        """转发给真实回调 (调用方需持有锁，以保证回放与实时输出的顺序)"""
+        if kind == "chunk":
+            if self._target:
+                self._target(chunk)
+            return
+        method = getattr(self._target, kind, None)
+        if method:
+            method()
+
+    def __call__(self, chunk: str):
+        self._check()
+        with self._lock:
+            if not self._attached:
+                self._events.append(("chunk", chunk))
+                return
+            self._forward("chunk", chunk)
+
+    def flush(self):
+        with self._lock:
+            if not self._attached:
+                self._events.append(("flush", None))
+                return
+            self._forward("flush")
+
+    def reset(self):
+        with self._lock:
+            if not self._attached:
+                # 尚未输出给任何人：直接丢弃缓存即可
+                self._events = []
+                return
+            self._forward("reset")
+
+    def attach(self, target: Optional[Callable]):
+        with self._lock:
+            self._target = target
+            self._attached = True
+            for kind, chunk in self._events:
+                self._forward(kind, chunk)
+            self._events = []
+
+class SpeculativeRun:
+    """
+    一位专家的投机执行：在后台线程中运行 agent.run，流式输出先缓存。
+
+    后台调用使用自己的取消令牌 (同时挂在所属会诊的令牌之下)：cancel() 立即关闭在途的 LLM 连接并释放限流额度，
+    而不是等到下一个 chunk 到达 (超过截止时间的专家往往正是迟迟没有输出的那一位)。
+    """
+    def __init__(self, role_name: str, agent, stop_event=None):
+        self.role_name = role_name
+        self.agent = agent
+        self.future: Future = Future()
+        self._cancelled = threading.Event()
+        self._token = CancellationToken()
+        self.chat_stream = _BufferedStream(self._cancelled, stop_event)
+        self.summary_stream = _BufferedStream(self._cancelled, stop_event)
+
+    def start(self, shared_state: SharedState):
+        parent = current_token()
+        handle = parent.register(self._token.set) if parent else None
+
+        def run():
+            try:
+                with cancellation_scope(self._token):
+                    self._run(shared_state)
+            finally:
+                if parent:
+                    parent.unregister(handle)
+
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run,), daemon=True).start()
+
+    def _run(self, shared_state: SharedState):
+        try:
+            result = self.agent.run(shared_state, stream_callback=self.chat_stream, summary_stream_callback=self.summary_stream)
+            self.future.set_result(result)
+        except BaseException as e:
+            self.future.set_exception(e)
+
+    def attach(self, chat_stream_callback: Optional[Callable], summary_stream_callback: Optional[Callable]) -> Future:
+        """确认采用本次投机结果：回放已缓存的输出并切换到真实回调，返回结果 Future"""
+        self.chat_stream.attach(chat_stream_callback)
+        self.summary_stream.attach(summary_stream_callback)
+        return self.future
+
+    def cancel(self):
+        self._cancelled.set()
+        self._token.set()
+
+class SpeculativeDispatcher:
+    """
+    投机执行调度器 (每次会诊运行一个实例，经 RunContext 传给节点)。
+
+    Moderator_Router 开始规划时，先调用 start() 在后台启动先验概率高的专家 (settings.speculative_specialists)，
+    与路由调用并行；路由结束后 discard_unselected() 中止未被选中的专家。
+    被选中的专家节点通过 claim() 取得已在运行的任务，不再重新调用 LLM。
+    """
+    def __init__(self, roles: List[str], agent_factory: Callable[[str], object], stop_event=None):
+        """
+        :param roles: 需要投机执行的专家 (已与本轮启用的专家取交集)
+        :param agent_factory: role_name -> Agent 实例 (需与专家节点使用相同的模型配置)
+        """
+        self.roles = list(roles)
+        self.agent_factory = agent_factory
+        self.stop_event = stop_event
+        self._runs: Dict[str, SpeculativeRun] = {}
+        self._lock = threading.Lock()
+
+    def start(self, state: AgentGraphState) -> List[str]:
+        """基于当前图状态启动投机执行，返回已启动的专家"""
+        if not state.get("structured_info"):
+            return []
+        started = []
+        with self._lock:
+            for role_name in self.roles:
+                if role_name in self._runs:
+                    continue
+                agent = self.agent_factory(role_name)
+                shared_state = SharedState.from_graph_state(state)
+                # 输入未变化、节点会直接复用上一轮意见的专家无需投机执行
+                if agent.reuse_previous(shared_state) is not None:
+                    continue
+                run = SpeculativeRun(role_name, agent, self.stop_event)
+                self._runs[role_name] = run
+                run.start(shared_state)
+                started.append(role_name)
+        return started
+
+    def claim(self, role_name: str) -> Optional[SpeculativeRun]:
+        """专家节点领取自己的投机任务 (没有则返回 None，按正常流程执行)"""
+        with self._lock:
+            return self._runs.pop(role_name, None)
+
+    def discard_unselected(self, selected_agents: List[str]) -> List[str]:
+        """中止未被路由选中的投机任务，返回被丢弃的专家"""
+        discarded = []
+        with self._lock:
+            for role_name in list(self._runs):
+                if role_name not in selected_agents:
+                    self._runs.pop(role_name).cancel()
+                    discarded.append(role_name)
+        return discarded
+
+    def cancel_all(self):
+        """运行结束 (或出错) 时中止所有尚未被领取的任务"""
+        with self._lock:
+            for run in self._runs.values():
+                run.cancel()
+            self._runs.clear()
@@ -91,6 +91,19 @@ function handleEvent(data) {
         clinicalStore.setSpecialistOpinion(data.role, "")
         clinicalStore.setSpecialistSummary(data.role, "")
       }
+      // Abandoned after its deadline: replace the partial stream with a placeholder
+      if (data.content === 'timed_out') {
+        clinicalStore.setSpecialistOpinion(data.role, "（本轮分析超时，已被放弃）")
+        clinicalStore.setSpecialistSummary(data.role, "")
+      }
+      // Skipped this round: drop results left over from the previous round
+      if (data.content === 'skipped') {
+        if (data.role === 'Conflict Detector') {
+          clinicalStore.setConflicts([])
+        } else if (data.role === 'Team Discussion') {
+          clinicalStore.setDiscussionNotes("")
+        }
+      }
       break
       
     case 'token':
@@ -128,6 +141,38 @@ function handleEvent(data) {
       clinicalStore.internalStream.push(`[${data.role}] ${data.content}`)
       break
       
+    case 'stream_reset': {
+      // The backend is retrying an LLM call whose stream broke halfway:
+      // drop the partial tokens already received for this target
+      const { role, target } = data
+      if (role === 'Moderator') {
+        if (target === 'summary') {
+          clinicalStore.setModeratorSummary("")
+        } else {
+          const lastMsg = chatStore.chatHistory[chatStore.chatHistory.length - 1]
+          if (lastMsg && lastMsg.role === 'Moderator') {
+            lastMsg.content = ""
+          }
+        }
+      } else if (role === 'Case Organizer') {
+        clinicalStore.clearStreamingStructuredText()
+      } else if (role === 'Team Discussion') {
+        clinicalStore.setDiscussionNotes("")
+      } else if (target === 'specialist_summary') {
+        clinicalStore.setSpecialistSummary(role, "")
+      } else {
+        clinicalStore.setSpecialistOpinion(role, "")
+      }
+      break
+    }
+
+    case 'node_partial':
+      // Partial results while a node is still generating (e.g. completed case fields)
+      if (data.data.structured_info) {
+        clinicalStore.updateStructuredInfo(data.data.structured_info)
+      }
+      break
+
     case 'node_finished':
       // Update structured data
       const output = data.data
@@ -102,6 +102,11 @@ export const useClinicalStore = defineStore('clinical', () => {
   }
 
   function setSpecialistOpinion(role, content) {
+    // null: the specialist timed out and its previous-round entry was withdrawn
+    if (content === null) {
+      delete specialistOpinions[role]
+      return
+    }
     specialistOpinions[role] = content
   }
 
@@ -113,6 +118,11 @@ export const useClinicalStore = defineStore('clinical', () => {
   }
 
   function setSpecialistSummary(role, content) {
+    // null: the specialist timed out and its previous-round entry was withdrawn
+    if (content === null) {
+      delete specialistSummaries[role]
+      return
+    }
     specialistSummaries[role] = content
   }
 
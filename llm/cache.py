@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+class LLMResponseCache:
+    """
+    内容寻址的 LLM 响应缓存 (Content-Addressed Response Cache)
+
+    缓存键是请求内容的哈希 (base_url, model, temperature, json_mode, messages ...)，
+    因此相同输入在任意会话、任意进程重启后都能命中。
+
+    两级存储：
+    1. 内存层：容量有限的 LRU (OrderedDict)，命中时无 IO。
+    2. 磁盘层：每个键一个 JSON 文件 (按前两位哈希分目录)，内存淘汰后仍可命中，
+       命中后回填到内存层。
+    """
+    def __init__(self, max_entries: int = 512, cache_dir: Optional[str] = ".cache/llm"):
+        """
+        :param max_entries: 内存 LRU 的最大条目数
+        :param cache_dir: 磁盘缓存目录；为 None 时仅使用内存层
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(base_url: str, request_kwargs: Dict[str, Any]) -> str:
+        """根据 base_url 和请求参数计算缓存键 (与是否流式无关)"""
+        payload = {
+            "base_url": base_url,
+            "model": request_kwargs.get("model"),
+            "temperature": request_kwargs.get("temperature"),
+            "json_mode": request_kwargs.get("response_format") is not None,
+            "max_tokens": request_kwargs.get("max_tokens"),
+            "messages": request_kwargs.get("messages"),
+        }
+        raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _file_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, value: str):
+        """写入内存层并执行 LRU 淘汰 (调用方需持有锁)"""
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        if not self.cache_dir:
+            return None
+
+        file_path = self._file_path(key)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                value = json.load(f)["content"]
+        except Exception as e:
+            print(f"Error loading LLM cache entry {file_path}: {e}")
+            return None
+
+        with self._lock:
+            self._remember(key, value)
+        return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._remember(key, value)
+
+        if not self.cache_dir:
+            return
+
+        file_path = self._file_path(key)
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            # 先写临时文件再原子替换，避免并发读到半个文件
+            tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"content": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            print(f"Error saving LLM cache entry {file_path}: {e}")
+
+    def clear(self):
+        """仅清空内存层 (磁盘层可直接删除目录)"""
+        with self._lock:
+            self._memory.clear()
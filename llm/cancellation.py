@@ -0,0 +1,109 @@
+import asyncio
+import contextvars
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+class CallCancelled(InterruptedError):
+    """所属会诊已被取消：LLM 调用被中止 (或尚未发出即被放弃)"""
+
+class CancellationToken(threading.Event):
+    """
+    可取消的停止信号：与 threading.Event 用法相同 (is_set / set / wait)，可直接作为 stop_event 传入会诊流程。
+
+    set() 时除置位外，还会立即关闭当前登记的所有在途调用 (流式响应的 HTTP 连接、异步调用所在的 Task)，
+    而不是等到下一个 Token 到达时才发现已停止。每个被中止的调用记录一次取消延迟
+    (从 set() 到该调用真正退出的时间)，用于 latency_stats() 统计。
+    """
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._closers: Dict[int, Callable[[], None]] = {}
+        self._next_id = 0
+        self.cancelled_at: Optional[float] = None
+        self.abort_latencies: List[float] = []
+
+    def set(self):
+        with self._lock:
+            if self.cancelled_at is None:
+                self.cancelled_at = time.monotonic()
+            closers = list(self._closers.values())
+            self._closers.clear()
+        super().set()
+        for close in closers:
+            try:
+                close()
+            except Exception as e:
+                print(f"[Cancel] Failed to close in-flight call: {e}")
+
+    def register(self, close: Callable[[], None]) -> Optional[int]:
+        """登记一个在途调用的关闭函数；已取消时立即调用并返回 None"""
+        with self._lock:
+            if self.cancelled_at is None:
+                self._next_id += 1
+                self._closers[self._next_id] = close
+                return self._next_id
+        close()
+        return None
+
+    def unregister(self, handle: Optional[int]):
+        if handle is None:
+            return
+        with self._lock:
+            self._closers.pop(handle, None)
+
+    def raise_if_cancelled(self):
+        """已取消时抛出 CallCancelled (用于在发起新调用前检查)"""
+        if self.is_set():
+            raise CallCancelled("Consultation cancelled")
+
+    def aborted(self, error: Optional[BaseException] = None) -> CallCancelled:
+        """记录一次在途调用被中止，返回应抛出的 CallCancelled"""
+        with self._lock:
+            if self.cancelled_at is not None:
+                self.abort_latencies.append(time.monotonic() - self.cancelled_at)
+        cancelled = CallCancelled("LLM call aborted by cancellation")
+        cancelled.__cause__ = error
+        return cancelled
+
+    def latency_stats(self) -> Dict[str, float]:
+        """被中止调用的取消延迟统计 (毫秒)：count / mean_ms / max_ms"""
+        with self._lock:
+            latencies = list(self.abort_latencies)
+        if not latencies:
+            return {"count": 0, "mean_ms": 0.0, "max_ms": 0.0}
+        return {
+            "count": len(latencies),
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "max_ms": max(latencies) * 1000
+        }
+
+async def sleep_unless_cancelled(delay: float, token: Optional[CancellationToken], poll_interval: float = 0.1):
+    """asyncio.sleep 的可取消版本：token 被取消时提前返回 (由调用方随后检查 raise_if_cancelled)"""
+    if not token:
+        await asyncio.sleep(delay)
+        return
+    deadline = time.monotonic() + delay
+    while not token.is_set():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(poll_interval, remaining))
+
+# 当前执行上下文所属会诊的取消令牌；LLMClient 通过它发现取消，而无需每个 Agent 层层传参。
+# LangGraph 的节点线程池会复制 contextvars；自行创建的后台线程需用 copy_context().run 启动。
+_current_token: contextvars.ContextVar[Optional[CancellationToken]] = contextvars.ContextVar("mdt_cancellation_token", default=None)
+
+def current_token() -> Optional[CancellationToken]:
+    return _current_token.get()
+
+@contextmanager
+def cancellation_scope(token: Optional[CancellationToken]):
+    """在该作用域 (及其复制了上下文的线程) 内发起的 LLM 调用受 token 控制"""
+    reset_token = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset_token)
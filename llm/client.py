@@ -1,35 +1,255 @@
 import openai
+import asyncio
 import json
 import time
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from config.settings import settings
-from config.llm_config import LLMConfig
+from config.llm_config import LLMConfig, PROVIDER_RATE_LIMITS, DEFAULT_PROVIDER_RATE_LIMIT
+from llm.cache import LLMResponseCache
+from llm.cancellation import CancellationToken, current_token, sleep_unless_cancelled
+from llm.hedging import AsyncHedgeRace, HedgeRace
+from llm.rate_limit import ConcurrencyGovernor, Permit, estimate_message_tokens, estimate_tokens
+from llm.retry import RetryPolicy, is_transient_error
+from llm.streaming import StreamAborted, StreamAccumulator
 
-class LLMClient:
+# 全局响应缓存 (同步 / 异步客户端共享)
+response_cache = LLMResponseCache(
+    max_entries=settings.llm_cache_max_entries,
+    cache_dir=settings.llm_cache_dir or None
+)
+
+# 全局限流器 (同步 / 异步客户端共享同一份 Provider 额度)
+governor = ConcurrencyGovernor(
+    provider_limits=PROVIDER_RATE_LIMITS,
+    default_provider_limit=DEFAULT_PROVIDER_RATE_LIMIT
+)
+
+# 全局重试策略 (瞬时故障时带抖动的指数退避)
+retry_policy = RetryPolicy(
+    max_attempts=settings.llm_max_attempts,
+    base_delay=settings.llm_retry_base_delay,
+    max_delay=settings.llm_retry_max_delay
+)
+
+class LLMCallFailed(Exception):
+    """所有预设 (含故障转移) 均调用失败；last_error 为最后一个预设失败的原因"""
+    def __init__(self, last_error: Exception):
+        super().__init__(f"LLM 调用失败: {last_error}")
+        self.last_error = last_error
+
+class _StreamAttempt:
+    """
+    包装 stream_callback，记录本次尝试是否已经向调用方输出过内容。
+    若流在中途断开并需要重试，通过 stream_callback.reset() (如果调用方提供) 通知调用方
+    丢弃已输出的部分内容，重试从头开始输出。
+    """
+    def __init__(self, stream_callback: callable = None):
+        self.stream_callback = stream_callback
+        self.started = False
+
+    def __call__(self, chunk: str):
+        self.started = True
+        if self.stream_callback:
+            self.stream_callback(chunk)
+
+    def reset(self):
+        if not self.started:
+            return
+        self.started = False
+        reset = getattr(self.stream_callback, "reset", None)
+        if reset:
+            reset()
+
+class _BaseLLMClient:
+    """
+    同步 / 异步客户端的公共逻辑：参数解析与请求体构造。
+    """
+    def _resolve_model_params(self, model: str = None, temperature: float = 0.7, config: LLMConfig = None) -> Tuple[str, float]:
+        """
+        确定本次调用使用的模型名称与采样温度。
+
+        :return: (target_model, target_temp)
+        """
+        target_model = model
+        target_temp = temperature
+
+        if config:
+            # 如果提供了 config，优先使用 config 中的模型名（除非显式传入了 model 参数）
+            target_model = model or config.model_name
+            # 如果传入的 temperature 是默认值 0.7，则尝试使用 config 中的配置
+            target_temp = temperature if temperature != 0.7 else config.temperature
+        else:
+            # 回退到全局设置
+            target_model = model or settings.model_name
+        return target_model, target_temp
+
+    def _build_request_kwargs(self, messages: list, target_model: str, target_temp: float, json_mode: bool, stream: bool) -> Dict[str, Any]:
+        """构造 chat.completions.create 的请求参数"""
+        response_format = {"type": "json_object"} if json_mode else None
+
+        kwargs = {
+            "model": target_model,
+            "messages": messages,
+            "temperature": target_temp,
+            "response_format": response_format,
+            "stream": stream
+        }
+
+        # --- 测试模式 (Test Mode) ---
+        # 在测试模式下限制 max_tokens 以节省成本
+        if settings.test_mode:
+            kwargs["max_tokens"] = 256
+            print(f"[Test Mode] Max tokens limited to {kwargs['max_tokens']} for {target_model}")
+        return kwargs
+
+    def _cache_key(self, config: LLMConfig, use_cache: Optional[bool], request_kwargs: Dict[str, Any]) -> Optional[str]:
+        """
+        计算本次调用的缓存键；未开启缓存时返回 None。
+        use_cache 为 None 时遵循 config.cache 的设置。
+        """
+        if not settings.llm_cache_enabled:
+            return None
+        enabled = use_cache if use_cache is not None else bool(config and config.cache)
+        if not enabled:
+            return None
+        base_url = config.base_url if config else settings.openai_base_url
+        return LLMResponseCache.make_key(base_url, request_kwargs)
+
+    @staticmethod
+    def _candidate_configs(config: LLMConfig = None) -> List[Optional[LLMConfig]]:
+        """本次调用依次尝试的配置：主配置 + 故障转移列表"""
+        if not config:
+            return [None]
+        return [config] + list(config.fallbacks)
+
+    @staticmethod
+    def _log_retry(target_model: str, attempt: int, error: Exception, delay: float):
+        print(f"[Retry] {target_model} attempt {attempt + 1} failed ({type(error).__name__}: {error}), retrying in {delay:.1f}s")
+
+    @staticmethod
+    def _log_failover(previous: Optional[LLMConfig], candidate: LLMConfig, error: Exception, call_stats: Optional[dict]):
+        previous_model = previous.model_name if previous else settings.model_name
+        print(f"[Failover] {previous_model} failed ({error}), switching to {candidate.model_name}")
+        if call_stats is not None:
+            call_stats.setdefault("failovers", []).append(candidate.model_name)
+
+    @staticmethod
+    def _hedge_target(config: LLMConfig = None) -> Optional[LLMConfig]:
+        """本次调用的对冲预设；未开启对冲时返回 None"""
+        if not settings.llm_hedging_enabled or not config:
+            return None
+        if config.hedge_config is None or config.hedge_delay is None:
+            return None
+        return config.hedge_config
+
+    @staticmethod
+    def _hedge_request_kwargs(hedge_config: LLMConfig, request_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """对冲请求与主请求的消息、JSON 模式等完全相同，只替换模型与温度"""
+        return dict(request_kwargs, model=hedge_config.model_name, temperature=hedge_config.temperature)
+
+    @staticmethod
+    def _report_hedge(race, config: LLMConfig, target_model: str, call_stats: Optional[dict]):
+        """记录对冲结果：是否发出了备用请求、哪一路胜出"""
+        if not race.hedged:
+            return
+        winner_model = config.hedge_config.model_name if race.winner == "backup" else target_model
+        print(f"[Hedge] {target_model} no first token after {config.hedge_delay:.1f}s, hedged to {config.hedge_config.model_name}, winner: {winner_model}")
+        if call_stats is not None:
+            call_stats["hedged"] = True
+            call_stats["hedge_winner"] = winner_model
+
+    def _governed_config(self, config: LLMConfig, target_model: str) -> LLMConfig:
+        """限流按 (base_url, api_key) 统计，未传 config 时使用全局默认配置"""
+        if config:
+            return config
+        return LLMConfig(api_key=settings.openai_api_key, base_url=settings.openai_base_url, model_name=target_model)
+
+    @staticmethod
+    def _estimate_request_tokens(request_kwargs: Dict[str, Any]) -> int:
+        """预估一次调用的 Token 消耗 (输入 + 预期输出)"""
+        output_tokens = request_kwargs.get("max_tokens") or settings.llm_output_token_estimate
+        return estimate_message_tokens(request_kwargs["messages"]) + output_tokens
+
+    @staticmethod
+    def _report_queue_wait(permit: Permit, target_model: str, call_stats: Optional[dict]):
+        """把排队时长回报给调用方 (call_stats)，较长的等待同时打印出来便于排查"""
+        if call_stats is not None:
+            call_stats["queue_wait"] = call_stats.get("queue_wait", 0.0) + permit.queue_wait
+        if permit.queue_wait >= 1.0:
+            print(f"[RateLimit] {target_model} waited {permit.queue_wait:.2f}s for provider quota")
+
+    @staticmethod
+    def _release_permit(permit: Optional[Permit], request_kwargs: Dict[str, Any], content: Optional[str]):
+        """归还限流名额，并按实际输出长度结算 Token 额度"""
+        if not permit:
+            return
+        actual_tokens = None
+        if content is not None:
+            actual_tokens = estimate_message_tokens(request_kwargs["messages"]) + estimate_tokens(content)
+        governor.release(permit, actual_tokens)
+
+    @staticmethod
+    def _replay_cached(content: str, stream: bool, stream_callback: callable = None, chunk_size: int = 32) -> str:
+        """缓存命中时，在流式模式下按块回放给 stream_callback，保持 UI 行为一致"""
+        if stream and stream_callback:
+            for i in range(0, len(content), chunk_size):
+                stream_callback(content[i:i + chunk_size])
+        return content
+
+    @staticmethod
+    def _flush_stream(stream_callback: callable = None):
+        """流式输出结束：让带合并缓冲的回调 (stream_callback.flush) 输出剩余内容"""
+        flush = getattr(stream_callback, "flush", None)
+        if flush:
+            flush()
+
+    @staticmethod
+    def _stream_transport(stream: bool, token: Optional[CancellationToken]) -> bool:
+        """是否以流式传输发起请求：调用方要求流式，或处于可取消的会诊中 (取消时可立即断开连接)"""
+        return stream or bool(token and settings.llm_cancellable_transport)
+
+    @staticmethod
+    def _extract_delta(chunk) -> Optional[str]:
+        """从流式 chunk 中提取增量文本，没有内容时返回 None"""
+        # 增加安全检查：确保 choices 列表不为空
+        if chunk.choices and len(chunk.choices) > 0:
+            delta = chunk.choices[0].delta
+            # 检查 content 是否存在 (有些 chunk 可能只包含 finish_reason)
+            if delta.content is not None:
+                return delta.content
+        return None
+
+class LLMClient(_BaseLLMClient):
     """
     大模型客户端封装类 (LLM Client Wrapper)
-    
+
     该类旨在提供一个统一的接口来调用不同的大语言模型服务（如 OpenAI, DeepSeek, Claude 等）。
     它支持多 Provider 管理，能够根据传入的配置自动切换底层的 API Client。
-    
+
     主要功能：
     1. 多客户端管理：根据 API Key 和 Base URL 缓存和复用 openai.OpenAI 实例。
     2. 统一调用接口：屏蔽不同模型在调用细节上的差异（目前主要基于 OpenAI 兼容接口）。
     3. 流式/非流式支持：统一封装了流式输出 (Stream) 和普通输出的处理逻辑。
     4. JSON 模式支持：便捷地开启 JSON Output Mode。
     5. 测试模式支持：在测试环境下限制 Token 消耗。
+    6. 响应缓存：对开启缓存的配置 (LLMConfig.cache)，相同请求直接复用历史结果。
+    7. 限流：按 Provider / 模型限制请求速率、Token 速率与在途请求数，超限时排队而不是触发 429。
+    8. 重试与故障转移：瞬时故障按指数退避重试，仍失败则按 LLMConfig.fallbacks 切换预设。
+    9. 对冲请求：首 Token 超过 LLMConfig.hedge_delay 未到达时向 hedge_config 再发一份请求，先出 Token 者胜出。
     """
     def __init__(self):
         """
         初始化 LLMClient。
-        
+
         默认创建一个基于 settings 中配置的 OpenAI 客户端作为后备。
         初始化客户端缓存字典 `_clients`。
         """
         # 默认客户端 (兼容旧代码或未指定配置的情况)
+        # 重试由 get_completion 统一处理，关闭 SDK 内置重试以免重试次数相乘
         self.default_client = openai.OpenAI(
             api_key=settings.openai_api_key,
-            base_url=settings.openai_base_url
+            base_url=settings.openai_base_url,
+            max_retries=0
         )
         # 客户端缓存: {(api_key, base_url): client_instance}
         # 用于避免重复创建相同的客户端连接
@@ -38,98 +258,359 @@ class LLMClient:
     def _get_client(self, config: LLMConfig = None) -> openai.OpenAI:
         """
         根据提供的配置获取或创建 OpenAI 客户端实例。
-        
+
         :param config: LLMConfig 对象，包含 api_key 和 base_url。
         :return: openai.OpenAI 客户端实例。
         """
         if not config:
             return self.default_client
-        
+
         key = (config.api_key, config.base_url)
         if key not in self._clients:
             self._clients[key] = openai.OpenAI(
                 api_key=config.api_key,
-                base_url=config.base_url
+                base_url=config.base_url,
+                max_retries=0
             )
         return self._clients[key]
 
-    def get_completion(self, 
-                       messages: list, 
-                       model: str = None, 
+    def get_completion(self,
+                       messages: list,
+                       model: str = None,
                        temperature: float = 0.7,
                        json_mode: bool = False,
                        stream: bool = False,
                        stream_callback: callable = None,
-                       config: LLMConfig = None) -> str:
+                       config: LLMConfig = None,
+                       use_cache: Optional[bool] = None,
+                       call_stats: Optional[dict] = None) -> str:
         """
         获取模型回复的核心方法。
-        
+
         :param messages: 对话列表，格式为 [{"role": "user", "content": "..."}]。
         :param model: (可选) 强制指定使用的模型名称。如果不传，则优先使用 config 中的 model_name，最后回退到 settings.model_name。
         :param temperature: (可选) 采样温度。如果不传，则优先使用 config 中的 temperature。
         :param json_mode: 是否强制模型输出 JSON 格式 (需要模型支持 json_object)。
         :param stream: 是否开启流式输出 (Streaming)。
         :param stream_callback: 流式输出时的回调函数，接收 chunk 字符串作为参数。
+            若流中途断开需要重试，会调用 stream_callback.reset() (如有) 通知调用方丢弃已输出内容；
+            调用成功结束时会调用 stream_callback.flush() (如有)，供合并输出的回调输出剩余内容。
+            回调抛出 StreamAborted 时立即结束调用并原样抛出 (不重试、不切换预设)。
         :param config: (新增) LLMConfig 对象，指定本次调用使用的模型配置 (Key, URL, Model, Temp)。
+        :param use_cache: (可选) 是否使用响应缓存；不传则遵循 config.cache。
+        :param call_stats: (可选) 调用统计字典，调用结束后写入 queue_wait (因限流排队的秒数)、
+            attempts (总尝试次数)、model (最终使用的模型)、failovers (切换过的预设)，
+            以及发生对冲时的 hedged / hedge_winner (胜出的模型)。
         :return: 模型生成的完整文本内容。
+        :raises LLMCallFailed: 所有预设均失败 (已按重试策略重试并完成故障转移)。
         """
+        last_error = None
+        previous = None
+        for candidate in self._candidate_configs(config):
+            if last_error is not None:
+                self._log_failover(previous, candidate, last_error, call_stats)
+            try:
+                return self._complete_with_retries(messages, model, temperature, json_mode, stream, stream_callback, candidate, use_cache, call_stats)
+            except (InterruptedError, StreamAborted):
+                raise
+            except Exception as e:
+                last_error = e
+                previous = candidate
+        raise LLMCallFailed(last_error) from last_error
+
+    def _complete_with_retries(self, messages, model, temperature, json_mode, stream, stream_callback, config, use_cache, call_stats) -> str:
+        """使用单个预设完成调用：缓存 → 限流 → 请求，瞬时故障时退避重试"""
         # 1. 确定使用的配置参数 (Model & Temperature)
-        target_model = model
-        target_temp = temperature
-        
-        if config:
-            # 如果提供了 config，优先使用 config 中的模型名（除非显式传入了 model 参数）
-            target_model = model or config.model_name
-            # 如果传入的 temperature 是默认值 0.7，则尝试使用 config 中的配置
-            target_temp = temperature if temperature != 0.7 else config.temperature
-        else:
-            # 回退到全局设置
-            target_model = model or settings.model_name
+        target_model, target_temp = self._resolve_model_params(model, temperature, config)
 
         # 2. 获取对应的 API Client
         client = self._get_client(config)
-        
+
         # 3. 执行 API 调用
+        kwargs = self._build_request_kwargs(messages, target_model, target_temp, json_mode, stream)
+        if call_stats is not None:
+            call_stats["model"] = target_model
+
+        # 缓存命中则直接返回 (流式模式下回放给 stream_callback)
+        cache_key = self._cache_key(config, use_cache, kwargs)
+        if cache_key:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                self._replay_cached(cached, stream, stream_callback)
+                self._flush_stream(stream_callback)
+                return cached
+
+        token = current_token()
+        for attempt in range(retry_policy.max_attempts):
+            # 会诊已取消：不再发起新的调用
+            if token:
+                token.raise_if_cancelled()
+            stream_attempt = _StreamAttempt(stream_callback)
+            if call_stats is not None:
+                call_stats["attempts"] = call_stats.get("attempts", 0) + 1
+            try:
+                full_content = self._hedged_request(client, config, target_model, kwargs, stream, stream_attempt, call_stats)
+                break
+            except (InterruptedError, StreamAborted):
+                raise
+            except Exception as e:
+                # 流中途断开：通知调用方丢弃已输出的部分内容
+                stream_attempt.reset()
+                if not is_transient_error(e) or attempt == retry_policy.max_attempts - 1:
+                    raise
+                delay = retry_policy.delay(attempt, e)
+                self._log_retry(target_model, attempt, e, delay)
+                if token:
+                    token.wait(delay)
+                else:
+                    time.sleep(delay)
+
+        self._flush_stream(stream_callback)
+        if cache_key and full_content:
+            response_cache.set(cache_key, full_content)
+        return full_content
+
+    def _hedged_request(self, client: openai.OpenAI, config: LLMConfig, target_model: str, request_kwargs: Dict[str, Any], stream: bool, stream_callback: callable, call_stats: Optional[dict]) -> str:
+        """配置了对冲预设时以对冲方式发起请求，否则直接请求"""
+        hedge_config = self._hedge_target(config)
+        if not hedge_config:
+            return self._governed_request(client, config, target_model, request_kwargs, stream, stream_callback, call_stats)
+
+        hedge_kwargs = self._hedge_request_kwargs(hedge_config, request_kwargs)
+        race = HedgeRace(stream_callback)
+        try:
+            return race.run(
+                lambda callback: self._governed_request(client, config, target_model, request_kwargs, stream, callback, call_stats),
+                lambda callback: self._governed_request(self._get_client(hedge_config), hedge_config, hedge_config.model_name, hedge_kwargs, stream, callback, call_stats),
+                config.hedge_delay
+            )
+        finally:
+            self._report_hedge(race, config, target_model, call_stats)
+
+    def _governed_request(self, client: openai.OpenAI, config: LLMConfig, target_model: str, request_kwargs: Dict[str, Any], stream: bool, stream_callback: callable, call_stats: Optional[dict]) -> str:
+        """在限流许可下发起一次请求"""
+        permit = None
+        if settings.llm_rate_limit_enabled:
+            permit = governor.acquire(self._governed_config(config, target_model), target_model, self._estimate_request_tokens(request_kwargs), current_token())
+            self._report_queue_wait(permit, target_model, call_stats)
+
+        full_content = None
         try:
-            response_format = {"type": "json_object"} if json_mode else None
-            
-            # 构造请求参数
-            kwargs = {
-                "model": target_model,
-                "messages": messages,
-                "temperature": target_temp,
-                "response_format": response_format,
-                "stream": stream
-            }
-
-            # --- 测试模式 (Test Mode) ---
-            # 在测试模式下限制 max_tokens 以节省成本
-            if settings.test_mode:
-                kwargs["max_tokens"] = 256 
-                print(f"[Test Mode] Max tokens limited to {kwargs['max_tokens']} for {target_model}")
-
-            if stream:
-                # 流式处理逻辑
-                response_stream = client.chat.completions.create(**kwargs)
-                full_content = ""
+            full_content = self._request(client, request_kwargs, stream, stream_callback)
+        finally:
+            self._release_permit(permit, request_kwargs, full_content)
+        return full_content
+
+    def _request(self, client: openai.OpenAI, request_kwargs: Dict[str, Any], stream: bool, stream_callback: callable = None) -> str:
+        """
+        向 Provider 发起一次请求并返回完整文本。
+        处于可取消的会诊中时，响应流登记到取消令牌：取消时由令牌直接关闭连接，本次调用抛出 CallCancelled。
+        """
+        token = current_token()
+        if self._stream_transport(stream, token):
+            # 流式处理逻辑
+            response_stream = client.chat.completions.create(**dict(request_kwargs, stream=True))
+            handle = token.register(response_stream.close) if token else None
+            accumulator = StreamAccumulator()
+            try:
                 for chunk in response_stream:
-                    # 增加安全检查：确保 choices 列表不为空
-                    if chunk.choices and len(chunk.choices) > 0:
-                        delta = chunk.choices[0].delta
-                        # 检查 content 是否存在 (有些 chunk 可能只包含 finish_reason)
-                        if delta.content is not None:
-                            content_chunk = delta.content
-                            full_content += content_chunk
-                            if stream_callback:
-                                stream_callback(content_chunk)
-                return full_content
-            else:
-                # 非流式处理逻辑
-                response = client.chat.completions.create(**kwargs)
-                return response.choices[0].message.content
-        except InterruptedError:
-            raise
-        except Exception as e:
-            return f"[Error] LLM 调用失败: {str(e)}"
+                    content_chunk = self._extract_delta(chunk)
+                    if content_chunk is not None:
+                        accumulator.append(content_chunk)
+                        if stream and stream_callback:
+                            stream_callback(content_chunk)
+            except Exception as e:
+                # 连接被取消令牌关闭时，底层读取会以各种网络异常结束
+                if token and token.is_set():
+                    raise token.aborted(e)
+                raise
+            finally:
+                if token:
+                    token.unregister(handle)
+                # 回调中止读取 (用户停止、对冲落败) 时立即关闭连接
+                response_stream.close()
+            if token and token.is_set():
+                raise token.aborted()
+            return accumulator.text()
+        # 非流式处理逻辑
+        response = client.chat.completions.create(**request_kwargs)
+        return response.choices[0].message.content
+
+class AsyncLLMClient(_BaseLLMClient):
+    """
+    异步大模型客户端 (基于 openai.AsyncOpenAI)
+
+    与 LLMClient 保持相同的 get_completion 调用约定 (流式/非流式、json_mode、
+    stream_callback、LLMConfig)，区别在于 get_completion 是协程：
+    等待模型输出期间不占用 OS 线程，适合在事件循环中驱动整张会诊图 (astream)。
+
+    stream_callback 仍然是普通的同步函数，会在事件循环线程中被调用，因此不应执行阻塞操作。
+    """
+    def __init__(self):
+        self.default_client = openai.AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            base_url=settings.openai_base_url,
+            max_retries=0
+        )
+        # 客户端缓存: {(api_key, base_url): async_client_instance}
+        self._clients = {}
+
+    def _get_client(self, config: LLMConfig = None) -> openai.AsyncOpenAI:
+        """根据提供的配置获取或创建 AsyncOpenAI 客户端实例"""
+        if not config:
+            return self.default_client
+
+        key = (config.api_key, config.base_url)
+        if key not in self._clients:
+            self._clients[key] = openai.AsyncOpenAI(
+                api_key=config.api_key,
+                base_url=config.base_url,
+                max_retries=0
+            )
+        return self._clients[key]
+
+    async def get_completion(self,
+                             messages: list,
+                             model: str = None,
+                             temperature: float = 0.7,
+                             json_mode: bool = False,
+                             stream: bool = False,
+                             stream_callback: callable = None,
+                             config: LLMConfig = None,
+                             use_cache: Optional[bool] = None,
+                             call_stats: Optional[dict] = None) -> str:
+        """
+        获取模型回复的核心方法 (异步版本)，参数与 LLMClient.get_completion 一致。
+
+        :return: 模型生成的完整文本内容。
+        :raises LLMCallFailed: 所有预设均失败 (已按重试策略重试并完成故障转移)。
+        """
+        last_error = None
+        previous = None
+        for candidate in self._candidate_configs(config):
+            if last_error is not None:
+                self._log_failover(previous, candidate, last_error, call_stats)
+            try:
+                return await self._complete_with_retries(messages, model, temperature, json_mode, stream, stream_callback, candidate, use_cache, call_stats)
+            except (InterruptedError, StreamAborted):
+                raise
+            except Exception as e:
+                last_error = e
+                previous = candidate
+        raise LLMCallFailed(last_error) from last_error
+
+    async def _complete_with_retries(self, messages, model, temperature, json_mode, stream, stream_callback, config, use_cache, call_stats) -> str:
+        """使用单个预设完成调用 (异步版本)"""
+        target_model, target_temp = self._resolve_model_params(model, temperature, config)
+        client = self._get_client(config)
+
+        kwargs = self._build_request_kwargs(messages, target_model, target_temp, json_mode, stream)
+        if call_stats is not None:
+            call_stats["model"] = target_model
+
+        cache_key = self._cache_key(config, use_cache, kwargs)
+        if cache_key:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                self._replay_cached(cached, stream, stream_callback)
+                self._flush_stream(stream_callback)
+                return cached
+
+        token = current_token()
+        for attempt in range(retry_policy.max_attempts):
+            if token:
+                token.raise_if_cancelled()
+            stream_attempt = _StreamAttempt(stream_callback)
+            if call_stats is not None:
+                call_stats["attempts"] = call_stats.get("attempts", 0) + 1
+            try:
+                full_content = await self._hedged_request(client, config, target_model, kwargs, stream, stream_attempt, call_stats)
+                break
+            except (InterruptedError, StreamAborted):
+                raise
+            except Exception as e:
+                stream_attempt.reset()
+                if not is_transient_error(e) or attempt == retry_policy.max_attempts - 1:
+                    raise
+                delay = retry_policy.delay(attempt, e)
+                self._log_retry(target_model, attempt, e, delay)
+                await sleep_unless_cancelled(delay, token)
+
+        self._flush_stream(stream_callback)
+        if cache_key and full_content:
+            response_cache.set(cache_key, full_content)
+        return full_content
+
+    async def _hedged_request(self, client: openai.AsyncOpenAI, config: LLMConfig, target_model: str, request_kwargs: Dict[str, Any], stream: bool, stream_callback: callable, call_stats: Optional[dict]) -> str:
+        """配置了对冲预设时以对冲方式发起请求，否则直接请求 (异步版本)"""
+        hedge_config = self._hedge_target(config)
+        if not hedge_config:
+            return await self._governed_request(client, config, target_model, request_kwargs, stream, stream_callback, call_stats)
+
+        hedge_kwargs = self._hedge_request_kwargs(hedge_config, request_kwargs)
+        race = AsyncHedgeRace(stream_callback)
+        try:
+            return await race.run(
+                lambda callback: self._governed_request(client, config, target_model, request_kwargs, stream, callback, call_stats),
+                lambda callback: self._governed_request(self._get_client(hedge_config), hedge_config, hedge_config.model_name, hedge_kwargs, stream, callback, call_stats),
+                config.hedge_delay
+            )
+        finally:
+            self._report_hedge(race, config, target_model, call_stats)
+
+    async def _governed_request(self, client: openai.AsyncOpenAI, config: LLMConfig, target_model: str, request_kwargs: Dict[str, Any], stream: bool, stream_callback: callable, call_stats: Optional[dict]) -> str:
+        """在限流许可下发起一次请求 (异步版本)"""
+        permit = None
+        if settings.llm_rate_limit_enabled:
+            permit = await governor.acquire_async(self._governed_config(config, target_model), target_model, self._estimate_request_tokens(request_kwargs), current_token())
+            self._report_queue_wait(permit, target_model, call_stats)
+
+        full_content = None
+        try:
+            full_content = await self._request(client, request_kwargs, stream, stream_callback)
+        finally:
+            self._release_permit(permit, request_kwargs, full_content)
+        return full_content
+
+    async def _request(self, client: openai.AsyncOpenAI, request_kwargs: Dict[str, Any], stream: bool, stream_callback: callable = None) -> str:
+        """
+        向 Provider 发起一次请求并返回完整文本 (异步版本)。
+        处于可取消的会诊中时，取消令牌会直接取消执行本次请求的 Task (httpx 随之断开连接)，本次调用抛出 CallCancelled。
+        """
+        token = current_token()
+        if not token:
+            return await self._read_response(client, request_kwargs, stream, stream_callback)
+
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        handle = token.register(lambda: loop.call_soon_threadsafe(task.cancel))
+        try:
+            return await self._read_response(client, request_kwargs, stream, stream_callback)
+        except asyncio.CancelledError as e:
+            if not token.is_set():
+                raise
+            # 取消来自令牌而非外层：撤销本次 cancel 请求，以 CallCancelled 的形式向上传递
+            task.uncancel()
+            raise token.aborted(e)
+        finally:
+            token.unregister(handle)
+
+    async def _read_response(self, client: openai.AsyncOpenAI, request_kwargs: Dict[str, Any], stream: bool, stream_callback: callable = None) -> str:
+        if stream:
+            response_stream = await client.chat.completions.create(**request_kwargs)
+            accumulator = StreamAccumulator()
+            try:
+                async for chunk in response_stream:
+                    content_chunk = self._extract_delta(chunk)
+                    if content_chunk is not None:
+                        accumulator.append(content_chunk)
+                        if stream_callback:
+                            stream_callback(content_chunk)
+            finally:
+                await response_stream.close()
+            return accumulator.text()
+        response = await client.chat.completions.create(**request_kwargs)
+        return response.choices[0].message.content
 
 llm_client = LLMClient()
+async_llm_client = AsyncLLMClient()
@@ -0,0 +1,200 @@
+import asyncio
+import contextvars
+import threading
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from llm.cancellation import CancellationToken, cancellation_scope, current_token
+
+PRIMARY = "primary"
+BACKUP = "backup"
+
+class HedgeLost(Exception):
+    """当前请求在对冲竞速中落败，用于中止其流式读取"""
+
+class HedgeRace:
+    """
+    对冲请求 (Hedged Request) 的同步实现。
+
+    先发出主请求；若在 delay 秒内仍未收到首个 Token，则向备用预设发出一份相同的请求。
+    两路中最先产出 Token 的一路获胜，其输出继续转发给 stream_callback；
+    非流式请求以最先返回完整结果的一路为准。
+
+    每一路在独立的守护线程中、以各自的取消令牌执行 (令牌同时挂在所属会诊的令牌之下)。
+    决出胜者后立即 set() 落败一路的令牌，直接关闭其响应流并释放限流额度，
+    而不是等它的下一个 chunk 到达 (首 Token 迟迟不来的主请求正是对冲要处理的情况)。
+    """
+    def __init__(self, stream_callback: callable = None):
+        self.stream_callback = stream_callback
+        self.winner: Optional[str] = None
+        # 是否已发出备用请求
+        self.hedged = False
+        self._cond = threading.Condition()
+        self._launched = []
+        self._results: Dict[str, str] = {}
+        self._errors: Dict[str, BaseException] = {}
+        self._tokens: Dict[str, CancellationToken] = {}
+
+    def _claim(self, leg: str) -> bool:
+        """尝试成为获胜者 (调用方需持有锁)，返回该路是否为获胜者"""
+        if self.winner is None:
+            self.winner = leg
+            self._cond.notify_all()
+        return self.winner == leg
+
+    def _abort_losers(self):
+        """中止除获胜者以外的所有请求 (不可持有锁：关闭连接可能触发其他线程的回调)"""
+        with self._cond:
+            losers = [token for leg, token in self._tokens.items() if leg != self.winner]
+        for token in losers:
+            token.set()
+
+    def callback_for(self, leg: str) -> Callable[[str], None]:
+        def callback(chunk: str):
+            with self._cond:
+                newly_won = self.winner is None
+                won = self._claim(leg)
+            if newly_won:
+                self._abort_losers()
+            if not won:
+                raise HedgeLost()
+            if self.stream_callback:
+                self.stream_callback(chunk)
+        return callback
+
+    def _run_leg(self, leg: str, request_fn: Callable[[Callable], str]):
+        try:
+            content = request_fn(self.callback_for(leg))
+            with self._cond:
+                # 没有产出任何 chunk 的请求 (非流式或空回复) 在完成时参与竞速
+                self._claim(leg)
+                self._results[leg] = content
+                self._cond.notify_all()
+            self._abort_losers()
+        except BaseException as e:
+            with self._cond:
+                self._errors[leg] = e
+                self._cond.notify_all()
+
+    def _launch(self, leg: str, request_fn: Callable[[Callable], str]):
+        """启动一路请求 (调用方需持有锁)"""
+        self._launched.append(leg)
+        # 每一路使用自己的取消令牌：所属会诊被取消时一并取消，落败时单独取消
+        token = self._tokens[leg] = CancellationToken()
+        parent = current_token()
+        handle = parent.register(token.set) if parent else None
+
+        def run_leg():
+            try:
+                with cancellation_scope(token):
+                    self._run_leg(leg, request_fn)
+            finally:
+                if parent:
+                    parent.unregister(handle)
+
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(run_leg,), daemon=True).start()
+
+    def _outcome(self) -> Optional[Tuple[bool, object]]:
+        """当前是否已有结论 (调用方需持有锁)：返回 (成功?, 内容或异常)，尚无结论时返回 None"""
+        for leg, error in self._errors.items():
+            # 落败一路被中止时同样抛出 CallCancelled (InterruptedError)，不代表会诊被取消
+            if isinstance(error, InterruptedError) and self.winner in (None, leg):
+                return False, error
+        if self.winner is not None:
+            if self.winner in self._results:
+                return True, self._results[self.winner]
+            if self.winner in self._errors:
+                return False, self._errors[self.winner]
+            return None
+        if self._launched and all(leg in self._errors for leg in self._launched):
+            return False, self._errors[self._launched[0]]
+        return None
+
+    def run(self, primary_fn: Callable[[Callable], str], backup_fn: Callable[[Callable], str], delay: float) -> str:
+        """
+        :param primary_fn / backup_fn: 接收 stream_callback、返回完整文本的请求函数
+        :param delay: 等待首个 Token 的时长 (秒)，超时后发出备用请求
+        """
+        self._launch(PRIMARY, primary_fn)
+        with self._cond:
+            self._cond.wait_for(lambda: self.winner is not None or PRIMARY in self._errors, timeout=delay)
+            if self.winner is None and PRIMARY not in self._errors:
+                self.hedged = True
+                self._launch(BACKUP, backup_fn)
+            self._cond.wait_for(lambda: self._outcome() is not None)
+            ok, value = self._outcome()
+        self._abort_losers()
+        if not ok:
+            raise value
+        return value
+
+class AsyncHedgeRace:
+    """
+    对冲请求的异步实现，语义与 HedgeRace 相同：
+    两路请求作为 asyncio.Task 运行，获胜后 (首个 chunk 到达时) 立即 cancel 落败的一路 (关闭其连接)，
+    而不是等获胜一路的流结束。
+    """
+    def __init__(self, stream_callback: callable = None):
+        self.stream_callback = stream_callback
+        self.winner: Optional[str] = None
+        self.hedged = False
+        self._first_token = asyncio.Event()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def _abort_losers(self):
+        """取消除获胜者以外仍在运行的请求"""
+        for leg, task in self._tasks.items():
+            if leg != self.winner and not task.done():
+                task.cancel()
+
+    def callback_for(self, leg: str) -> Callable[[str], None]:
+        def callback(chunk: str):
+            if self.winner is None:
+                self.winner = leg
+                self._first_token.set()
+                # 回调在获胜一路的任务中 (事件循环线程上) 同步执行，可以直接取消另一路
+                self._abort_losers()
+            if self.winner != leg:
+                raise HedgeLost()
+            if self.stream_callback:
+                self.stream_callback(chunk)
+        return callback
+
+    async def run(self, primary_fn: Callable[[Callable], Awaitable[str]], backup_fn: Callable[[Callable], Awaitable[str]], delay: float) -> str:
+        tasks = {asyncio.ensure_future(primary_fn(self.callback_for(PRIMARY))): PRIMARY}
+        self._tasks = {leg: task for task, leg in tasks.items()}
+        first_token = asyncio.ensure_future(self._first_token.wait())
+        try:
+            await asyncio.wait(list(tasks) + [first_token], timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            primary_task = next(iter(tasks))
+            if self.winner is None and not primary_task.done():
+                self.hedged = True
+                backup_task = asyncio.ensure_future(backup_fn(self.callback_for(BACKUP)))
+                tasks[backup_task] = BACKUP
+                self._tasks[BACKUP] = backup_task
+
+            pending = set(tasks)
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    leg = tasks[task]
+                    if task.cancelled():
+                        # 落败后被 _abort_losers 取消的一路
+                        continue
+                    error = task.exception()
+                    if isinstance(error, InterruptedError):
+                        raise error
+                    if error is None and self.winner in (None, leg):
+                        self.winner = leg
+                        return task.result()
+                    if error is not None and self.winner == leg:
+                        raise error
+                    if error is not None and first_error is None and not isinstance(error, HedgeLost):
+                        first_error = error
+            raise first_error or RuntimeError("All hedged requests failed")
+        finally:
+            first_token.cancel()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
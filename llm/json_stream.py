@@ -0,0 +1,195 @@
+import json
+from typing import Callable, List, Optional, Tuple
+
+from llm.streaming import StreamAborted
+
+WHITESPACE = " \t\r\n"
+LITERAL_START = "-0123456789tfn"
+LITERAL_CHARS = "+-.0123456789eEtruefalsn"
+
+class JSONStreamError(StreamAborted, ValueError):
+    """流式输出已经不可能构成合法的 JSON 对象 (例如开头是说明文字、括号不匹配)"""
+    def __init__(self, message: str, text: str = ""):
+        super().__init__(message)
+        self.text = text
+
+class _Frame:
+    """解析栈中的一层容器 (对象或数组)"""
+    __slots__ = ("kind", "expect", "path", "key", "value_start", "empty")
+
+    def __init__(self, kind: str, path: Optional[Tuple[str, ...]]):
+        self.kind = kind
+        self.expect = "key" if kind == "{" else "value"
+        # 对象成员的路径前缀；数组内部不上报成员，为 None
+        self.path = path
+        self.key = None
+        self.value_start = 0
+        self.empty = True
+
+class IncrementalJSONParser:
+    """
+    增量 JSON 解析器：逐块喂入模型的流式输出，对象成员的值一旦完整就立即回调
+    on_member(path, value)，path 为从根对象开始的键路径，例如 ("symptoms",) 或 ("updated_case", "imaging")。
+    只上报深度不超过 max_depth 的成员。
+
+    只做结构层面的校验 (根必须是对象、键值/逗号/括号的顺序)，成员的值完整后用 json.loads 校验；
+    一旦输出不可能构成合法 JSON 就抛出 JSONStreamError，无需等到整段生成结束。
+    允许开头和结尾的 Markdown 代码块标记 (```json ... ```)。
+    """
+    def __init__(self, on_member: Callable[[Tuple[str, ...], object], None] = None, max_depth: int = 2):
+        self.on_member = on_member
+        self.max_depth = max_depth
+        self.reset()
+
+    def reset(self):
+        self._chars: List[str] = []
+        self._stack: List[_Frame] = []
+        self._state = "start"   # start | fence | body | done
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._in_literal = False
+        self.done = False
+
+    def text(self) -> str:
+        return "".join(self._chars)
+
+    def _fail(self, message: str):
+        raise JSONStreamError(f"{message} at offset {len(self._chars) - 1}", self.text())
+
+    def feed(self, chunk: str):
+        for c in chunk:
+            self._chars.append(c)
+            self._step(c, len(self._chars) - 1)
+
+    def _step(self, c: str, i: int):
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                self._in_string = False
+                self._end_string(i)
+            return
+
+        if self._in_literal:
+            if c in LITERAL_CHARS:
+                return
+            self._in_literal = False
+            self._end_value(i)
+
+        if self._state == "fence":
+            if c == "\n":
+                self._state = "start"
+            return
+        if c in WHITESPACE:
+            return
+        if self._state in ("start", "done"):
+            if c == "`":
+                if self._state == "start":
+                    self._state = "fence"
+                return
+            if self._state == "start" and c == "{":
+                self._stack.append(_Frame("{", ()))
+                self._state = "body"
+                return
+            self._fail(f"unexpected {c!r} outside the JSON object")
+
+        frame = self._stack[-1]
+        if frame.expect == "key":
+            if c == '"':
+                self._begin_string(i)
+            elif c == "}" and frame.empty:
+                self._close(i)
+            else:
+                self._fail(f"expected a key, got {c!r}")
+        elif frame.expect == "colon":
+            if c != ":":
+                self._fail(f"expected ':', got {c!r}")
+            frame.expect = "value"
+        elif frame.expect == "value":
+            frame.value_start = i
+            if c == '"':
+                self._begin_string(i)
+            elif c in "{[":
+                path = frame.path + (frame.key,) if frame.kind == "{" and frame.path is not None else None
+                frame.expect = "nested"
+                self._stack.append(_Frame(c, path if c == "{" else None))
+            elif c in LITERAL_START:
+                self._in_literal = True
+            elif c == "]" and frame.kind == "[" and frame.empty:
+                self._close(i)
+            else:
+                self._fail(f"expected a value, got {c!r}")
+        elif frame.expect == "comma":
+            if c == ",":
+                frame.expect = "key" if frame.kind == "{" else "value"
+            elif c == ("}" if frame.kind == "{" else "]"):
+                self._close(i)
+            else:
+                self._fail(f"expected ',' or closing bracket, got {c!r}")
+
+    def _begin_string(self, i: int):
+        self._in_string = True
+        self._string_start = i
+
+    def _end_string(self, i: int):
+        frame = self._stack[-1]
+        if frame.expect == "key":
+            frame.key = json.loads("".join(self._chars[self._string_start:i + 1]))
+            frame.expect = "colon"
+            return
+        self._end_value(i + 1)
+
+    def _close(self, i: int):
+        self._stack.pop()
+        if not self._stack:
+            self._state = "done"
+            self.done = True
+            return
+        self._end_value(i + 1)
+
+    def _end_value(self, end: int):
+        """当前容器中的一个值刚刚完整 (end 为值结束后的下标)"""
+        frame = self._stack[-1]
+        frame.empty = False
+        frame.expect = "comma"
+        if frame.kind != "{" or frame.path is None:
+            return
+        path = frame.path + (frame.key,)
+        if len(path) > self.max_depth:
+            return
+        raw = "".join(self._chars[frame.value_start:end])
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError as e:
+            self._fail(f"invalid value for {'/'.join(path)}: {e.msg}")
+        if self.on_member:
+            self.on_member(path, value)
+
+class JSONStreamWatcher:
+    """
+    套在流式回调外层：把每个片段喂给 IncrementalJSONParser 后再转发给下游回调。
+    输出格式出错时 JSONStreamError 从回调中抛出，LLMClient 会立即结束本次调用 (不重试、不切换预设)。
+    flush() / reset() 转发给下游回调，reset() 同时重置解析器 (流中断重试时从头解析)。
+    """
+    def __init__(self, callback: Optional[Callable[[str], None]], parser: IncrementalJSONParser):
+        self.callback = callback
+        self.parser = parser
+
+    def __call__(self, chunk: str):
+        if self.callback:
+            self.callback(chunk)
+        self.parser.feed(chunk)
+
+    def flush(self):
+        flush = getattr(self.callback, "flush", None)
+        if flush:
+            flush()
+
+    def reset(self):
+        self.parser.reset()
+        reset = getattr(self.callback, "reset", None)
+        if reset:
+            reset()
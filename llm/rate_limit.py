@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from config.llm_config import LLMConfig, RateLimitConfig
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的 Token 数。
+    中文约 1 字 1 Token，英文约 4 字符 1 Token，这里取 2 字符 1 Token 作为折中 (偏保守)。
+    """
+    return max(1, len(text) // 2)
+
+def estimate_message_tokens(messages: list) -> int:
+    return sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+
+class TokenBucket:
+    """
+    令牌桶：容量为每分钟额度，按秒匀速补充。
+    允许在结算实际用量时出现负余额 (欠账)，后续请求会等待欠账被补齐。
+    调用方负责加锁。
+    """
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """获取 amount 个令牌还需等待的秒数 (0 表示可立即获取)"""
+        self._refill(now)
+        # 单次请求超过桶容量时按满桶放行，避免永远等待
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self.tokens -= amount
+
+@dataclass
+class _LimitScope:
+    """一个限流作用域 (某个 Provider 或某个模型) 的状态"""
+    name: str
+    limits: RateLimitConfig
+    request_bucket: Optional[TokenBucket] = None
+    token_bucket: Optional[TokenBucket] = None
+    in_flight: int = 0
+
+    def __post_init__(self):
+        if self.limits.requests_per_minute > 0:
+            self.request_bucket = TokenBucket(self.limits.requests_per_minute)
+        if self.limits.tokens_per_minute > 0:
+            self.token_bucket = TokenBucket(self.limits.tokens_per_minute)
+
+@dataclass
+class Permit:
+    """一次已获准的调用，调用结束后必须通过 governor.release 归还"""
+    scopes: List[_LimitScope]
+    estimated_tokens: int
+    queue_wait: float = 0.0
+    released: bool = field(default=False, repr=False)
+
+class ConcurrencyGovernor:
+    """
+    按 Provider (base_url, api_key) 与模型 (base_url, api_key, model) 两级限流：
+    - 每分钟请求数 (requests/min) 与 Token 数 (tokens/min) 的令牌桶；
+    - 最大在途请求数 (max in-flight)。
+
+    一次调用必须同时满足所有作用域的额度才会被放行 (原子地扣减)，
+    否则排队等待，等待时长记录在 Permit.queue_wait 中返回给调用方。
+    同步调用通过 Condition 等待，异步调用通过 asyncio.sleep 轮询，不占用线程。
+    """
+    # 在途数已满时异步调用的轮询间隔 (秒)
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, provider_limits: Dict[str, RateLimitConfig] = None, default_provider_limit: RateLimitConfig = None):
+        """
+        :param provider_limits: {base_url: RateLimitConfig}，按 Provider 的限额
+        :param default_provider_limit: 未在 provider_limits 中列出的 Provider 使用的限额
+        """
+        self.provider_limits = provider_limits or {}
+        self.default_provider_limit = default_provider_limit or RateLimitConfig()
+        self._scopes: Dict[Tuple, _LimitScope] = {}
+        self._cond = threading.Condition()
+
+    def _scopes_for(self, config: LLMConfig, model_name: str) -> List[_LimitScope]:
+        """获取 (必要时创建) 本次调用涉及的限流作用域 (调用方需持有锁)"""
+        scopes = []
+        provider_key = ("provider", config.base_url, config.api_key)
+        if provider_key not in self._scopes:
+            limits = self.provider_limits.get(config.base_url, self.default_provider_limit)
+            self._scopes[provider_key] = _LimitScope(name=config.base_url, limits=limits)
+        scopes.append(self._scopes[provider_key])
+
+        if config.rate_limit:
+            model_key = ("model", config.base_url, config.api_key, model_name)
+            if model_key not in self._scopes:
+                self._scopes[model_key] = _LimitScope(name=model_name, limits=config.rate_limit)
+            scopes.append(self._scopes[model_key])
+        return scopes
+
+    def _try_acquire(self, scopes: List[_LimitScope], estimated_tokens: int) -> Optional[float]:
+        """
+        尝试原子地获取所有作用域的额度 (调用方需持有锁)。
+        :return: 0 表示已获取；正数表示需等待的秒数；None 表示在途数已满，需等待释放。
+        """
+        for scope in scopes:
+            if scope.limits.max_in_flight > 0 and scope.in_flight >= scope.limits.max_in_flight:
+                return None
+
+        now = time.monotonic()
+        wait = 0.0
+        for scope in scopes:
+            if scope.request_bucket:
+                wait = max(wait, scope.request_bucket.wait_time(1, now))
+            if scope.token_bucket:
+                wait = max(wait, scope.token_bucket.wait_time(estimated_tokens, now))
+        if wait > 0:
+            return wait
+
+        for scope in scopes:
+            if scope.request_bucket:
+                scope.request_bucket.consume(1)
+            if scope.token_bucket:
+                scope.token_bucket.consume(estimated_tokens)
+            scope.in_flight += 1
+        return 0.0
+
+    def acquire(self, config: LLMConfig, model_name: str, estimated_tokens: int, cancel_token=None) -> Permit:
+        """
+        阻塞直到获准调用 (同步版本)
+        :param cancel_token: (可选) llm.cancellation.CancellationToken，排队期间被取消时抛出 CallCancelled，不再发出请求
+        """
+        start = time.monotonic()
+        with self._cond:
+            scopes = self._scopes_for(config, model_name)
+            while True:
+                if cancel_token:
+                    cancel_token.raise_if_cancelled()
+                wait = self._try_acquire(scopes, estimated_tokens)
+                if wait == 0:
+                    return Permit(scopes=scopes, estimated_tokens=estimated_tokens, queue_wait=time.monotonic() - start)
+                # 在途数已满时等待 release 通知；令牌不足时等待补充 (同样可被 release 提前唤醒)
+                timeout = wait if wait is not None else 1.0
+                if cancel_token:
+                    # 取消不会唤醒 Condition，缩短等待间隔以便及时发现
+                    timeout = min(timeout, self.POLL_INTERVAL)
+                self._cond.wait(timeout=timeout)
+
+    async def acquire_async(self, config: LLMConfig, model_name: str, estimated_tokens: int, cancel_token=None) -> Permit:
+        """等待直到获准调用 (异步版本)，等待期间不阻塞事件循环"""
+        start = time.monotonic()
+        while True:
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            with self._cond:
+                scopes = self._scopes_for(config, model_name)
+                wait = self._try_acquire(scopes, estimated_tokens)
+            if wait == 0:
+                return Permit(scopes=scopes, estimated_tokens=estimated_tokens, queue_wait=time.monotonic() - start)
+            await asyncio.sleep(min(wait, 1.0) if wait is not None else self.POLL_INTERVAL)
+
+    def release(self, permit: Permit, actual_tokens: Optional[int] = None):
+        """
+        归还在途名额，并按实际用量结算 Token 额度 (多退少补)。
+        :param actual_tokens: 实际消耗的 Token 数 (估算值)，为 None 时不结算
+        """
+        if permit.released:
+            return
+        with self._cond:
+            permit.released = True
+            for scope in permit.scopes:
+                scope.in_flight -= 1
+                if actual_tokens is not None and scope.token_bucket:
+                    scope.token_bucket.consume(actual_tokens - permit.estimated_tokens)
+            self._cond.notify_all()
@@ -0,0 +1,64 @@
+import random
+from typing import Optional
+
+import httpx
+import openai
+
+# 视为瞬时故障、值得重试的 HTTP 状态码
+TRANSIENT_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    判断一次调用失败是否为瞬时故障 (超时、429、5xx、连接/流中断)。
+    非瞬时故障 (如 400 参数错误、401 鉴权失败) 重试也无济于事，直接切换到下一个预设。
+    """
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in TRANSIENT_STATUS_CODES
+    # 流式读取过程中连接被断开时，底层 httpx 异常可能直接抛出
+    if isinstance(error, (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)):
+        return True
+    # 部分中转服务在流中途返回的错误没有状态码
+    if isinstance(error, openai.APIError) and not isinstance(error, openai.APIStatusError):
+        return True
+    return False
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """读取 429/503 响应中的 Retry-After 头 (秒)，没有则返回 None"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+class RetryPolicy:
+    """
+    带抖动的指数退避 (Full Jitter)：
+    第 n 次重试前等待 uniform(0, min(max_delay, base_delay * 2^n)) 秒；
+    若服务端给出 Retry-After，则至少等待该时长 (不超过 max_delay)。
+    """
+    def __init__(self, max_attempts: int = 3, base_delay: float = 1.0, max_delay: float = 20.0):
+        """
+        :param max_attempts: 每个预设的最大尝试次数 (含首次调用)
+        :param base_delay: 退避基数 (秒)
+        :param max_delay: 单次等待上限 (秒)
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, error: Exception = None) -> float:
+        """
+        :param attempt: 已失败的次数 (从 0 开始)
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        hinted = retry_after_seconds(error) if error is not None else None
+        if hinted is not None:
+            backoff = max(backoff, min(hinted, self.max_delay))
+        return backoff
@@ -0,0 +1,131 @@
+import time
+from typing import Callable, List
+
+class StreamAborted(Exception):
+    """
+    由流式回调主动抛出，表示已输出的内容不可用 (如格式错误)，应立即结束本次调用。
+    LLMClient 与 InterruptedError 一样原样抛出，不重试、不切换预设。
+    """
+
+class StreamAccumulator:
+    """
+    流式输出的累加器：把增量片段追加到列表，结束时一次性 join，
+    避免 `full_content += chunk` 在长输出上反复拷贝字符串。
+    """
+    def __init__(self):
+        self._parts: List[str] = []
+
+    def append(self, chunk: str):
+        self._parts.append(chunk)
+
+    def text(self) -> str:
+        return "".join(self._parts)
+
+class ChunkCoalescer:
+    """
+    流式片段合并器：把模型逐 Token 输出的小片段攒成较大的块再交给下游回调，
+    距上次输出超过 interval_ms 毫秒或缓冲达到 max_chars 个字符时输出一次。
+
+    不使用定时器线程，时间条件在新片段到达时检查；流结束时调用方必须调用 flush()
+    输出剩余内容 (LLMClient 在调用成功后会自动调用 stream_callback.flush)。
+    interval_ms 与 max_chars 均为 0 时不做合并，逐片段输出。
+    """
+    def __init__(self, callback: Callable[[str], None], interval_ms: int = 0, max_chars: int = 0):
+        self.callback = callback
+        self.interval = interval_ms / 1000.0
+        self.max_chars = max_chars
+        self._buffer: List[str] = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def __call__(self, chunk: str):
+        if not chunk:
+            return
+        self._buffer.append(chunk)
+        self._size += len(chunk)
+        if self._size >= self.max_chars or time.monotonic() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """立即输出缓冲中的全部内容"""
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer = []
+        self._size = 0
+        self.callback(text)
+
+    def reset(self):
+        """丢弃尚未输出的内容 (流中断重试时使用)"""
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+class DelimitedStreamSplitter:
+    """
+    按分隔标记把一路流式输出拆成两路：标记之前的内容交给 first_callback，之后的交给 second_callback。
+
+    分隔标记可能被拆在多个 chunk 中，因此尾部可能构成标记前缀的几个字符会暂存，
+    确认不是标记后再输出。标记之后紧跟的空白会被跳过。
+    flush() / reset() 会转发给两路下游回调 (若其提供)，与 LLMClient 的约定保持一致。
+    """
+    def __init__(self, delimiter: str, first_callback: Callable[[str], None] = None, second_callback: Callable[[str], None] = None):
+        self.delimiter = delimiter
+        self.first_callback = first_callback
+        self.second_callback = second_callback
+        self.found = False
+        self._pending = ""
+        self._second_started = False
+
+    def _emit_first(self, text: str):
+        if text and self.first_callback:
+            self.first_callback(text)
+
+    def _emit_second(self, text: str):
+        if not self._second_started:
+            text = text.lstrip()
+            self._second_started = bool(text)
+        if text and self.second_callback:
+            self.second_callback(text)
+
+    def _partial_match_length(self, text: str) -> int:
+        """text 末尾与分隔标记开头重合的最大长度"""
+        for length in range(min(len(text), len(self.delimiter) - 1), 0, -1):
+            if self.delimiter.startswith(text[-length:]):
+                return length
+        return 0
+
+    def __call__(self, chunk: str):
+        if self.found:
+            self._emit_second(chunk)
+            return
+        text = self._pending + chunk
+        index = text.find(self.delimiter)
+        if index >= 0:
+            self.found = True
+            self._pending = ""
+            self._emit_first(text[:index])
+            self._emit_second(text[index + len(self.delimiter):])
+            return
+        keep = self._partial_match_length(text)
+        self._pending = text[len(text) - keep:] if keep else ""
+        self._emit_first(text[:len(text) - keep])
+
+    def flush(self):
+        if self._pending:
+            self._emit_first(self._pending)
+            self._pending = ""
+        for callback in (self.first_callback, self.second_callback):
+            flush = getattr(callback, "flush", None)
+            if flush:
+                flush()
+
+    def reset(self):
+        self.found = False
+        self._pending = ""
+        self._second_started = False
+        for callback in (self.first_callback, self.second_callback):
+            reset = getattr(callback, "reset", None)
+            if reset:
+                reset()
@@ -0,0 +1,59 @@
+import threading
+from typing import Optional
+
+from llm.rate_limit import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken 随 langchain-openai 安装，缺失时退回字符估算
+    tiktoken = None
+
+# 各预设模型的分词器并不相同，这里统一用 cl100k_base 近似计数，只用于预算控制
+ENCODING_NAME = "cl100k_base"
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+def _get_encoding():
+    """
+    懒加载 tiktoken 编码表。首次使用时可能需要联网下载，
+    失败 (离线、未安装) 后不再重试，之后一律使用字符估算。
+    """
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if not _encoding_loaded:
+            if tiktoken is not None:
+                try:
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    print(f"[Tokenizer] tiktoken unavailable ({e}), falling back to character estimate")
+            _encoding_loaded = True
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    """计算文本的 Token 数 (tiktoken 不可用时按字符估算)"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = "……(已截断)") -> Optional[str]:
+    """
+    把文本截断到 max_tokens 以内 (保留开头，末尾追加 marker)。
+    预算连 marker 都放不下时返回 None。
+    """
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - count_tokens(marker)
+    if budget <= 0:
+        return None
+    encoding = _get_encoding()
+    if encoding is None:
+        # estimate_tokens 约 2 字符 1 Token
+        return text[:budget * 2] + marker
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:budget]) + marker
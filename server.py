@@ -1,6 +1,6 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, List
+from typing import Dict, List, Optional
 import uuid
 import json
 import asyncio
@@ -8,8 +8,11 @@ import traceback
 
 from core.shared_state import SharedState
 from core.schemas import CaseInput, AgentStatusUpdate, StreamEvent
-from core.pipeline_api import run_mdt_generator
+from core.pipeline_api import run_mdt_stream
 from core.session_logger import session_logger
+from core.session_store import create_session_store
+from core.archive import get_archive
+from llm.cancellation import CancellationToken
 
 app = FastAPI(title="ILD Agents MDT API")
 
@@ -23,82 +26,114 @@ app.add_middleware(
 )
 
 # Session Management
-# In-memory storage for now. For production, use Redis.
-active_sessions: Dict[str, SharedState] = {}
+# Bounded in-memory LRU + TTL cache, written through to a persistent backend (see config.settings.session_backend).
+# Evicted sessions are reloaded on their next request, and survive a server restart.
+session_store = create_session_store()
 
 @app.post("/api/sessions", response_model=Dict[str, str])
 async def create_session():
     session_id = str(uuid.uuid4())
-    active_sessions[session_id] = SharedState()
+    await asyncio.to_thread(session_store.put, session_id, SharedState())
     return {"session_id": session_id}
 
 @app.get("/api/sessions/{session_id}", response_model=Dict)
 async def get_session_state(session_id: str):
-    if session_id not in active_sessions:
+    state = await asyncio.to_thread(session_store.get, session_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    return active_sessions[session_id].model_dump()
+    return state.model_dump()
 
 @app.post("/api/sessions/{session_id}/case")
 async def submit_case(session_id: str, input_data: CaseInput):
-    if session_id not in active_sessions:
+    state = await asyncio.to_thread(session_store.get, session_id)
+    if state is None:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    state = active_sessions[session_id]
-    state.raw_case_text = input_data.case_text
-    state.round_count += 1
-    state.raw_case_history.append(f"【第 {state.round_count} 轮输入】\n{input_data.case_text}")
-    state.chat_history.append({"role": "user", "content": input_data.case_text})
+    state.add_user_input(input_data.case_text)
+    await asyncio.to_thread(session_store.put, session_id, state)
     
     return {"status": "updated", "round": state.round_count}
 
+@app.get("/api/archive/rounds", response_model=List[Dict])
+async def query_archive(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    agent: Optional[List[str]] = Query(None),
+    model: Optional[List[str]] = Query(None),
+    severity: Optional[List[str]] = Query(None),
+    session_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
+    """Filter archived consultation rounds by date (ISO), selected agent, model or conflict severity"""
+    archive = get_archive()
+    if archive is None:
+        raise HTTPException(status_code=404, detail="Consultation archive is disabled")
+    return await asyncio.to_thread(
+        archive.query_rounds, since=since, until=until, agent=agent, model=model,
+        severity=severity, session_id=session_id, limit=limit, offset=offset
+    )
+
+@app.get("/api/archive/rounds/{session_id}/{round_index}", response_model=Dict)
+async def get_archived_round(session_id: str, round_index: int):
+    archive = get_archive()
+    if archive is None:
+        raise HTTPException(status_code=404, detail="Consultation archive is disabled")
+    result = await asyncio.to_thread(archive.get_round, session_id, round_index)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Round not found")
+    return result
+
+async def _watch_disconnect(websocket: WebSocket, stop_event: CancellationToken):
+    """Cancel the running round as soon as the client disconnects (the stop button closes the socket)"""
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    except Exception:
+        pass
+    stop_event.set()
+
 @app.websocket("/ws/consultation/{session_id}")
 async def websocket_endpoint(websocket: WebSocket, session_id: str):
     await websocket.accept()
     
-    if session_id not in active_sessions:
+    # Pinned in memory for the whole round, and written back to the store when the round ends
+    state = await asyncio.to_thread(session_store.acquire, session_id)
+    if state is None:
         await websocket.close(code=4004, reason="Session not found")
         return
-        
-    state = active_sessions[session_id]
     
     # Wait for start signal or configuration
-    import threading
-    stop_event = threading.Event()
+    # Setting the token (disconnect / stop) also closes every in-flight LLM call of this session
+    stop_event = CancellationToken()
+    disconnect_watcher = None
     
     try:
         data = await websocket.receive_text()
         config = json.loads(data)
         enabled_agents = config.get("selected_agents", ["Case Organizer", "Radiologist", "Pathologist", "Pulmonologist", "Rheumatologist", "Moderator"])
         model_configs = config.get("model_configs", {})
+        # resume=true: continue the current round from its last checkpoint instead of restarting it
+        resume = bool(config.get("resume", False))
         
-        # Run the generator
-        generator = run_mdt_generator(state, enabled_agents, model_configs=model_configs, stop_event=stop_event)
-        
-        # Helper to safely get next item without raising StopIteration into asyncio
-        def safe_next(gen):
-            try:
-                return next(gen)
-            except StopIteration:
-                return None
+        # Notice a disconnect even while no events are being sent (e.g. during a non-streaming router call)
+        disconnect_watcher = asyncio.create_task(_watch_disconnect(websocket, stop_event))
 
-        while True:
-            try:
-                # Use asyncio.to_thread to call next(generator) to avoid blocking the loop
-                event = await asyncio.to_thread(safe_next, generator)
-                
-                if event is None:
-                    break
-                
+        # Run the pipeline: events are pushed onto the event loop by the bridge
+        try:
+            async for event in run_mdt_stream(state, enabled_agents, model_configs=model_configs, stop_event=stop_event, session_id=session_id, resume=resume):
                 await websocket.send_json(event)
-                
-            except Exception as e:
-                print(f"Error during streaming: {e}")
-                traceback.print_exc()
-                break
+        except Exception as e:
+            # Client went away mid-round: cancel right away instead of after the log is saved
+            stop_event.set()
+            print(f"Error during streaming: {e}")
+            traceback.print_exc()
         
         # Save session log after round completion
         try:
-            session_logger.save_round(session_id, state)
+            session_logger.save_round(session_id, state, model_configs)
         except Exception as e:
             print(f"Failed to save session log: {e}")
             traceback.print_exc()
@@ -115,6 +150,9 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
         traceback.print_exc()
     finally:
         stop_event.set()
+        if disconnect_watcher:
+            disconnect_watcher.cancel()
+        await asyncio.to_thread(session_store.release, session_id)
 
 if __name__ == "__main__":
     import uvicorn
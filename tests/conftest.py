@@ -0,0 +1,29 @@
+import os
+import sys
+import tempfile
+
+# config.settings 要求 OPENAI_API_KEY；测试不会访问真实的模型服务 (见 benchmarks.provider.SimulatedProvider)
+os.environ.setdefault("OPENAI_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 会诊日志 (logs/sessions)、checkpoint 与缓存 (.cache) 都相对当前目录创建：测试在临时目录中运行，不写入仓库
+os.chdir(tempfile.mkdtemp(prefix="mdt-tests-"))
+
+import pytest
+
+from benchmarks.provider import ModelProfile, SimulatedProvider, simulated_backend
+
+@pytest.fixture
+def failing_provider(monkeypatch):
+    """每次请求都失败且不重试的模拟 Provider：LLMClient 抛出 LLMCallFailed"""
+    import llm.client as client_module
+    monkeypatch.setattr(client_module.retry_policy, "max_attempts", 1)
+    provider = SimulatedProvider(default_profile=ModelProfile(ttft=0.0, tokens_per_sec=1e6, error_rate=1.0, jitter=0.0))
+    with simulated_backend(provider):
+        yield provider
+
+@pytest.fixture
+def fast_provider():
+    """立即返回的模拟 Provider"""
+    provider = SimulatedProvider(default_profile=ModelProfile(ttft=0.0, tokens_per_sec=1e6, output_tokens=20, jitter=0.0))
+    with simulated_backend(provider):
+        yield provider
@@ -0,0 +1,120 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from core.archive import ConsultationArchive
+
+def _round(round_index: int, timestamp: str, selected, severities=(), summary="总结"):
+    return {
+        "round_index": round_index,
+        "timestamp": timestamp,
+        "user_input": f"第 {round_index} 轮输入",
+        "process": {
+            "structured_info": {"imaging": "HRCT 网格影"},
+            "selected_agents": list(selected),
+            "specialist_opinions": {agent: f"{agent} 意见" for agent in selected},
+            "specialist_summaries": {agent: f"{agent} 总结" for agent in selected},
+            "conflicts": [{"issue": f"冲突 {s}", "severity": s, "involved_agents": list(selected)} for s in severities],
+            "discussion_notes": ""
+        },
+        "output": {"summary": summary, "questions_to_user": []},
+        "new_evidence": {}
+    }
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = ConsultationArchive(str(tmp_path / "archive.sqlite"))
+    archive.record_rounds([
+        {"session_id": "s1", "round": _round(1, "2026-03-01T09:00:00", ["Radiologist", "Pulmonologist"], ["high"]),
+         "models": {"Radiologist": "gpt-5.1", "Pulmonologist": "grok-4", "Moderator": "gpt-5.1"}},
+        {"session_id": "s1", "round": _round(2, "2026-03-01T23:59:59.900000", ["Pulmonologist"]),
+         "models": {"Pulmonologist": "grok-4", "Moderator": "gpt-5.1"}},
+        {"session_id": "s2", "round": _round(1, "2026-03-02T00:00:00", ["Rheumatologist", "Pulmonologist"], ["low", "medium"]),
+         "models": {"Rheumatologist": "deepseek-chat", "Pulmonologist": "grok-4"}},
+    ])
+    return archive
+
+def _keys(results):
+    return [(r["session_id"], r["round_index"]) for r in results]
+
+def test_query_returns_newest_first_with_facets(archive):
+    results = archive.query_rounds()
+    assert _keys(results) == [("s2", 1), ("s1", 2), ("s1", 1)]
+    first = results[-1]
+    assert sorted(first["selected_agents"]) == ["Pulmonologist", "Radiologist"]
+    assert first["models"] == {"Radiologist": "gpt-5.1", "Pulmonologist": "grok-4", "Moderator": "gpt-5.1"}
+    assert first["conflict_severities"] == ["high"]
+    assert results[0]["conflict_severities"] == ["low", "medium"]
+
+def test_date_only_until_includes_whole_day(archive):
+    assert _keys(archive.query_rounds(until="2026-03-01")) == [("s1", 2), ("s1", 1)]
+    assert _keys(archive.query_rounds(since="2026-03-02")) == [("s2", 1)]
+    assert _keys(archive.query_rounds(since="2026-03-01T12:00:00", until="2026-03-02T00:00:00")) == [("s1", 2)]
+
+def test_filters_match_any_value(archive):
+    assert _keys(archive.query_rounds(agent="Radiologist")) == [("s1", 1)]
+    assert _keys(archive.query_rounds(agent=["Radiologist", "Rheumatologist"])) == [("s2", 1), ("s1", 1)]
+    assert _keys(archive.query_rounds(model="deepseek-chat")) == [("s2", 1)]
+    assert _keys(archive.query_rounds(severity=["high", "medium"])) == [("s2", 1), ("s1", 1)]
+    assert _keys(archive.query_rounds(session_id="s1", agent="Pulmonologist")) == [("s1", 2), ("s1", 1)]
+    assert archive.query_rounds(agent="Pathologist") == []
+
+def test_limit_and_offset(archive):
+    assert _keys(archive.query_rounds(limit=1, offset=1)) == [("s1", 2)]
+
+def test_rerecording_a_round_replaces_it(archive):
+    archive.record_rounds([{"session_id": "s1", "round": _round(1, "2026-03-01T09:00:00", ["Pathologist"], summary="新总结")}])
+    result = archive.get_round("s1", 1)
+    assert result["summary"] == "新总结"
+    assert result["selected_agents"] == ["Pathologist"]
+    assert result["conflicts"] == []
+    assert _keys(archive.query_rounds(severity="high")) == []
+
+def test_import_logs(tmp_path):
+    log_dir = tmp_path / "sessions"
+    log_dir.mkdir()
+    with open(log_dir / "s3.jsonl", "w", encoding="utf-8") as f:
+        f.write(json.dumps({"round": _round(1, "2026-03-03T10:00:00", ["Radiologist"]), "models": {"Radiologist": "gpt-5.1"}}, ensure_ascii=False) + "\n")
+        f.write("{truncated\n")
+    archive = ConsultationArchive(str(tmp_path / "archive.sqlite"))
+    assert archive.import_logs(str(log_dir)) == 1
+    assert archive.query_rounds(model="gpt-5.1")[0]["session_id"] == "s3"
+
+def test_import_logs_does_not_load_session_logger(tmp_path):
+    # 导入 session_logger 会启动其后台写入线程，档案库 (及其命令行) 不应依赖它
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = (
+        "import sys; from core.archive import ConsultationArchive; "
+        f"ConsultationArchive({str(tmp_path / 'archive.sqlite')!r}).import_logs({str(tmp_path)!r}); "
+        "print('core.session_logger' in sys.modules)"
+    )
+    output = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True,
+                            env={**os.environ, "OPENAI_API_KEY": "test"}).stdout
+    assert output.strip() == "False"
+
+def test_consultation_round_is_archived_with_selected_agents(fast_provider, tmp_path):
+    from core.batch import DEFAULT_AGENTS
+    from core.pipeline_api import run_mdt_round
+    from core.session_logger import SessionLogger
+    from core.shared_state import SharedState
+
+    archive = ConsultationArchive(str(tmp_path / "archive.sqlite"))
+    logger = SessionLogger(log_dir=str(tmp_path / "sessions"), flush_interval=0, archive=archive)
+    state = SharedState()
+    for text in ("男 62 岁，活动后气短 1 年，HRCT 双下肺网格影", "补充：ANA 1:320"):
+        state.add_user_input(text)
+        assert run_mdt_round(state, DEFAULT_AGENTS) == []
+        logger.save_round("s1", state)
+    logger.flush()
+
+    assert "Pulmonologist" in state.selected_agents
+    assert any(state.new_evidence.values())
+    for agent in state.selected_agents:
+        assert ("s1", 2) in _keys(archive.query_rounds(agent=agent))
+    second = archive.get_round("s1", 2)
+    assert second["selected_agents"] == state.selected_agents
+    assert second["new_evidence"] == state.new_evidence
+    assert {o["agent"] for o in second["agent_outputs"] if o["selected"]} >= set(state.selected_agents)
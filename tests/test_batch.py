@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import core.batch as batch_module
+from core.archive import ConsultationArchive
+from core.batch import BatchRunner, load_completed, read_cases
+from core.session_logger import SessionLogger
+
+def _write_lines(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write((line if isinstance(line, str) else json.dumps(line, ensure_ascii=False)) + "\n")
+
+def test_load_completed_missing_file(tmp_path):
+    assert load_completed(str(tmp_path / "missing.jsonl")) == set()
+
+def test_load_completed_uses_latest_record_per_case(tmp_path):
+    output = tmp_path / "results.jsonl"
+    _write_lines(output, [
+        {"case_id": "a", "status": "ok"},
+        {"case_id": "b", "status": "error"},
+        {"case_id": "c", "status": "ok"},
+        {"case_id": "b", "status": "ok"},
+        {"case_id": "c", "status": "error"},
+        "",
+        '{"case_id": "d", "status": "o',
+    ])
+    # b 重跑成功、c 重跑失败；被截断的最后一行忽略
+    assert load_completed(str(output)) == {"a", "b"}
+
+def test_read_cases_skips_invalid_lines(tmp_path):
+    cases = tmp_path / "cases.jsonl"
+    _write_lines(cases, [{"case_id": 7, "case_text": "x"}, "not json", {"case_id": "no-text"}, {"case_text": "y"}])
+    assert [c["case_id"] for c in read_cases(str(cases))] == ["7", "line-4"]
+
+def test_resume_skips_completed_cases(fast_provider, tmp_path):
+    cases, output = tmp_path / "cases.jsonl", tmp_path / "results.jsonl"
+    _write_lines(cases, [{"case_id": case_id, "case_text": "男 62 岁，活动后气短"} for case_id in ("a", "b", "c")])
+    # 上次运行：a 成功，b 失败，c 未完成 (且最后一行没有换行)
+    with open(output, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"case_id": "a", "status": "ok"}) + "\n" + json.dumps({"case_id": "b", "status": "error"}))
+
+    counts = BatchRunner(str(cases), str(output), concurrency=2).run()
+
+    assert counts == {"ok": 2, "error": 0, "skipped": 1, "interrupted": 0}
+    with open(output, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert sorted(r["case_id"] for r in records[2:]) == ["b", "c"]
+    assert all(len(r["rounds"]) == 1 for r in records[2:])
+    assert load_completed(str(output)) == {"a", "b", "c"}
+
+def test_rerun_replaces_previous_session_log(fast_provider, tmp_path, monkeypatch):
+    archive = ConsultationArchive(str(tmp_path / "archive.sqlite"))
+    logger = SessionLogger(log_dir=str(tmp_path / "sessions"), flush_interval=0, archive=archive)
+    monkeypatch.setattr(batch_module, "session_logger", logger)
+    runner = BatchRunner(str(tmp_path / "cases.jsonl"), str(tmp_path / "results.jsonl"), log_sessions=True)
+
+    # 第一次运行两轮，重跑时只有一轮：会话中不能残留上次运行的第 2 轮
+    assert runner.run_case({"case_id": "a", "case_text": "男 62 岁，活动后气短", "follow_ups": ["补充：ANA 1:320"]})["status"] == "ok"
+    logger.flush()
+    assert [r["round_index"] for r in logger.compact("batch-a")["rounds"]] == [1, 2]
+
+    assert runner.run_case({"case_id": "a", "case_text": "男 62 岁，活动后气短"})["status"] == "ok"
+    logger.flush()
+    assert [r["round_index"] for r in logger.compact("batch-a")["rounds"]] == [1]
+    assert [r["round_index"] for r in archive.query_rounds(session_id="batch-a")] == [1]
+
+def test_llm_failure_marks_case_as_error(failing_provider, tmp_path):
+    runner = BatchRunner(str(tmp_path / "cases.jsonl"), str(tmp_path / "results.jsonl"))
+    record = runner.run_case({"case_id": "a", "case_text": "男 62 岁，活动后气短", "follow_ups": ["补充：ANA 1:320"]})
+    assert record["status"] == "error"
+    assert record["errors"] and all("Simulated provider error" in e for e in record["errors"])
+    # 失败的轮次之后不再继续，续跑时整个病例重做
+    assert len(record["rounds"]) == 1
+    _write_lines(tmp_path / "results.jsonl", [record])
+    assert load_completed(str(tmp_path / "results.jsonl")) == set()
@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from agents.case_organizer.agent import CaseOrganizerAgent
+from agents.case_organizer.patch import CasePatchError, EVIDENCE_KEYS, validate_patch, validate_answers, apply_patch, derive_new_evidence
+from core.shared_state import SharedState
+
+CASE = {
+    "basic_info": "男 62 岁",
+    "symptoms": "活动后气短 1 年",
+    "signs": "双下肺 Velcro 啰音",
+    "lab_results": "未提及",
+    "imaging": "HRCT 双下肺网格影",
+    "pathology": "未提及",
+    "diagnosis_history": "无",
+    "key_questions": "是否为 IPF？是否做过自身抗体检查？"
+}
+
+def test_validate_patch_normalises_ops():
+    ops = validate_patch([{"op": "replace", "path": "/lab_results", "value": "ANA 1:320"}])
+    assert ops == [{"op": "replace", "field": "lab_results", "value": "ANA 1:320"}]
+
+@pytest.mark.parametrize("patch", [
+    {"op": "replace", "path": "/lab_results", "value": "x"},
+    [{"op": "remove", "path": "/lab_results"}],
+    [{"op": "replace", "path": "/updated_case/lab_results", "value": "x"}],
+    [{"op": "replace", "path": "/unknown", "value": "x"}],
+    [{"op": "replace", "path": "/lab_results", "value": ["x"]}],
+    ["replace"],
+])
+def test_validate_patch_rejects_invalid_ops(patch):
+    with pytest.raises(CasePatchError):
+        validate_patch(patch)
+
+def test_validate_answers():
+    assert validate_answers(None) == []
+    assert validate_answers([" 已查 ANA ", "无", ""]) == ["已查 ANA"]
+    with pytest.raises(CasePatchError):
+        validate_answers("已查 ANA")
+
+def test_apply_patch_does_not_modify_input():
+    original = dict(CASE)
+    updated = apply_patch(original, [{"op": "replace", "field": "lab_results", "value": "ANA 1:320"}])
+    assert updated["lab_results"] == "ANA 1:320"
+    assert original == CASE
+
+def test_derive_new_evidence_takes_appended_text():
+    new_info = dict(CASE, symptoms="活动后气短 1 年，近 1 月干咳", imaging="HRCT 下肺蜂窝影", lab_results="ANA 1:320")
+    evidence = derive_new_evidence(CASE, new_info)
+    assert set(evidence) == set(EVIDENCE_KEYS)
+    assert evidence["new_symptoms_info"] == ["近 1 月干咳"]
+    assert evidence["new_imaging_info"] == ["HRCT 下肺蜂窝影"]
+    # 原值为 "未提及" 时取整个新值
+    assert evidence["new_lab_results"] == ["ANA 1:320"]
+    assert evidence["new_pathology_info"] == []
+    assert evidence["answers_to_team_questions"] == []
+
+def test_key_questions_change_maps_to_answers():
+    new_info = dict(CASE, key_questions="是否为 IPF？(自身抗体已查，ANA 1:320)")
+    evidence = derive_new_evidence(CASE, new_info)
+    assert evidence["answers_to_team_questions"] == ["是否为 IPF？(自身抗体已查，ANA 1:320)"]
+
+    # 模型单独给出回答时以回答为准
+    evidence = derive_new_evidence(CASE, new_info, ["自身抗体已查，ANA 1:320"])
+    assert evidence["answers_to_team_questions"] == ["自身抗体已查，ANA 1:320"]
+
+def _categories(evidence: dict) -> set:
+    return {key for key, items in evidence.items() if items}
+
+def test_patch_mode_and_full_mode_give_same_evidence_categories():
+    """同一条补充信息 (回答了团队关于自身抗体的提问并补充了化验)，两种模式得到相同的证据类别"""
+    updated_case = dict(CASE, lab_results="ANA 1:320，抗 Ro-52 阳性", key_questions="是否为 IPF 或 CTD-ILD？")
+    answer = "已做自身抗体检查：ANA 1:320，抗 Ro-52 阳性"
+    full_response = json.dumps({
+        "updated_case": updated_case,
+        "new_evidence": {
+            "new_lab_results": ["ANA 1:320，抗 Ro-52 阳性"],
+            "new_symptoms_info": [],
+            "new_imaging_info": [],
+            "new_pathology_info": [],
+            "answers_to_team_questions": [answer]
+        }
+    }, ensure_ascii=False)
+    patch_response = json.dumps({
+        "patch": [
+            {"op": "replace", "path": "/lab_results", "value": updated_case["lab_results"]},
+            {"op": "replace", "path": "/key_questions", "value": updated_case["key_questions"]}
+        ],
+        "answers_to_team_questions": [answer]
+    }, ensure_ascii=False)
+
+    agent = CaseOrganizerAgent()
+    full_state = SharedState(structured_info=dict(CASE))
+    agent._apply_response(full_state, full_response, dict(CASE))
+    patch_state = SharedState(structured_info=dict(CASE))
+    agent._apply_patch_response(patch_state, patch_response, dict(CASE))
+
+    assert patch_state.structured_info == full_state.structured_info
+    assert _categories(patch_state.new_evidence) == _categories(full_state.new_evidence) == {"new_lab_results", "answers_to_team_questions"}
+    assert patch_state.new_evidence["answers_to_team_questions"] == [answer]
@@ -0,0 +1,42 @@
+import pytest
+
+from benchmarks.provider import ModelProfile, SimulatedProvider, simulated_backend
+from config.settings import settings
+from core.batch import DEFAULT_AGENTS
+from core.pipeline_api import run_mdt_round
+from core.shared_state import SharedState, merge_dicts
+
+@pytest.fixture
+def slow_radiologist_provider():
+    """Radiologist 改用的 slow-model 首 Token 要 30 秒，其余模型立即返回"""
+    provider = SimulatedProvider(profiles={"slow-model": ModelProfile(ttft=30.0, jitter=0.0)},
+                                 default_profile=ModelProfile(ttft=0.0, tokens_per_sec=1e6, output_tokens=20, jitter=0.0))
+    with simulated_backend(provider):
+        yield provider
+
+def test_merge_dicts_none_removes_key():
+    assert merge_dicts({"a": "1", "b": "2"}, {"b": None, "c": "3"}) == {"a": "1", "c": "3"}
+
+def test_timed_out_specialist_withdraws_previous_opinion(slow_radiologist_provider, monkeypatch):
+    monkeypatch.setattr(settings, "specialist_quorum", 0)
+    monkeypatch.setattr(settings, "specialist_quorum_window", None)
+    state = SharedState()
+    state.add_user_input("男 62 岁，活动后气短 1 年，HRCT 双下肺网格影，TBLC 病理提示 UIP")
+    assert run_mdt_round(state, DEFAULT_AGENTS) == []
+    assert "Radiologist" in state.specialist_opinions
+
+    # 第 2 轮：Radiologist 因新的影像信息被唤醒，但换用的模型卡住，超过 hard 截止时间被放弃
+    monkeypatch.setattr(settings, "node_deadlines", {"Radiologist": {"hard": 0.3}})
+    events = []
+    state.add_user_input("补充：复查 HRCT 蜂窝影增多")
+    assert run_mdt_round(state, DEFAULT_AGENTS, {"Radiologist": "slow-model"}, on_event=events.append) == []
+
+    assert state.selected_agents == ["Pulmonologist", "Radiologist"]
+    assert state.agent_status["Radiologist"] == "timed_out"
+    # 上一轮的意见与总结不能流入本轮的冲突检测与总结
+    for field in (state.specialist_opinions, state.specialist_summaries, state.specialist_fingerprints):
+        assert "Radiologist" not in field
+    assert "Pathologist" in state.specialist_opinions
+    # 汇聚后只剩 1 位专家提交意见：不进行团队讨论
+    assert "Team Discussion" not in [e.get("role") for e in events if e["type"] == "node_finished"]
+    assert any("本轮仅 1 位专家提交意见" in str(e.get("content")) for e in events)
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+
+import llm.client as client_module
+from benchmarks.provider import ModelProfile, SimulatedProvider, simulated_backend
+from config.llm_config import LLMConfig
+from llm.cancellation import CallCancelled, CancellationToken, cancellation_scope
+from llm.client import LLMCallFailed
+from llm.hedging import AsyncHedgeRace
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+def _hedged_config() -> LLMConfig:
+    backup = LLMConfig(api_key="k", base_url="https://sim.invalid", model_name="fast")
+    return LLMConfig(api_key="k", base_url="https://sim.invalid", model_name="stalled", hedge_delay=0.05, hedge_config=backup)
+
+def _provider() -> SimulatedProvider:
+    # 主请求的首 Token 要 30 秒才到，备用请求立即输出
+    return SimulatedProvider(profiles={
+        "stalled": ModelProfile(ttft=30.0, tokens_per_sec=1e6, output_tokens=10, jitter=0.0),
+        "fast": ModelProfile(ttft=0.0, tokens_per_sec=1e6, output_tokens=10, jitter=0.0),
+    })
+
+def _in_flight() -> int:
+    return sum(scope.in_flight for scope in client_module.governor._scopes.values())
+
+def _wait_for(predicate, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+def test_stalled_primary_is_aborted_when_backup_wins():
+    with simulated_backend(_provider()):
+        chunks = []
+        started_at = time.monotonic()
+        call_stats = {}
+        content = client_module.llm_client.get_completion(MESSAGES, stream=True, stream_callback=chunks.append,
+                                                          config=_hedged_config(), use_cache=False, call_stats=call_stats)
+        assert time.monotonic() - started_at < 5
+        assert content and "".join(chunks) == content
+        assert call_stats["hedge_winner"] == "fast"
+        # 落败的主请求应立即被关闭并释放限流额度，而不是等 30 秒后的首个 chunk
+        assert _wait_for(lambda: _in_flight() == 0)
+
+def test_consultation_cancel_still_aborts_both_legs():
+    with simulated_backend(SimulatedProvider(default_profile=ModelProfile(ttft=30.0, jitter=0.0))):
+        token = CancellationToken()
+        config = _hedged_config()
+        threading.Timer(0.2, token.set).start()
+        started_at = time.monotonic()
+        try:
+            with cancellation_scope(token):
+                client_module.llm_client.get_completion(MESSAGES, stream=True, config=config, use_cache=False)
+            raise AssertionError("expected CallCancelled")
+        except CallCancelled:
+            pass
+        assert time.monotonic() - started_at < 5
+        assert _wait_for(lambda: _in_flight() == 0)
+
+def test_exhausted_presets_raise_instead_of_returning_error_text(failing_provider):
+    config = LLMConfig(api_key="k", base_url="https://sim.invalid", model_name="primary",
+                       fallbacks=[LLMConfig(api_key="k", base_url="https://sim.invalid", model_name="fallback")])
+    for get_completion in (client_module.llm_client.get_completion,
+                           lambda *args, **kwargs: asyncio.run(client_module.async_llm_client.get_completion(*args, **kwargs))):
+        try:
+            get_completion(MESSAGES, config=config, use_cache=False)
+            raise AssertionError("expected LLMCallFailed")
+        except LLMCallFailed as e:
+            assert "Simulated provider error" in str(e.last_error)
+
+def test_async_loser_is_cancelled_as_soon_as_winner_streams():
+    events = []
+
+    async def primary(callback):
+        try:
+            await asyncio.sleep(30)
+            callback("late")
+            return "late"
+        except asyncio.CancelledError:
+            events.append("primary cancelled")
+            raise
+
+    async def backup(callback):
+        callback("first ")
+        # 获胜一路仍在输出时，落败一路应已被取消
+        await asyncio.sleep(0.05)
+        events.append("backup finished")
+        callback("done")
+        return "first done"
+
+    async def run():
+        race = AsyncHedgeRace(stream_callback=lambda chunk: None)
+        return race, await race.run(primary, backup, delay=0.01)
+
+    race, content = asyncio.run(run())
+    assert content == "first done"
+    assert race.hedged and race.winner == "backup"
+    assert events == ["primary cancelled", "backup finished"]
@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+from llm.json_stream import IncrementalJSONParser, JSONStreamError, JSONStreamWatcher
+
+UPDATE = {
+    "updated_case": {"symptoms": "咳嗽 \"3 月\"，{夜间}加重", "imaging": "HRCT 网格影", "score": 2.5e1},
+    "new_evidence": {"new_lab_results": ["ANA 1:320"], "details": {"deep": True}},
+    "done": None
+}
+
+def _members(text: str, chunk_size: int = 1, **kwargs):
+    members = []
+    parser = IncrementalJSONParser(lambda path, value: members.append((path, value)), **kwargs)
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+    return parser, members
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 1000])
+def test_reports_members_up_to_max_depth(chunk_size):
+    parser, members = _members(json.dumps(UPDATE, ensure_ascii=False), chunk_size)
+    assert parser.done
+    assert members == [
+        (("updated_case", "symptoms"), UPDATE["updated_case"]["symptoms"]),
+        (("updated_case", "imaging"), "HRCT 网格影"),
+        (("updated_case", "score"), 25.0),
+        (("updated_case",), UPDATE["updated_case"]),
+        (("new_evidence", "new_lab_results"), ["ANA 1:320"]),
+        (("new_evidence", "details"), {"deep": True}),
+        (("new_evidence",), UPDATE["new_evidence"]),
+        (("done",), None),
+    ]
+
+def test_member_is_reported_before_the_object_closes():
+    parser, members = _members('{"symptoms": "咳嗽", "imaging": "HRC')
+    assert members == [(("symptoms",), "咳嗽")]
+    assert not parser.done
+
+def test_max_depth_one_reports_only_top_level():
+    _, members = _members(json.dumps(UPDATE), max_depth=1)
+    assert [path for path, _ in members] == [("updated_case",), ("new_evidence",), ("done",)]
+
+def test_accepts_markdown_fence():
+    parser, members = _members('```json\n{"a": [1, 2], "b": {}}\n```')
+    assert parser.done
+    assert members == [(("a",), [1, 2]), (("b",), {})]
+
+@pytest.mark.parametrize("text", [
+    "好的，以下是整理结果：{",
+    '{"a" 1}',
+    '{"a": 1]',
+    '{"a": 1 "b": 2}',
+    '{"a": tru}',
+    '{"a": 1,}',
+    '{"a": 1} trailing',
+    '[{"a": 1}]',
+])
+def test_malformed_output_fails_fast(text):
+    with pytest.raises(JSONStreamError) as excinfo:
+        _members(text)
+    assert text.startswith(excinfo.value.text)
+
+def test_watcher_forwards_chunks_and_resets_parser():
+    received, resets = [], []
+
+    def callback(chunk):
+        received.append(chunk)
+    callback.reset = lambda: resets.append(True)
+
+    members = []
+    watcher = JSONStreamWatcher(callback, IncrementalJSONParser(lambda path, value: members.append(path)))
+    watcher('{"a": 1, "b": ')
+    # 流中断重试：从头解析新的输出
+    watcher.reset()
+    watcher('{"c": 2}')
+    assert received == ['{"a": 1, "b": ', '{"c": 2}']
+    assert resets == [True]
+    assert members == [("a",), ("c",)]
+    assert watcher.parser.done
+
+    with pytest.raises(JSONStreamError):
+        watcher("}")
@@ -0,0 +1,76 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+import core.checkpoint as checkpoint_module
+import core.pipeline as pipeline_module
+from benchmarks.provider import ModelProfile, SimulatedProvider, simulated_backend
+from config.settings import settings
+from core.batch import DEFAULT_AGENTS
+from core.pipeline_api import run_mdt_stream
+from core.shared_state import SharedState
+from llm.cancellation import CancellationToken
+
+@pytest.fixture
+def checkpoint_db(tmp_path, monkeypatch):
+    """每个测试使用独立的 checkpoint 库与图缓存，并以异步图驱动"""
+    monkeypatch.setattr(settings, "stream_async_graph", True)
+    monkeypatch.setattr(settings, "checkpoint_enabled", True)
+    monkeypatch.setattr(settings, "checkpoint_db_path", str(tmp_path / "checkpoints.sqlite"))
+    monkeypatch.setattr(checkpoint_module, "_checkpointer", None)
+    monkeypatch.setattr(checkpoint_module, "_checkpointer_loaded", False)
+    monkeypatch.setattr(pipeline_module, "_graph_cache", OrderedDict())
+
+def _collect(state: SharedState, **kwargs):
+    async def consume():
+        return [event async for event in run_mdt_stream(state, DEFAULT_AGENTS, **kwargs)]
+    return asyncio.run(consume())
+
+def _finished(events):
+    return [e["role"] for e in events if e["type"] == "node_finished"]
+
+def test_stream_drives_async_graph(fast_provider, checkpoint_db, monkeypatch):
+    built = []
+    original = pipeline_module.build_mdt_graph
+
+    def build_mdt_graph(enabled_agents, use_async=False, checkpointer=None):
+        built.append(use_async)
+        return original(enabled_agents, use_async=use_async, checkpointer=checkpointer)
+
+    monkeypatch.setattr(pipeline_module, "build_mdt_graph", build_mdt_graph)
+
+    state = SharedState()
+    state.add_user_input("男 62 岁，活动后气短 1 年，HRCT 双下肺网格影")
+    events = _collect(state, session_id="s1")
+
+    assert built == [True]
+    assert not [e for e in events if e["type"] == "error"]
+    assert _finished(events)[:2] == ["Case Organizer", "Moderator_Router"]
+    assert _finished(events)[-1] == "Moderator"
+    assert state.moderator_summary
+
+def test_async_stream_can_stop_and_resume(checkpoint_db):
+    provider = SimulatedProvider(default_profile=ModelProfile(ttft=0.05, tokens_per_sec=2000, output_tokens=50, jitter=0.0))
+    with simulated_backend(provider):
+        state = SharedState()
+        state.add_user_input("男 62 岁，活动后气短 1 年，HRCT 双下肺网格影")
+        stop_event = CancellationToken()
+
+        async def stop_during_specialists():
+            events = []
+            async for event in run_mdt_stream(state, DEFAULT_AGENTS, stop_event=stop_event, session_id="s2"):
+                events.append(event)
+                if event["type"] == "token" and event["role"] == "Pulmonologist":
+                    stop_event.set()
+            return events
+
+        stopped = asyncio.run(stop_during_specialists())
+        assert "Moderator" not in _finished(stopped)
+
+        resumed = _collect(state, session_id="s2", resume=True)
+        assert not [e for e in resumed if e["type"] == "error"]
+        # 已完成的节点先回放，随后只执行未完成的节点
+        assert _finished(resumed)[:2] == ["Case Organizer", "Moderator_Router"]
+        assert _finished(resumed)[-1] == "Moderator"
+        assert state.moderator_summary
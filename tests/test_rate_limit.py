@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from config.llm_config import LLMConfig, RateLimitConfig
+from llm.cancellation import CancellationToken
+from llm.rate_limit import ConcurrencyGovernor, TokenBucket
+
+def _config(**rate_limit) -> LLMConfig:
+    return LLMConfig(api_key="k", base_url="https://provider.test/v1", model_name="m",
+                     rate_limit=RateLimitConfig(**rate_limit) if rate_limit else None)
+
+def test_token_bucket_refills_at_per_minute_rate():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    assert bucket.wait_time(60, now) == 0
+    bucket.consume(60)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 1) == 0
+    # 补充不会超过容量
+    assert bucket.wait_time(60, now + 3600) == 0
+    assert bucket.tokens == 60
+
+def test_token_bucket_debt_and_oversized_requests():
+    bucket = TokenBucket(60)
+    now = bucket.updated_at
+    # 结算时实际用量超出预扣：出现欠账，需等待补齐后才能再次获取
+    bucket.consume(90)
+    assert bucket.wait_time(1, now) == pytest.approx(31.0)
+    # 单次请求超过容量时按满桶放行
+    full = TokenBucket(60)
+    assert full.wait_time(1000, full.updated_at) == 0
+
+def test_max_in_flight_blocks_until_release():
+    governor = ConcurrencyGovernor(default_provider_limit=RateLimitConfig(max_in_flight=1))
+    config = _config()
+    first = governor.acquire(config, "m", 10)
+    acquired = threading.Event()
+
+    def second():
+        governor.release(governor.acquire(config, "m", 10))
+        acquired.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not acquired.wait(0.1)
+    governor.release(first)
+    assert acquired.wait(2)
+    thread.join()
+    # 重复释放不会让在途数变为负数
+    governor.release(first)
+    assert all(scope.in_flight == 0 for scope in governor._scopes.values())
+
+def test_model_scope_applies_on_top_of_provider_scope():
+    governor = ConcurrencyGovernor()
+    limited = _config(max_in_flight=1)
+    permit = governor.acquire(limited, "m", 10)
+    assert [scope.name for scope in permit.scopes] == ["https://provider.test/v1", "m"]
+    # 同一 Provider 上不受模型限额约束的调用不受影响
+    other = governor.acquire(_config(), "other", 10)
+    governor.release(other)
+    governor.release(permit)
+
+def test_release_settles_actual_token_usage():
+    governor = ConcurrencyGovernor(default_provider_limit=RateLimitConfig(tokens_per_minute=600))
+    permit = governor.acquire(_config(), "m", 100)
+    bucket = permit.scopes[0].token_bucket
+    before = bucket.tokens
+    governor.release(permit, actual_tokens=300)
+    assert bucket.tokens == pytest.approx(before - 200, abs=1)
+
+def test_queued_acquire_is_cancelled():
+    governor = ConcurrencyGovernor(default_provider_limit=RateLimitConfig(max_in_flight=1))
+    config = _config()
+    permit = governor.acquire(config, "m", 10)
+    token = CancellationToken()
+    threading.Timer(0.05, token.set).start()
+    started = time.monotonic()
+    with pytest.raises(InterruptedError):
+        governor.acquire(config, "m", 10, token)
+    assert time.monotonic() - started < 1
+    governor.release(permit)
+
+def test_acquire_async_waits_for_request_budget():
+    governor = ConcurrencyGovernor(default_provider_limit=RateLimitConfig(requests_per_minute=600))
+    config = _config()
+
+    async def run():
+        permits = [await governor.acquire_async(config, "m", 1) for _ in range(601)]
+        for permit in permits:
+            governor.release(permit)
+        return permits
+
+    permits = asyncio.run(run())
+    # 前 600 次立即放行，第 601 次等待约 0.1 秒的补充
+    assert permits[0].queue_wait < 0.05
+    assert permits[-1].queue_wait == pytest.approx(0.1, abs=0.08)
@@ -0,0 +1,81 @@
+import pytest
+
+from agents.moderator.agent import ModeratorAgent
+from agents.moderator.routing import CONFIDENCE_ABSENT, CONFIDENCE_HIT, CONFIDENCE_UNSURE, RuleBasedRouter
+from config.settings import settings
+from core.shared_state import SharedState
+
+router = RuleBasedRouter()
+
+def _first_round(**fields) -> SharedState:
+    info = {"basic_info": "男 62 岁", "symptoms": "活动后气短 1 年", "imaging": "未提及", "pathology": "未提及", "lab_results": "未提及"}
+    info.update(fields)
+    return SharedState(round_count=1, structured_info=info)
+
+def _follow_up(**evidence) -> SharedState:
+    return SharedState(round_count=2, structured_info={"symptoms": "气短"}, new_evidence=evidence)
+
+def test_first_round_clear_case_is_confident():
+    decision = router.route(_first_round(imaging="HRCT 双下肺网格影", pathology="TBLC：UIP 模式", lab_results="ANA 1:320"))
+    assert decision.agents == ["Pulmonologist", "Radiologist", "Pathologist", "Rheumatologist"]
+    assert decision.confidence == CONFIDENCE_HIT
+    assert decision.path == "rules"
+
+def test_first_round_missing_fields_are_absent_not_unsure():
+    decision = router.route(_first_round())
+    assert decision.agents == ["Pulmonologist"]
+    assert decision.confidence == CONFIDENCE_ABSENT
+
+def test_imaging_mentioned_outside_imaging_field():
+    decision = router.route(_first_round(symptoms="气短，外院胸部 CT 提示磨玻璃影"))
+    assert "Radiologist" in decision.agents
+
+@pytest.mark.parametrize("fields", [
+    {"pathology": "拟行 TBLC"},                         # 计划中的活检
+    {"diagnosis_history": "外院曾行肺活检"},              # 病理字段缺失但其他字段提及
+    {"symptoms": "活动后气短，无关节痛，否认皮疹"},         # 只有被否定的风湿症状
+])
+def test_ambiguous_first_round_is_unsure(fields):
+    decision = router.route(_first_round(**fields))
+    assert decision.confidence == CONFIDENCE_UNSURE
+    assert "Pathologist" not in decision.agents and "Rheumatologist" not in decision.agents
+
+def test_rheumatology_lab_results_select_rheumatologist_even_when_negative():
+    decision = router.route(_first_round(lab_results="ANA 阴性，抗 Jo-1 阴性"))
+    assert "Rheumatologist" in decision.agents
+    assert decision.confidence == CONFIDENCE_ABSENT
+
+def test_empty_case_falls_back_to_llm():
+    decision = router.route(SharedState(round_count=1, structured_info={}))
+    assert decision.confidence == 0.0
+
+def test_follow_up_only_routes_new_evidence():
+    decision = router.route(_follow_up(new_imaging_info=["复查 HRCT 蜂窝影增多"], new_lab_results=[], new_pathology_info=[]))
+    assert decision.agents == ["Pulmonologist", "Radiologist"]
+    assert decision.confidence == CONFIDENCE_ABSENT
+
+def test_follow_up_keyword_classifies_other_evidence():
+    decision = router.route(_follow_up(new_lab_results=["抗 MDA5 抗体阳性"], new_symptoms_info=["新发技工手"]))
+    assert decision.agents == ["Pulmonologist", "Rheumatologist"]
+
+def test_follow_up_without_evidence_is_unsure():
+    assert router.route(_follow_up()).confidence == CONFIDENCE_UNSURE
+
+def test_unclassifiable_answer_is_unsure():
+    decision = router.route(_follow_up(answers_to_team_questions=["吸烟 30 年，已戒烟 5 年"]))
+    assert decision.confidence == CONFIDENCE_UNSURE
+    decision = router.route(_follow_up(answers_to_team_questions=["已查 ANA 1:320"]))
+    assert decision.agents == ["Pulmonologist", "Rheumatologist"]
+    assert decision.confidence == CONFIDENCE_ABSENT
+
+def test_moderator_uses_rules_only_above_threshold(monkeypatch):
+    monkeypatch.setattr(settings, "rule_router_enabled", True)
+    monkeypatch.setattr(settings, "rule_router_min_confidence", 0.8)
+    agent = ModeratorAgent()
+    assert agent._route_by_rules(_first_round(imaging="HRCT 网格影")) == ["Pulmonologist", "Radiologist"]
+    assert agent._route_by_rules(_first_round(pathology="拟行 TBLC")) is None
+    assert agent.last_routing.confidence == CONFIDENCE_UNSURE
+
+    monkeypatch.setattr(settings, "rule_router_enabled", False)
+    assert agent._route_by_rules(_first_round(imaging="HRCT 网格影")) is None
+    assert agent.last_routing is None
@@ -0,0 +1,36 @@
+import json
+
+from core.session_logger import SessionLogger
+from core.shared_state import SharedState
+
+def _legacy_round(round_index: int) -> dict:
+    return {"round_index": round_index, "timestamp": f"2026-01-0{round_index}T09:00:00", "user_input": f"旧版第 {round_index} 轮",
+            "process": {}, "output": {"summary": f"旧总结 {round_index}", "questions_to_user": []}}
+
+def test_compaction_keeps_legacy_rounds(tmp_path):
+    log_dir = tmp_path / "sessions"
+    log_dir.mkdir()
+    # 改用 JSONL 之前的日志：整个会话写在 {session_id}.json 中
+    with open(log_dir / "s1.json", "w", encoding="utf-8") as f:
+        json.dump({"session_id": "s1", "created_at": "2026-01-01T09:00:00", "last_updated": "2026-01-02T09:00:00",
+                   "rounds": [_legacy_round(1), _legacy_round(2)]}, f, ensure_ascii=False)
+    logger = SessionLogger(log_dir=str(log_dir), flush_interval=0)
+    assert logger.session_ids() == ["s1"]
+
+    # 升级后重做第 2 轮并继续第 3 轮
+    state = SharedState(round_count=2, raw_case_text="新版第 2 轮", moderator_summary="新总结 2")
+    logger.save_round("s1", state)
+    logger.save_round("s1", state.model_copy(update={"round_count": 3, "raw_case_text": "新版第 3 轮"}))
+
+    compacted = logger.compact("s1")
+    assert [r["user_input"] for r in compacted["rounds"]] == ["旧版第 1 轮", "新版第 2 轮", "新版第 3 轮"]
+    assert compacted["created_at"] == "2026-01-01T09:00:00"
+
+    # 写出合并结果 (覆盖旧版文件) 后再次合并不会丢失轮次
+    assert logger.write_compacted("s1") == str(log_dir / "s1.json")
+    assert logger.compact("s1")["rounds"] == compacted["rounds"]
+
+    logger.delete_session("s1")
+    logger.flush()
+    assert logger.compact("s1")["rounds"] == []
+    assert logger.session_ids() == []
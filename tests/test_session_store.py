@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from core.session_store import SessionStore, SQLiteSessionStore, InMemorySessionStore
+from core.shared_state import SharedState
+
+class _DictBackend(SessionStore):
+    """记录写入次数的内存后端；put_gate 未放行时 put 阻塞 (模拟慢速后端)"""
+    def __init__(self):
+        self.data = {}
+        self.puts = []
+        self.put_gate = threading.Event()
+        self.put_gate.set()
+        self.fail = False
+
+    def get(self, session_id):
+        payload = self.data.get(session_id)
+        return SharedState.model_validate_json(payload) if payload else None
+
+    def put(self, session_id, state):
+        self.put_gate.wait(5)
+        if self.fail:
+            raise OSError("backend down")
+        self.puts.append(session_id)
+        self.data[session_id] = state.model_dump_json()
+
+    def delete(self, session_id):
+        self.data.pop(session_id, None)
+
+def _state(text: str) -> SharedState:
+    return SharedState(raw_case_text=text)
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+def test_lru_eviction_without_backend():
+    store = InMemorySessionStore(max_entries=2, ttl_seconds=None)
+    store.put("a", _state("a"))
+    store.put("b", _state("b"))
+    store.get("a")  # a 成为最近访问
+    store.put("c", _state("c"))
+    assert len(store) == 2
+    assert store.get("b") is None
+    assert store.get("a").raw_case_text == "a"
+
+def test_ttl_expiry():
+    store = InMemorySessionStore(max_entries=10, ttl_seconds=0.05)
+    store.put("a", _state("a"))
+    time.sleep(0.1)
+    assert store.get("a") is None
+    assert len(store) == 0
+
+def test_spill_and_rehydrate():
+    backend = _DictBackend()
+    store = InMemorySessionStore(max_entries=1, ttl_seconds=None, backend=backend)
+    store.put("a", _state("a"))
+    store.put("b", _state("b"))
+    assert len(store) == 1
+    assert "a" in store
+    assert store.get("a").raw_case_text == "a"
+    # 重新加载 a 时 b 被淘汰并写入后端
+    assert backend.get("b").raw_case_text == "b"
+
+def test_leased_session_is_not_evicted():
+    backend = _DictBackend()
+    store = InMemorySessionStore(max_entries=1, ttl_seconds=None, backend=backend)
+    store.put("a", _state("a"))
+    with store.lease("a") as state:
+        store.put("b", _state("b"))
+        store.put("c", _state("c"))
+        state.raw_case_text = "a2"
+        assert store.get("a") is state
+    # release 时写回最新状态，随后按容量淘汰
+    assert backend.get("a").raw_case_text == "a2"
+    assert len(store) == 1
+
+def test_backend_failure_does_not_raise():
+    backend = _DictBackend()
+    backend.fail = True
+    store = InMemorySessionStore(max_entries=1, ttl_seconds=None, backend=backend)
+    store.put("a", _state("a"))
+    store.put("b", _state("b"))
+    assert store.get("b").raw_case_text == "b"
+
+def test_slow_backend_write_does_not_block_other_sessions():
+    backend = _DictBackend()
+    store = InMemorySessionStore(max_entries=10, ttl_seconds=None, backend=backend)
+    store.put("a", _state("a"))
+    backend.put_gate.clear()
+    writer = threading.Thread(target=store.put, args=("b", _state("b")))
+    writer.start()
+    try:
+        time.sleep(0.05)
+        started = time.monotonic()
+        assert store.get("a").raw_case_text == "a"
+        assert store.get("b").raw_case_text == "b"
+        assert time.monotonic() - started < 1
+    finally:
+        backend.put_gate.set()
+        writer.join()
+    assert backend.get("b").raw_case_text == "b"
+
+def test_sqlite_backend_survives_restart(tmp_path):
+    db_path = str(tmp_path / "sessions.sqlite")
+    store = InMemorySessionStore(backend=SQLiteSessionStore(db_path))
+    store.put("a", _state("a"))
+    restarted = InMemorySessionStore(backend=SQLiteSessionStore(db_path))
+    assert restarted.get("a").raw_case_text == "a"
+    restarted.delete("a")
+    assert "a" not in InMemorySessionStore(backend=SQLiteSessionStore(db_path))
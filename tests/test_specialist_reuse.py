@@ -0,0 +1,46 @@
+from agents.radiologist.agent import RadiologistAgent
+from agents.specialist import ERROR_SUMMARY
+from core.nodes.specialists import specialist_node_factory
+from core.shared_state import SharedState
+
+CASE = {"basic_info": "男 62 岁", "imaging": "HRCT 网格影", "key_questions": "诊断"}
+
+def _state(**kwargs) -> SharedState:
+    return SharedState(round_count=2, structured_info=dict(CASE), **kwargs)
+
+def test_reuses_previous_opinion_when_inputs_unchanged():
+    agent = RadiologistAgent()
+    state = _state()
+    state.specialist_fingerprints = {"Radiologist": agent.input_fingerprint(state)}
+    state.specialist_opinions = {"Radiologist": "UIP 模式"}
+    state.specialist_summaries = {"Radiologist": "UIP"}
+    assert agent.reuse_previous(state) == {"content": "UIP 模式", "summary": "UIP"}
+
+def test_failed_previous_opinion_is_not_reused():
+    agent = RadiologistAgent()
+    state = _state()
+    state.specialist_fingerprints = {"Radiologist": agent.input_fingerprint(state)}
+    state.specialist_opinions = {"Radiologist": "影像分析过程中发生错误: timeout"}
+    state.specialist_summaries = {"Radiologist": "分析出错"}
+    assert agent.reuse_previous(state) is None
+
+    state.specialist_opinions = {"Radiologist": "[Error] LLM 调用失败: timeout"}
+    state.specialist_summaries = {"Radiologist": "[Error] LLM 调用失败: timeout"}
+    assert agent.reuse_previous(state) is None
+
+def test_failed_run_clears_fingerprint(failing_provider):
+    node = specialist_node_factory(RadiologistAgent, "Radiologist")
+    state = _state()
+    # 上一轮成功时留下的指纹不能保留，否则下一轮会把本轮的错误当作缓存沿用
+    state.specialist_fingerprints = {"Radiologist": "stale"}
+    output = node(state.model_dump())
+    assert "LLM 调用失败" in output["specialist_opinions"]["Radiologist"]
+    assert output["specialist_summaries"]["Radiologist"] == ERROR_SUMMARY
+    assert output["agent_status"] == {"Radiologist": "error"}
+    assert output["specialist_fingerprints"] == {"Radiologist": ""}
+
+def test_successful_run_records_fingerprint(fast_provider):
+    node = specialist_node_factory(RadiologistAgent, "Radiologist")
+    state = _state()
+    output = node(state.model_dump())
+    assert output["specialist_fingerprints"]["Radiologist"] == RadiologistAgent().input_fingerprint(state)
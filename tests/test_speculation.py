@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+import llm.client as client_module
+from agents.radiologist.agent import RadiologistAgent
+from benchmarks.provider import ModelProfile, SimulatedProvider, simulated_backend
+from core.shared_state import SharedState
+from core.speculation import SpeculativeRun
+from llm.cancellation import CancellationToken, cancellation_scope
+
+STATE = SharedState(round_count=1, structured_info={"imaging": "HRCT 网格影"})
+
+@pytest.fixture
+def stalled_provider():
+    """首 Token 要 30 秒才到的 Provider：模拟卡住的流"""
+    with simulated_backend(SimulatedProvider(default_profile=ModelProfile(ttft=30.0, jitter=0.0))) as provider:
+        yield provider
+
+def _in_flight() -> int:
+    return sum(scope.in_flight for scope in client_module.governor._scopes.values())
+
+def _started(run: SpeculativeRun) -> bool:
+    deadline = time.monotonic() + 2
+    while _in_flight() == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return _in_flight() > 0
+
+def test_cancel_closes_stalled_stream(stalled_provider):
+    run = SpeculativeRun("Radiologist", RadiologistAgent())
+    run.start(STATE)
+    assert _started(run)
+    run.cancel()
+    with pytest.raises(InterruptedError):
+        run.future.result(timeout=2)
+    assert _in_flight() == 0
+
+def test_consultation_cancel_reaches_speculative_run(stalled_provider):
+    token = CancellationToken()
+    run = SpeculativeRun("Radiologist", RadiologistAgent())
+    with cancellation_scope(token):
+        run.start(STATE)
+    assert _started(run)
+    token.set()
+    with pytest.raises(InterruptedError):
+        run.future.result(timeout=2)